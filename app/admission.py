@@ -0,0 +1,250 @@
+# Admission control of new submissions by backlog, free disk space and per-client quotas.
+
+# app/admission.py
+
+import os
+import json
+import math
+import time
+import logging
+from typing import Callable
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from app.config import (
+    INPUT_DIR, OUTPUT_DIR, ADMISSION_MAX_QUEUE_DEPTH, ADMISSION_MAX_OUTSTANDING_PAGES, ADMISSION_MIN_FREE_BYTES, ADMISSION_CLIENT_HEADER,
+    ADMISSION_CLIENT_MAX_TASKS, ADMISSION_CLIENT_MAX_PAGES, ADMISSION_THROUGHPUT_WINDOW, ADMISSION_RETRY_AFTER_MIN, ADMISSION_RETRY_AFTER_MAX,
+    ADMISSION_RETRY_AFTER_DEFAULT, STORAGE_RETENTION_SECONDS
+)
+from app.redis_client import get_redis
+from app.scheduling import analysis_queues
+from app.storage import disk_usage
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_PREFIX = "mineru:admission"
+TASKS_KEY = f"{ADMISSION_PREFIX}:tasks"
+PAGES_KEY = f"{ADMISSION_PREFIX}:pages"
+CLIENT_KEY_PREFIX = f"{ADMISSION_PREFIX}:client"
+# Pages finished per minute, for the throughput behind Retry-After
+FINISHED_KEY_PREFIX = f"{ADMISSION_PREFIX}:finished"
+# The same per worker process, and the seconds each spent running analyses, in one hash per minute
+WORKER_FINISHED_KEY_PREFIX = f"{ADMISSION_PREFIX}:finished-by-worker"
+WORKER_BUSY_KEY_PREFIX = f"{ADMISSION_PREFIX}:busy-by-worker"
+FINISHED_BUCKET_SECONDS = 60
+MAX_CLIENT_ID_LENGTH = 128
+
+# Why a submission was turned away
+REASON_QUEUE_DEPTH = "queue_depth"
+REASON_OUTSTANDING_PAGES = "outstanding_pages"
+REASON_DISK_SPACE = "disk_space"
+REASON_CLIENT_QUOTA = "client_quota"
+
+
+def client_id(headers, client_host: str | None) -> str:
+    """
+    Who a submission counts against: the ADMISSION_CLIENT_HEADER value when the client sends
+    one, its address otherwise.
+    """
+    value = (headers.get(ADMISSION_CLIENT_HEADER) or "").strip()
+    return (value or client_host or "unknown")[:MAX_CLIENT_ID_LENGTH]
+
+
+class AdmissionController:
+    """
+    Decides whether a new submission is accepted. Every analysis that is published is recorded
+    with its page count and client until it succeeds or fails for good, which gives the pages
+    outstanding overall and per client; finished pages are counted per minute, which gives the
+    recent throughput. Retry-After is the time that throughput needs to work off the part of the
+    backlog above the threshold that was hit.
+    """
+
+    def __init__(self, queues: Callable[[], list[str]] = analysis_queues, max_queue_depth: int = ADMISSION_MAX_QUEUE_DEPTH,
+                 max_outstanding_pages: int = ADMISSION_MAX_OUTSTANDING_PAGES, min_free_bytes: int = ADMISSION_MIN_FREE_BYTES,
+                 client_max_tasks: int = ADMISSION_CLIENT_MAX_TASKS, client_max_pages: int = ADMISSION_CLIENT_MAX_PAGES,
+                 throughput_window: int = ADMISSION_THROUGHPUT_WINDOW):
+        self.queues = queues
+        self.max_queue_depth = max_queue_depth
+        self.max_outstanding_pages = max_outstanding_pages
+        self.min_free_bytes = min_free_bytes
+        self.client_max_tasks = client_max_tasks
+        self.client_max_pages = client_max_pages
+        self.throughput_window = throughput_window
+
+    @property
+    def redis(self):
+        return get_redis()
+
+    def check(self, client: str):
+        """
+        Raises an HTTPException with a Retry-After header when a submission from `client` should
+        not be accepted now: 429 when the client is over its quota, 503 when the service is.
+        """
+        if self.client_max_tasks or self.client_max_pages:
+            usage = self.client_usage(client)
+            if self.client_max_tasks and usage["tasks"] >= self.client_max_tasks:
+                excess_pages = (usage["tasks"] - self.client_max_tasks + 1) * usage["pages"] / max(usage["tasks"], 1)
+                self._reject(429, REASON_CLIENT_QUOTA, excess_pages, f"You already have {usage['tasks']} tasks outstanding, the most one client may have.")
+            if self.client_max_pages and usage["pages"] >= self.client_max_pages:
+                self._reject(429, REASON_CLIENT_QUOTA, usage["pages"] - self.client_max_pages + 1, f"You already have {usage['pages']} pages outstanding, the most one client may have.")
+
+        data_dirs = [path for path in {INPUT_DIR, OUTPUT_DIR} if os.path.isdir(path)]
+        if self.min_free_bytes and data_dirs:
+            free_bytes = min(disk_usage(path)["free_bytes"] for path in data_dirs)
+            if free_bytes < self.min_free_bytes:
+                self._reject(503, REASON_DISK_SPACE, None, "The service is low on disk space. Please retry later.")
+
+        if self.max_outstanding_pages:
+            pages = self.outstanding_pages()
+            if pages >= self.max_outstanding_pages:
+                self._reject(503, REASON_OUTSTANDING_PAGES, pages - self.max_outstanding_pages + 1, f"The service has {pages} pages waiting to be analyzed. Please retry later.")
+
+        if self.max_queue_depth:
+            depth = sum(metrics.queue_depths(self.queues()).values())
+            if depth >= self.max_queue_depth:
+                tasks = self.redis.hlen(TASKS_KEY)
+                excess_pages = (depth - self.max_queue_depth + 1) * self.outstanding_pages() / max(tasks, 1)
+                self._reject(503, REASON_QUEUE_DEPTH, excess_pages, f"The service has {depth} tasks queued. Please retry later.")
+
+    def _reject(self, status_code: int, reason: str, excess_pages: float | None, detail: str):
+        retry_after = self.retry_after(excess_pages)
+        metrics.ADMISSION_REJECTIONS.labels(reason=reason).inc()
+        logger.warning(f"Submission turned away ({reason}), retry after {retry_after}s: {detail}")
+        raise HTTPException(status_code=status_code, detail=detail, headers={"Retry-After": str(retry_after)})
+
+    def retry_after(self, excess_pages: float | None) -> int:
+        throughput = self.throughput() if excess_pages else 0.0
+        seconds = excess_pages / throughput if throughput else ADMISSION_RETRY_AFTER_DEFAULT
+        return min(max(math.ceil(seconds), ADMISSION_RETRY_AFTER_MIN), ADMISSION_RETRY_AFTER_MAX)
+
+    def throughput(self) -> float:
+        """
+        Pages per second finished over the last `throughput_window` seconds.
+        """
+        now_bucket = int(time.time()) // FINISHED_BUCKET_SECONDS
+        buckets = max(self.throughput_window // FINISHED_BUCKET_SECONDS, 1)
+        counts = self.redis.mget([f"{FINISHED_KEY_PREFIX}:{now_bucket - offset}" for offset in range(buckets)])
+        return sum(int(count) for count in counts if count) / (buckets * FINISHED_BUCKET_SECONDS)
+
+    def worker_activity(self) -> dict[str, dict]:
+        """
+        Pages each worker process finished and seconds it spent running analyses over the last
+        `throughput_window` seconds; processes that did neither are left out.
+        """
+        now_bucket = int(time.time()) // FINISHED_BUCKET_SECONDS
+        buckets = max(self.throughput_window // FINISHED_BUCKET_SECONDS, 1)
+        pipe = self.redis.pipeline(transaction=False)
+        for offset in range(buckets):
+            pipe.hgetall(f"{WORKER_FINISHED_KEY_PREFIX}:{now_bucket - offset}")
+            pipe.hgetall(f"{WORKER_BUSY_KEY_PREFIX}:{now_bucket - offset}")
+        activity: dict[str, dict] = {}
+        for index, bucket in enumerate(pipe.execute()):
+            field = "busy_seconds" if index % 2 else "pages"
+            for worker, value in bucket.items():
+                entry = activity.setdefault(worker, {"pages": 0, "busy_seconds": 0.0})
+                entry[field] += float(value) if index % 2 else int(value)
+        return activity
+
+    def record_busy(self, worker: str, seconds: float):
+        """
+        Adds `seconds` a worker process spent on an analysis task, whatever its outcome. Shards
+        count here for the process that ran them, their pages for the one that merged them.
+        """
+        busy_key = f"{WORKER_BUSY_KEY_PREFIX}:{int(time.time()) // FINISHED_BUCKET_SECONDS}"
+        pipe = self.redis.pipeline()
+        pipe.hincrbyfloat(busy_key, worker, seconds)
+        pipe.expire(busy_key, self.throughput_window + FINISHED_BUCKET_SECONDS)
+        pipe.execute()
+
+    def outstanding_pages(self) -> int:
+        return max(int(self.redis.get(PAGES_KEY) or 0), 0)
+
+    def client_usage(self, client: str) -> dict:
+        usage = self.redis.hgetall(f"{CLIENT_KEY_PREFIX}:{client}")
+        return {"tasks": max(int(usage.get("tasks", 0)), 0), "pages": max(int(usage.get("pages", 0)), 0)}
+
+    def admit(self, task_id: str, pages: int, client: str):
+        """
+        Records a published analysis of `pages` pages as outstanding for `client`.
+        """
+        pipe = self.redis.pipeline()
+        pipe.hset(TASKS_KEY, task_id, json.dumps({"pages": pages, "client": client, "submitted_at": time.time()}))
+        pipe.incrby(PAGES_KEY, pages)
+        pipe.hincrby(f"{CLIENT_KEY_PREFIX}:{client}", "tasks", 1)
+        pipe.hincrby(f"{CLIENT_KEY_PREFIX}:{client}", "pages", pages)
+        pipe.execute()
+
+    def release(self, task_id: str, finished: bool = True, worker: str | None = None) -> int:
+        """
+        Takes a task off the outstanding work, once, and returns its pages. Pages of `finished`
+        tasks count towards the throughput, and that of the `worker` process that ran them;
+        successes and permanent failures both drain the backlog.
+        """
+        raw = self.redis.hget(TASKS_KEY, task_id)
+        # Only the caller whose delete succeeds releases it, so a task is never subtracted twice.
+        if not raw or not self.redis.hdel(TASKS_KEY, task_id):
+            return 0
+        entry = json.loads(raw)
+        pages, client_key = entry["pages"], f"{CLIENT_KEY_PREFIX}:{entry['client']}"
+        pipe = self.redis.pipeline()
+        pipe.decrby(PAGES_KEY, pages)
+        pipe.hincrby(client_key, "tasks", -1)
+        pipe.hincrby(client_key, "pages", -pages)
+        if finished:
+            bucket_key = f"{FINISHED_KEY_PREFIX}:{int(time.time()) // FINISHED_BUCKET_SECONDS}"
+            pipe.incrby(bucket_key, pages)
+            pipe.expire(bucket_key, self.throughput_window + FINISHED_BUCKET_SECONDS)
+            if worker:
+                worker_key = f"{WORKER_FINISHED_KEY_PREFIX}:{int(time.time()) // FINISHED_BUCKET_SECONDS}"
+                pipe.hincrby(worker_key, worker, pages)
+                pipe.expire(worker_key, self.throughput_window + FINISHED_BUCKET_SECONDS)
+        pipe.execute()
+        return pages
+
+    def prune(self, max_age_seconds: int = STORAGE_RETENTION_SECONDS) -> int:
+        """
+        Releases tasks recorded longer ago than `max_age_seconds`: their end went unnoticed, e.g.
+        a chord whose shard failed or a task killed by its hard time limit.
+        """
+        cutoff = time.time() - max_age_seconds
+        stale = [
+            task_id for task_id, raw in self.redis.hscan_iter(TASKS_KEY)
+            if json.loads(raw).get("submitted_at", 0) < cutoff
+        ]
+        for task_id in stale:
+            self.release(task_id, finished=False)
+        if stale:
+            logger.info(f"Released {len(stale)} stale tasks from admission control.")
+        return len(stale)
+
+
+admission = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """
+    Runs admission control on POSTs to `paths` before their body is read, so rejected uploads
+    cost neither bandwidth nor disk. When Redis cannot be reached, submissions are let through.
+    """
+
+    def __init__(self, app, paths: tuple[str, ...], controller: AdmissionController = admission):
+        self.app = app
+        self.paths = paths
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope.get("path") not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        client = client_id(Headers(scope=scope), (scope.get("client") or (None,))[0])
+        try:
+            await run_in_threadpool(self.controller.check, client)
+        except HTTPException as e:
+            await JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers)(scope, receive, send)
+            return
+        except Exception:
+            logger.warning("Admission control failed, letting the submission through.", exc_info=True)
+        await self.app(scope, receive, send)
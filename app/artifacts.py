@@ -0,0 +1,189 @@
+# Serving single result artifacts with conditional GET and compression, instead of the whole ZIP.
+
+# app/artifacts.py
+
+import os
+import json
+import zlib
+import hashlib
+from functools import lru_cache
+from typing import Iterator
+from fastapi.responses import Response, FileResponse, StreamingResponse
+from app.process_pdf import stream_lines
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is offered
+    brotli = None
+
+CHUNK_SIZE = 64 * 1024
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Artifact name in the URL -> (key in the result's generated_files, media type)
+ARTIFACTS = {
+    "markdown": ("markdown", "text/markdown; charset=utf-8"),
+    "content_list": ("content_list_json", "application/json"),
+    "middle_json": ("middle_json", "application/json"),
+    "model_json": ("model_json", "application/json"),
+    "content_stream": ("content_stream", "application/x-ndjson"),
+}
+IMAGE_MEDIA_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".gif": "image/gif", ".webp": "image/webp"}
+
+
+def file_etag(path: str) -> str:
+    # Weak, because the same entity is served under several content codings.
+    stat = os.stat(path)
+    digest = hashlib.sha1(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == bare for candidate in if_none_match.split(","))
+
+
+def negotiate_encoding(accept_encoding: str | None) -> str | None:
+    """
+    Picks br (when available) or gzip from an Accept-Encoding header, honouring q=0.
+    """
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    for coding in (("br", "gzip") if brotli else ("gzip",)):
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+def _compress(chunks: Iterator[bytes], encoding: str) -> Iterator[bytes]:
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31 writes the gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _iter_file(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            yield chunk
+
+
+def _cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+
+
+def file_response(path: str, media_type: str, if_none_match: str | None, accept_encoding: str | None, compressible: bool = True) -> Response:
+    """
+    Serves a file with an ETag, answering 304 when the client's copy is current and streaming
+    it through gzip or brotli when the client accepts one and the file is worth compressing.
+    """
+    etag = file_etag(path)
+    headers = _cache_headers(etag)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    encoding = negotiate_encoding(accept_encoding) if compressible and os.path.getsize(path) >= COMPRESS_MIN_BYTES else None
+    if encoding is None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    headers["Content-Encoding"] = encoding
+    return StreamingResponse(_compress(_iter_file(path), encoding), media_type=media_type, headers=headers)
+
+
+def json_response(payload, etag: str, if_none_match: str | None, accept_encoding: str | None) -> Response:
+    headers = _cache_headers(etag)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    encoding = negotiate_encoding(accept_encoding) if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding:
+        body = b"".join(_compress(iter([body]), encoding))
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def image_file_path(output_dir: str, image_path: str) -> str | None:
+    """
+    Maps an image path from the Markdown or content list (`images/<name>` or just `<name>`) to
+    a path inside the task's image directory. Anything that escapes that directory is refused.
+    The file itself may not exist (yet) on this node.
+    """
+    image_dir = os.path.realpath(os.path.join(output_dir, "images"))
+    relative = image_path.removeprefix("images/")
+    candidate = os.path.realpath(os.path.join(image_dir, relative))
+    if candidate == image_dir or os.path.commonpath([candidate, image_dir]) != image_dir:
+        return None
+    return candidate
+
+
+def image_media_type(path: str) -> str:
+    return IMAGE_MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+
+
+@lru_cache(maxsize=8)
+def _content_list_by_page(path: str, mtime_ns: int) -> tuple[dict[int, list], int]:
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    pages: dict[int, list] = {}
+    for item in items:
+        pages.setdefault(item.get("page_idx", 0), []).append(item)
+    return pages, (max(pages) + 1 if pages else 0)
+
+
+def content_list_pages(path: str, start_page: int, end_page: int, total_pages: int | None = None) -> dict:
+    """
+    Returns the content list items of pages `start_page`..`end_page` (0-based, inclusive). The
+    parsed file is kept for the few most recently used documents, so paging through a large
+    document parses it only once.
+    """
+    pages, pages_with_content = _content_list_by_page(path, os.stat(path).st_mtime_ns)
+    total_pages = total_pages or pages_with_content
+    end_page = min(end_page, total_pages - 1)
+    items = [item for page in range(start_page, end_page + 1) for item in pages.get(page, [])]
+    return {
+        "start_page": start_page,
+        "end_page": end_page,
+        "total_pages": total_pages,
+        "next_start_page": end_page + 1 if end_page + 1 < total_pages else None,
+        "items": items,
+    }
+
+
+def content_stream_chunk(data: bytes, offset: int) -> tuple[bytes, int]:
+    """
+    Returns the complete lines of `data`, read from a content stream at byte `offset`, and the
+    offset after them. A line that is still being written is left for the next read.
+    """
+    end = data.rfind(b"\n") + 1
+    return data[:end], offset + end
+
+
+def content_stream_from_list(path: str, start_page: int, end_page: int) -> bytes:
+    """
+    Builds the content stream of a task that was not streamed from its content list.
+    """
+    pages, _ = _content_list_by_page(path, os.stat(path).st_mtime_ns)
+    return "".join(stream_lines(pages, start_page, end_page)).encode("utf-8")
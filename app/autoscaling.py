@@ -0,0 +1,69 @@
+# Backlog and throughput figures for sizing the worker fleet from outside.
+
+# app/autoscaling.py
+
+import math
+from app.config import (
+    AUTOSCALE_TARGET_DRAIN_SECONDS, AUTOSCALE_MIN_WORKERS, AUTOSCALE_MAX_WORKERS, AUTOSCALE_FALLBACK_PAGES_PER_SECOND
+)
+from app.admission import AdmissionController, admission, TASKS_KEY
+from app.model_warmup import list_worker_states
+from app.scheduling import analysis_queues
+from app import metrics
+
+
+def recommended_workers(backlog_pages: int, pages_per_second_per_worker: float, target_drain_seconds: int = AUTOSCALE_TARGET_DRAIN_SECONDS,
+                        min_workers: int = AUTOSCALE_MIN_WORKERS, max_workers: int = AUTOSCALE_MAX_WORKERS) -> int:
+    """
+    The worker processes needed to finish `backlog_pages` within `target_drain_seconds`, each
+    finishing `pages_per_second_per_worker`, kept between `min_workers` and `max_workers`.
+    """
+    if backlog_pages <= 0 or pages_per_second_per_worker <= 0:
+        needed = 0
+    else:
+        needed = math.ceil(backlog_pages / (pages_per_second_per_worker * max(target_drain_seconds, 1)))
+    return min(max(needed, min_workers), max(max_workers, min_workers))
+
+
+def autoscaling_report(controller: AdmissionController = admission) -> dict:
+    """
+    Pages outstanding, tasks queued, what each worker process finished recently and how many
+    processes would drain the backlog within AUTOSCALE_TARGET_DRAIN_SECONDS. A process's rate is
+    its pages over the seconds it spent running analyses, so idle time does not drag it down;
+    the rate used for sizing pools all processes, since the pages of a sharded document are
+    credited to the one that merged it and its busy time to those that ran the shards.
+    """
+    backlog_pages = controller.outstanding_pages()
+    activity = controller.worker_activity()
+    workers = list_worker_states()
+    pages = sum(entry["pages"] for entry in activity.values())
+    busy_seconds = sum(entry["busy_seconds"] for entry in activity.values())
+    if pages and busy_seconds:
+        per_worker, rate_source = pages / busy_seconds, "measured"
+    else:
+        per_worker, rate_source = AUTOSCALE_FALLBACK_PAGES_PER_SECOND, "fallback"
+    total = controller.throughput()
+    # At the current pace; unknown while a backlog waits and nothing has finished lately
+    drain_seconds = math.ceil(backlog_pages / total) if total else (None if backlog_pages else 0)
+    return {
+        "backlog_pages": backlog_pages,
+        "backlog_tasks": controller.redis.hlen(TASKS_KEY),
+        "queued_tasks": metrics.queue_depths(analysis_queues()),
+        "throughput_window_seconds": controller.throughput_window,
+        "pages_per_second": round(total, 4),
+        "pages_per_second_per_worker": round(per_worker, 4),
+        "rate_source": rate_source,
+        "workers": {
+            worker: {
+                "pages": entry["pages"],
+                "busy_seconds": round(entry["busy_seconds"], 3),
+                "pages_per_second": round(entry["pages"] / entry["busy_seconds"], 4) if entry["busy_seconds"] else None,
+            }
+            for worker, entry in sorted(activity.items())
+        },
+        "current_workers": len(workers),
+        "ready_workers": sum(1 for worker in workers if worker.get("ready")),
+        "estimated_drain_seconds": drain_seconds,
+        "target_drain_seconds": AUTOSCALE_TARGET_DRAIN_SECONDS,
+        "recommended_workers": recommended_workers(backlog_pages, per_worker),
+    }
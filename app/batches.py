@@ -0,0 +1,99 @@
+# Batch submission support: unpacking multi-file uploads and tracking the tasks of a batch.
+
+# app/batches.py
+
+import os
+import json
+import time
+import tarfile
+import zipfile
+import logging
+from typing import BinaryIO, Iterator
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+BATCH_KEY_PREFIX = "mineru:batch"
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def iter_archive_pdfs(filename: str, fileobj: BinaryIO) -> Iterator[tuple[str, BinaryIO]]:
+    """
+    Yields (basename, file object) for every PDF inside a zip or tar archive, streaming each
+    member instead of extracting the archive. Directory components are dropped.
+    """
+    if filename.lower().endswith(".zip"):
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or not name.lower().endswith(".pdf") or info.filename.startswith("__MACOSX/"):
+                    continue
+                with archive.open(info) as member:
+                    yield name, member
+    else:
+        with tarfile.open(fileobj=fileobj, mode="r:*") as archive:
+            for info in archive:
+                name = os.path.basename(info.name)
+                if not info.isfile() or not name.lower().endswith(".pdf"):
+                    continue
+                member = archive.extractfile(info)
+                if member is not None:
+                    with member:
+                        yield name, member
+
+
+def unique_filename(filename: str, used: set[str]) -> str:
+    name, ext = os.path.splitext(filename)
+    candidate, counter = filename, 1
+    while candidate in used:
+        counter += 1
+        candidate = f"{name}_{counter}{ext}"
+    used.add(candidate)
+    return candidate
+
+
+def save_batch(batch_id: str, tasks: list[dict], ttl_seconds: int):
+    manifest = {"batch_id": batch_id, "created_at": time.time(), "tasks": tasks}
+    get_redis().set(f"{BATCH_KEY_PREFIX}:{batch_id}", json.dumps(manifest), ex=ttl_seconds)
+
+
+def load_batch(batch_id: str) -> dict | None:
+    raw = get_redis().get(f"{BATCH_KEY_PREFIX}:{batch_id}")
+    return json.loads(raw) if raw else None
+
+
+def summarize_batch(manifest: dict, states: dict[str, str]) -> dict:
+    """
+    Aggregates the per-task states of a batch into counts, progress and an overall status.
+    """
+    counts: dict[str, int] = {}
+    for state in states.values():
+        counts[state] = counts.get(state, 0) + 1
+
+    total = len(manifest["tasks"])
+    succeeded = counts.get("SUCCESS", 0)
+    failed = counts.get("FAILURE", 0) + counts.get("REVOKED", 0)
+    completed = succeeded + failed
+    if completed < total:
+        status = "PENDING" if counts.get("PENDING", 0) == total else "PROGRESS"
+    else:
+        status = "SUCCESS" if failed == 0 else ("FAILURE" if succeeded == 0 else "PARTIAL_FAILURE")
+
+    return {
+        "batch_id": manifest["batch_id"],
+        "status": status,
+        "total": total,
+        "completed": completed,
+        "succeeded": succeeded,
+        "failed": failed,
+        "progress": completed / total if total else 1.0,
+        "counts": counts,
+        "tasks": [
+            {**task, "status": states.get(task["task_id"], "PENDING")}
+            for task in manifest["tasks"]
+        ]
+    }
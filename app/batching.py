@@ -0,0 +1,112 @@
+# Micro-batching of model inference across the documents a worker process is analyzing at the same time.
+
+# app/batching.py
+
+import time
+import logging
+import threading
+from magic_pdf.model.doc_analyze_by_custom_model import batch_doc_analyze
+from app.config import (
+    MICRO_BATCH_SIZE, MICRO_BATCH_WAIT_MS, MICRO_BATCH_MAX_PAGES, MICRO_BATCH_TIMEOUT_SECONDS,
+    DOCUMENT_ISOLATION
+)
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    def __init__(self):
+        self.datasets = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.model_lists: list[list] | None = None
+
+
+class InferenceBatcher:
+    """
+    Collects the documents that tasks running in threads of this process want analyzed and runs
+    them through the models as one batch_doc_analyze call, so small documents fill the model
+    batches instead of each paying the per-call overhead. The first task to arrive waits up to
+    `max_wait_seconds` for `max_size` documents and then runs the batch for all of them; the
+    others wait for their share of the results. Batches run one at a time, and a batch keeps
+    taking documents until its turn comes, so documents arriving while the models are busy
+    form the next batch. Documents are only batched with others that use the same models (OCR
+    or not). When the batch fails, every member gets None and analyzes its document on its own,
+    so one broken PDF only fails its own task. The same happens to a task that has waited
+    `timeout_seconds` for its batch, so a batch that hangs does not take every task waiting on
+    it along until the hang guard (app/hang_guard.py) steps in.
+    """
+
+    def __init__(self, max_size: int = MICRO_BATCH_SIZE, max_wait_seconds: float = MICRO_BATCH_WAIT_MS / 1000,
+                 max_pages: int = MICRO_BATCH_MAX_PAGES, timeout_seconds: float = MICRO_BATCH_TIMEOUT_SECONDS):
+        self.max_size = max_size
+        self.max_wait_seconds = max_wait_seconds
+        self.max_pages = max_pages
+        self.timeout_seconds = timeout_seconds
+        self._open: dict[bool, _Batch] = {}
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        # A forked document child has nobody to batch with.
+        return self.max_size > 1 and not DOCUMENT_ISOLATION
+
+    def accepts(self, ds, start_page: int, end_page: int) -> bool:
+        # batch_doc_analyze always analyzes every page of a document.
+        return self.enabled and start_page == 0 and end_page == len(ds) - 1 and len(ds) <= self.max_pages
+
+    def analyze(self, ds, is_ocr: bool) -> list | None:
+        """
+        Returns the model list of all pages of `ds`, as doc_analyze would, once the batch it
+        joined has run, or None when the batch failed.
+        """
+        with self._lock:
+            batch = self._open.get(is_ocr)
+            leader = batch is None
+            if leader:
+                batch = self._open[is_ocr] = _Batch()
+            index = len(batch.datasets)
+            batch.datasets.append(ds)
+            if len(batch.datasets) >= self.max_size:
+                # Full: later documents start the next batch.
+                del self._open[is_ocr]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.max_wait_seconds)
+            acquired = self._run_lock.acquire(timeout=self.timeout_seconds)
+            with self._lock:
+                if self._open.get(is_ocr) is batch:
+                    del self._open[is_ocr]
+            if not acquired:
+                # The batch before this one is stuck; its members are on their own, and so are these.
+                logger.warning(f"Gave up on a batch of {len(batch.datasets)} documents after {self.timeout_seconds}s waiting for the models, analyzing them one by one.")
+                batch.done.set()
+                return None
+            try:
+                self._run(batch, is_ocr)
+            finally:
+                self._run_lock.release()
+        elif not batch.done.wait(self.timeout_seconds):
+            logger.warning(f"Batch did not finish within {self.timeout_seconds}s, analyzing the document on its own.")
+            return None
+
+        return None if batch.model_lists is None else batch.model_lists[index]
+
+    def _run(self, batch: _Batch, is_ocr: bool):
+        pages = sum(len(ds) for ds in batch.datasets)
+        started_at = time.perf_counter()
+        try:
+            infer_results = batch_doc_analyze(batch.datasets, parse_method="ocr" if is_ocr else "txt")
+            batch.model_lists = [infer_result.get_infer_res() for infer_result in infer_results]
+            logger.info(f"Analyzed a batch of {len(batch.datasets)} documents ({pages} pages) in {time.perf_counter() - started_at:.2f}s")
+            metrics.INFERENCE_BATCH_DOCUMENTS.observe(len(batch.datasets))
+        except Exception:
+            logger.warning(f"Batch of {len(batch.datasets)} documents failed, analyzing them one by one.", exc_info=True)
+        finally:
+            batch.done.set()
+
+
+inference_batcher = InferenceBatcher()
@@ -0,0 +1,198 @@
+# Content-addressed cache of finished analyses, so duplicate PDFs skip model inference.
+
+# app/cache.py
+
+import json
+import time
+import shutil
+import hashlib
+import logging
+from importlib import metadata
+from app.config import CACHE_ENABLED, CACHE_MAX_BYTES
+from app.redis_client import get_redis
+from app.object_store import object_store, directory_size
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "mineru:cache"
+ENTRIES_KEY = f"{CACHE_PREFIX}:entries"
+LRU_KEY = f"{CACHE_PREFIX}:lru"
+DIRS_KEY = f"{CACHE_PREFIX}:dirs"
+STATS_KEY = f"{CACHE_PREFIX}:stats"
+SIZE_KEY = f"{CACHE_PREFIX}:size_bytes"
+# Output directories -> how many tasks answered from the cache read their files
+ALIASES_KEY = f"{CACHE_PREFIX}:aliases"
+
+
+def _pipeline_version() -> str:
+    try:
+        return metadata.version("magic-pdf")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+PIPELINE_VERSION = _pipeline_version()
+
+
+def compute_cache_key(pdf_sha256: str, options: dict) -> str:
+    """
+    Builds the cache key from the PDF content hash, the parse options and the magic-pdf version.
+    """
+    payload = json.dumps(
+        {"sha256": pdf_sha256, "options": options, "pipeline": PIPELINE_VERSION},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Maps cache keys to the result summary of a finished task. Entries are evicted in
+    least-recently-used order once the outputs they reference exceed `max_bytes`. The output of
+    an evicted entry is deleted with it, unless tasks answered from the cache still point to it;
+    the storage garbage collector removes it together with those tasks then.
+    """
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, enabled: bool = CACHE_ENABLED):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+    @property
+    def redis(self):
+        return get_redis()
+
+    def lookup(self, key: str) -> dict | None:
+        if not self.enabled:
+            return None
+
+        raw = self.redis.hget(ENTRIES_KEY, key)
+        entry = json.loads(raw) if raw else None
+        if entry and not object_store.exists(entry["result"].get("output_directory", "")):
+            logger.warning(f"Cached output for key {key} is gone, dropping the entry.")
+            self._drop(key, entry)
+            entry = None
+
+        if entry is None:
+            self.redis.hincrby(STATS_KEY, "misses", 1)
+            return None
+
+        pipe = self.redis.pipeline()
+        pipe.zadd(LRU_KEY, {key: time.time()})
+        pipe.hincrby(STATS_KEY, "hits", 1)
+        pipe.hincrbyfloat(STATS_KEY, "saved_seconds", entry.get("processing_seconds", 0.0))
+        pipe.execute()
+        return entry
+
+    def store(self, key: str, result: dict, processing_seconds: float):
+        if not self.enabled:
+            return
+
+        output_dir = result["output_directory"]
+        # Another document may have been written into the same directory; its entry is stale now.
+        previous_key = self.redis.hget(DIRS_KEY, output_dir)
+        if previous_key and previous_key != key:
+            raw = self.redis.hget(ENTRIES_KEY, previous_key)
+            if raw:
+                self._drop(previous_key, json.loads(raw), remove_output=False)
+
+        entry = {
+            "result": result,
+            "size_bytes": directory_size(output_dir),
+            "processing_seconds": processing_seconds,
+            "created_at": time.time(),
+        }
+        replaced = self.redis.hget(ENTRIES_KEY, key)
+        self.total_bytes()  # sets up the running total before it is first added to
+        pipe = self.redis.pipeline()
+        pipe.hset(ENTRIES_KEY, key, json.dumps(entry))
+        pipe.incrby(SIZE_KEY, entry["size_bytes"] - (json.loads(replaced).get("size_bytes", 0) if replaced else 0))
+        pipe.hset(DIRS_KEY, output_dir, key)
+        pipe.zadd(LRU_KEY, {key: time.time()})
+        pipe.execute()
+        logger.info(f"Cached result for key {key} ({entry['size_bytes']} bytes).")
+        self.evict()
+
+    def evict(self):
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+
+        for key in self.redis.zrange(LRU_KEY, 0, -1):
+            if total <= self.max_bytes:
+                break
+            raw = self.redis.hget(ENTRIES_KEY, key)
+            if not raw:
+                self.redis.zrem(LRU_KEY, key)
+                continue
+            entry = json.loads(raw)
+            if not self._drop(key, entry):
+                continue
+            total -= entry.get("size_bytes", 0)
+            self.redis.hincrby(STATS_KEY, "evictions", 1)
+            logger.info(f"Evicted cache entry {key}, freed {entry.get('size_bytes', 0)} bytes.")
+
+    def add_alias(self, output_dir: str):
+        # Counted until the directory is deleted, which takes the tasks pointing to it along.
+        self.redis.hincrby(ALIASES_KEY, output_dir, 1)
+
+    def forget_directory(self, output_dir: str):
+        """
+        Drops the entry whose result lives in `output_dir`, for when the directory is deleted.
+        """
+        self.redis.hdel(ALIASES_KEY, output_dir)
+        key = self.redis.hget(DIRS_KEY, output_dir)
+        raw = self.redis.hget(ENTRIES_KEY, key) if key else None
+        if raw:
+            self._drop(key, json.loads(raw), remove_output=False)
+
+    def total_bytes(self) -> int:
+        raw = self.redis.get(SIZE_KEY)
+        if raw is not None:
+            return int(raw)
+        # Entries cached before the running total was kept are counted once.
+        total = sum(json.loads(raw).get("size_bytes", 0) for raw in self.redis.hvals(ENTRIES_KEY))
+        self.redis.set(SIZE_KEY, total, nx=True)
+        return int(self.redis.get(SIZE_KEY))
+
+    def stats(self) -> dict:
+        counters = self.redis.hgetall(STATS_KEY)
+        hits = int(counters.get("hits", 0))
+        misses = int(counters.get("misses", 0))
+        lookups = hits + misses
+        return {
+            "enabled": self.enabled,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "evictions": int(counters.get("evictions", 0)),
+            "saved_seconds": float(counters.get("saved_seconds", 0.0)),
+            "entries": self.redis.hlen(ENTRIES_KEY),
+            "size_bytes": self.total_bytes(),
+            "max_bytes": self.max_bytes,
+        }
+
+    def _drop(self, key: str, entry: dict, remove_output: bool = True) -> bool:
+        """
+        Removes the entry and, with `remove_output`, its output unless aliases read it. Returns
+        False when another process dropped the entry first.
+        """
+        output_dir = entry["result"].get("output_directory", "")
+        if not self.redis.hdel(ENTRIES_KEY, key):
+            self.redis.zrem(LRU_KEY, key)
+            return False
+        pipe = self.redis.pipeline()
+        pipe.decrby(SIZE_KEY, entry.get("size_bytes", 0))
+        pipe.zrem(LRU_KEY, key)
+        if output_dir and self.redis.hget(DIRS_KEY, output_dir) == key:
+            pipe.hdel(DIRS_KEY, output_dir)
+        pipe.execute()
+        if remove_output and output_dir:
+            if self.redis.hget(ALIASES_KEY, output_dir):
+                logger.info(f"Keeping the output of cache entry {key}, tasks answered from the cache still use it.")
+            else:
+                shutil.rmtree(output_dir, ignore_errors=True)
+                object_store.delete(output_dir)
+        return True
+
+
+result_cache = ResultCache()
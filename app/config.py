@@ -0,0 +1,190 @@
+# Runtime settings shared by the web app and the Celery worker.
+# Every value can be overridden through an environment variable of the same name.
+
+# app/config.py
+
+import os
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+# Logging: "rich" writes to the console and a rotating file from the logging thread; "json" writes JSON
+# lines with the task context through a background listener thread, fed by a queue of LOG_QUEUE_SIZE records
+# (dropped when full). In "json" mode INFO and DEBUG records are sampled per call site: the first
+# LOG_SAMPLE_INITIAL per LOG_SAMPLE_WINDOW_SECONDS, then every LOG_SAMPLE_THEREAFTER-th (LOG_SAMPLE_INITIAL 0 keeps all)
+LOG_MODE = os.getenv("LOG_MODE", "rich").strip().lower()
+LOG_QUEUE_SIZE = _env_int("LOG_QUEUE_SIZE", 10000)
+LOG_SAMPLE_INITIAL = _env_int("LOG_SAMPLE_INITIAL", 20)
+LOG_SAMPLE_THEREAFTER = _env_int("LOG_SAMPLE_THEREAFTER", 100)
+LOG_SAMPLE_WINDOW_SECONDS = float(os.getenv("LOG_SAMPLE_WINDOW_SECONDS", "1"))
+
+# Uploaded PDFs and analysis outputs, one sub-directory per task id
+INPUT_DIR = os.getenv("INPUT_DIR", "/app/data/input_pdfs")
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/app/data/output")
+LOG_DIR = os.getenv("LOG_DIR", "/app/data/logs")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+
+# Content-addressed result cache
+CACHE_ENABLED = _env_bool("CACHE_ENABLED", True)
+CACHE_MAX_BYTES = _env_int("CACHE_MAX_BYTES", 20 * 1024 * 1024 * 1024)
+
+UPLOAD_CHUNK_SIZE = _env_int("UPLOAD_CHUNK_SIZE", 1024 * 1024)
+
+# Model warmup in each worker process
+WARMUP_ENABLED = _env_bool("WARMUP_ENABLED", True)
+WARMUP_MODES = [mode.strip() for mode in os.getenv("WARMUP_MODES", "txt,ocr").split(",") if mode.strip()]
+WARMUP_TIMEOUT = _env_int("WARMUP_TIMEOUT", 900)
+# Each worker process refreshes its state every WORKER_HEARTBEAT_SECONDS; one not seen for
+# WORKER_STALE_SECONDS (killed, or its node lost) is dropped from /workers/status and /autoscaling
+WORKER_HEARTBEAT_SECONDS = _env_int("WORKER_HEARTBEAT_SECONDS", 30)
+WORKER_STALE_SECONDS = _env_int("WORKER_STALE_SECONDS", 120)
+
+# Page-level sharding of large documents across workers (0 disables it)
+SHARD_PAGES = _env_int("SHARD_PAGES", 0)
+SHARD_MIN_PAGES = _env_int("SHARD_MIN_PAGES", 200)
+
+# Outputs generated when a request does not choose any; visual reports can be rendered later on demand
+DEFAULT_OUTPUTS = [kind.strip() for kind in os.getenv("DEFAULT_OUTPUTS", "markdown,content_list").split(",") if kind.strip()]
+
+# Batch submission
+BATCH_MAX_FILES = _env_int("BATCH_MAX_FILES", 10000)
+
+# Completion notifications
+WEBHOOK_TIMEOUT = _env_int("WEBHOOK_TIMEOUT", 10)
+WEBHOOK_MAX_RETRIES = _env_int("WEBHOOK_MAX_RETRIES", 5)
+EVENT_STREAM_KEEPALIVE = _env_int("EVENT_STREAM_KEEPALIVE", 15)
+
+# Upload limits and backpressure
+MAX_UPLOAD_BYTES = _env_int("MAX_UPLOAD_BYTES", 200 * 1024 * 1024)
+MAX_BATCH_UPLOAD_BYTES = _env_int("MAX_BATCH_UPLOAD_BYTES", 4 * 1024 * 1024 * 1024)
+UPLOAD_CONCURRENCY = _env_int("UPLOAD_CONCURRENCY", 16)
+UPLOAD_IO_THREADS = _env_int("UPLOAD_IO_THREADS", 4)
+
+# Admission control: new submissions are turned away with 503 while the analysis queues hold ADMISSION_MAX_QUEUE_DEPTH
+# messages, ADMISSION_MAX_OUTSTANDING_PAGES pages are submitted but unfinished, or INPUT_DIR/OUTPUT_DIR have less than
+# ADMISSION_MIN_FREE_BYTES free, and with 429 while the client (ADMISSION_CLIENT_HEADER, else its address) has
+# ADMISSION_CLIENT_MAX_TASKS tasks or ADMISSION_CLIENT_MAX_PAGES pages outstanding (0 disables a check). Retry-After
+# comes from the pages finished over the last ADMISSION_THROUGHPUT_WINDOW seconds.
+ADMISSION_MAX_QUEUE_DEPTH = _env_int("ADMISSION_MAX_QUEUE_DEPTH", 10000)
+ADMISSION_MAX_OUTSTANDING_PAGES = _env_int("ADMISSION_MAX_OUTSTANDING_PAGES", 0)
+ADMISSION_MIN_FREE_BYTES = _env_int("ADMISSION_MIN_FREE_BYTES", 1024 * 1024 * 1024)
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "X-Client-Id")
+ADMISSION_CLIENT_MAX_TASKS = _env_int("ADMISSION_CLIENT_MAX_TASKS", 0)
+ADMISSION_CLIENT_MAX_PAGES = _env_int("ADMISSION_CLIENT_MAX_PAGES", 0)
+ADMISSION_THROUGHPUT_WINDOW = _env_int("ADMISSION_THROUGHPUT_WINDOW", 300)
+ADMISSION_RETRY_AFTER_MIN = _env_int("ADMISSION_RETRY_AFTER_MIN", 5)
+ADMISSION_RETRY_AFTER_MAX = _env_int("ADMISSION_RETRY_AFTER_MAX", 3600)
+# Retry-After when there is no recent throughput to go by, or the disk is full
+ADMISSION_RETRY_AFTER_DEFAULT = _env_int("ADMISSION_RETRY_AFTER_DEFAULT", 60)
+
+# Autoscaling signal (GET /autoscaling): the worker processes needed to finish the outstanding pages within
+# AUTOSCALE_TARGET_DRAIN_SECONDS at the pages per busy second the processes finished over the last ADMISSION_THROUGHPUT_WINDOW
+# (AUTOSCALE_FALLBACK_PAGES_PER_SECOND before any has), between AUTOSCALE_MIN_WORKERS and AUTOSCALE_MAX_WORKERS
+AUTOSCALE_TARGET_DRAIN_SECONDS = _env_int("AUTOSCALE_TARGET_DRAIN_SECONDS", 900)
+AUTOSCALE_MIN_WORKERS = _env_int("AUTOSCALE_MIN_WORKERS", 1)
+AUTOSCALE_MAX_WORKERS = _env_int("AUTOSCALE_MAX_WORKERS", 32)
+AUTOSCALE_FALLBACK_PAGES_PER_SECOND = float(os.getenv("AUTOSCALE_FALLBACK_PAGES_PER_SECOND", "1.0"))
+
+# Largest page range one request to the paginated content list may ask for
+CONTENT_LIST_MAX_PAGES = _env_int("CONTENT_LIST_MAX_PAGES", 100)
+
+# Inference runs in windows of this many pages so progress can be reported between them (0 = one pass)
+PROGRESS_PAGE_WINDOW = _env_int("PROGRESS_PAGE_WINDOW", 50)
+# Pages per flush of the incremental content stream, and how often a followed stream is polled
+STREAM_PAGE_WINDOW = _env_int("STREAM_PAGE_WINDOW", 10)
+STREAM_POLL_SECONDS = float(os.getenv("STREAM_POLL_SECONDS", "0.5"))
+
+# Low-memory mode: analyses of at least LOW_MEMORY_MIN_PAGES pages render, analyze and spill to disk
+# LOW_MEMORY_WINDOW_PAGES pages at a time from small window documents instead of the whole PDF (0 disables it)
+LOW_MEMORY_MIN_PAGES = _env_int("LOW_MEMORY_MIN_PAGES", 0)
+LOW_MEMORY_WINDOW_PAGES = _env_int("LOW_MEMORY_WINDOW_PAGES", 16)
+
+# Micro-batching: concurrent tasks of one worker process (threads pool) that analyze whole documents of at
+# most MICRO_BATCH_MAX_PAGES pages share one batch_doc_analyze call of up to MICRO_BATCH_SIZE documents,
+# waiting at most MICRO_BATCH_WAIT_MS for the batch to fill (MICRO_BATCH_SIZE 0 or 1 disables it)
+MICRO_BATCH_SIZE = _env_int("MICRO_BATCH_SIZE", 0)
+MICRO_BATCH_WAIT_MS = _env_int("MICRO_BATCH_WAIT_MS", 50)
+MICRO_BATCH_MAX_PAGES = _env_int("MICRO_BATCH_MAX_PAGES", 8)
+# Longest a task waits for the batch it joined before analyzing its document on its own
+MICRO_BATCH_TIMEOUT_SECONDS = _env_int("MICRO_BATCH_TIMEOUT_SECONDS", 600)
+
+# Queue routing: small documents go to the interactive queue, everything else to the bulk queue
+INTERACTIVE_QUEUE = os.getenv("INTERACTIVE_QUEUE", "interactive")
+BULK_QUEUE = os.getenv("BULK_QUEUE", "bulk")
+INTERACTIVE_MAX_PAGES = _env_int("INTERACTIVE_MAX_PAGES", 20)
+INTERACTIVE_MAX_BYTES = _env_int("INTERACTIVE_MAX_BYTES", 20 * 1024 * 1024)
+# A page that probably needs OCR counts as this many pages against INTERACTIVE_MAX_PAGES
+OCR_PAGE_COST = _env_int("OCR_PAGE_COST", 4)
+# Send likely scans to "<queue>_ocr" so they can be served by workers set up for OCR
+SPLIT_OCR_QUEUES = _env_bool("SPLIT_OCR_QUEUES", False)
+WORKER_PREFETCH_MULTIPLIER = _env_int("WORKER_PREFETCH_MULTIPLIER", 1)
+
+# Time limits of analysis tasks: a base plus a per-page allowance (OCR pages weigh OCR_PAGE_COST),
+# capped at TASK_MAX_TIME_LIMIT. The soft limit fails the task; the hard one kills the process GRACE seconds later.
+TASK_TIME_LIMIT_BASE = _env_int("TASK_TIME_LIMIT_BASE", 600)
+TASK_TIME_LIMIT_PER_PAGE = _env_int("TASK_TIME_LIMIT_PER_PAGE", 30)
+TASK_MAX_TIME_LIMIT = _env_int("TASK_MAX_TIME_LIMIT", 6 * 3600)
+TASK_TIME_LIMIT_GRACE = _env_int("TASK_TIME_LIMIT_GRACE", 120)
+# How often workers on the threads or solo pool, where Celery does not enforce the limits, check them (see app/hang_guard.py)
+WORKER_HANG_CHECK_SECONDS = _env_int("WORKER_HANG_CHECK_SECONDS", 10)
+# Retries of transient failures (connection errors to Redis or the object store), with exponential backoff
+TASK_MAX_RETRIES = _env_int("TASK_MAX_RETRIES", 3)
+TASK_RETRY_BACKOFF_MAX = _env_int("TASK_RETRY_BACKOFF_MAX", 300)
+# How often a task may be started before it is dead-lettered, when its worker keeps dying (crash, OOM kill)
+TASK_MAX_DELIVERIES = _env_int("TASK_MAX_DELIVERIES", 3)
+DEAD_LETTER_MAX_ENTRIES = _env_int("DEAD_LETTER_MAX_ENTRIES", 10000)
+
+# Submit-time pre-classification
+PRECLASSIFY_SAMPLE_PAGES = _env_int("PRECLASSIFY_SAMPLE_PAGES", 10)
+# Let workers skip classify() when the pre-classification is conclusive
+PRECLASSIFY_SKIP_CLASSIFY = _env_bool("PRECLASSIFY_SKIP_CLASSIFY", True)
+
+# Run each document in a child forked from the warmed worker process, which shares the model weights
+# copy-on-write and returns all memory the document used when it exits; with GPU inference, in a
+# spawned helper process that loads its own models instead (see README)
+DOCUMENT_ISOLATION = _env_bool("DOCUMENT_ISOLATION", False)
+# The child is killed when its RSS, (shared) model pages included, exceeds this (0 = no limit)
+DOCUMENT_MAX_RSS_BYTES = _env_int("DOCUMENT_MAX_RSS_BYTES", 0)
+MEMORY_POLL_SECONDS = float(os.getenv("MEMORY_POLL_SECONDS", "0.5"))
+# Replace a worker process (and load the models again) after this many tasks, or once its RSS is above
+# this after a task (0 = never)
+WORKER_MAX_TASKS_PER_CHILD = _env_int("WORKER_MAX_TASKS_PER_CHILD", 0)
+WORKER_MAX_MEMORY_PER_CHILD = _env_int("WORKER_MAX_MEMORY_PER_CHILD", 0)
+
+# Port of the Prometheus exporter each worker container serves (needs PROMETHEUS_MULTIPROC_DIR; 0 disables it)
+WORKER_METRICS_PORT = _env_int("WORKER_METRICS_PORT", 9808)
+
+# Retention of uploads, outputs and task results, and the disk watermarks that trigger early cleanup
+STORAGE_RETENTION_SECONDS = _env_int("STORAGE_RETENTION_SECONDS", 24 * 3600)
+STORAGE_HIGH_WATERMARK = float(os.getenv("STORAGE_HIGH_WATERMARK", "0.85"))
+STORAGE_LOW_WATERMARK = float(os.getenv("STORAGE_LOW_WATERMARK", "0.75"))
+STORAGE_GC_INTERVAL = _env_int("STORAGE_GC_INTERVAL", 600)
+# Files no task owns are only deleted once they are this old, so uploads still being submitted are never touched
+STORAGE_ORPHAN_MIN_AGE_SECONDS = _env_int("STORAGE_ORPHAN_MIN_AGE_SECONDS", 3600)
+
+# Where uploads and outputs are kept: "local" (INPUT_DIR/OUTPUT_DIR on a volume web and workers share)
+# or "s3" (an S3-compatible bucket; the directories are then per-node scratch space)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").strip().lower()
+S3_BUCKET = os.getenv("S3_BUCKET", "mineru")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+# Set for MinIO or another S3-compatible store; credentials come from the usual AWS_* variables
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+S3_MAX_POOL_CONNECTIONS = _env_int("S3_MAX_POOL_CONNECTIONS", 32)
+S3_MULTIPART_THRESHOLD = _env_int("S3_MULTIPART_THRESHOLD", 16 * 1024 * 1024)
+S3_MULTIPART_CHUNKSIZE = _env_int("S3_MULTIPART_CHUNKSIZE", 16 * 1024 * 1024)
+S3_TRANSFER_CONCURRENCY = _env_int("S3_TRANSFER_CONCURRENCY", 8)
+# Downloads redirect to presigned URLs valid this long (0 streams the bytes through the API)
+S3_PRESIGN_SECONDS = _env_int("S3_PRESIGN_SECONDS", 3600)
@@ -0,0 +1,121 @@
+# Dead-letter queue of analysis tasks that failed for good, and the delivery counts that catch poison PDFs.
+
+# app/dead_letter.py
+
+import json
+import time
+import logging
+from app.config import TASK_MAX_DELIVERIES, DEAD_LETTER_MAX_ENTRIES, STORAGE_RETENTION_SECONDS
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTER_PREFIX = "mineru:dead-letter"
+ENTRIES_KEY = f"{DEAD_LETTER_PREFIX}:entries"
+ORDER_KEY = f"{DEAD_LETTER_PREFIX}:order"
+DELIVERIES_KEY_PREFIX = "mineru:deliveries"
+
+# Why a task was dead-lettered
+REASON_ERROR = "error"
+REASON_TIMEOUT = "timeout"
+REASON_RETRIES_EXHAUSTED = "retries_exhausted"
+REASON_WORKER_LOST = "worker_lost"
+REASON_MEMORY_LIMIT = "memory_limit"
+REASON_CRASHED = "crashed"
+
+
+class RepeatedWorkerLossError(Exception):
+    """
+    Raised instead of running a task whose earlier deliveries all ended with the worker process
+    dying, so that one PDF that crashes or exhausts the worker cannot do so forever.
+    """
+
+
+class DeadLetterQueue:
+    """
+    Keeps the tasks that failed for good, keyed by the task id clients hold, with the reason and
+    the arguments needed to look into them or submit them again. Entries older than the storage
+    retention, or beyond the newest `max_entries`, are dropped as new ones come in.
+    """
+
+    def __init__(self, max_deliveries: int = TASK_MAX_DELIVERIES, max_entries: int = DEAD_LETTER_MAX_ENTRIES,
+                 retention_seconds: int = STORAGE_RETENTION_SECONDS):
+        self.max_deliveries = max_deliveries
+        self.max_entries = max_entries
+        self.retention_seconds = retention_seconds
+
+    @property
+    def redis(self):
+        return get_redis()
+
+    def count_delivery(self, task_id: str) -> int:
+        """
+        Counts a start of `task_id` and raises RepeatedWorkerLossError when it has been started
+        more than `max_deliveries` times without finishing. Tasks that finish, whatever the
+        outcome, clear their count with `clear_deliveries`, so only lost runs add up.
+        """
+        key = f"{DELIVERIES_KEY_PREFIX}:{task_id}"
+        pipe = self.redis.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, self.retention_seconds)
+        deliveries = pipe.execute()[0]
+        if deliveries > self.max_deliveries:
+            raise RepeatedWorkerLossError(
+                f"The worker was lost {deliveries - 1} times while running this task; the document probably crashes it or exhausts its memory."
+            )
+        return deliveries
+
+    def clear_deliveries(self, task_id: str):
+        self.redis.delete(f"{DELIVERIES_KEY_PREFIX}:{task_id}")
+
+    def add(self, task_id: str, task_name: str, reason: str, error: str, attempts: int, failed_task_id: str | None = None,
+            kwargs: dict | None = None, hostname: str | None = None):
+        now = time.time()
+        entry = {
+            "task_id": task_id,
+            "task": task_name,
+            "failed_task_id": failed_task_id or task_id,
+            "reason": reason,
+            "error": error,
+            "attempts": attempts,
+            "hostname": hostname,
+            "failed_at": now,
+            "kwargs": kwargs or {},
+        }
+        pipe = self.redis.pipeline()
+        pipe.hset(ENTRIES_KEY, task_id, json.dumps(entry, default=str))
+        pipe.zadd(ORDER_KEY, {task_id: now})
+        pipe.execute()
+        logger.warning(f"[TASK ID: {task_id}] Dead-lettered {task_name} after {attempts} attempts ({reason}): {error}")
+        self._trim(now)
+
+    def get(self, task_id: str) -> dict | None:
+        raw = self.redis.hget(ENTRIES_KEY, task_id)
+        return json.loads(raw) if raw else None
+
+    def list(self, limit: int = 100) -> list[dict]:
+        task_ids = self.redis.zrevrange(ORDER_KEY, 0, limit - 1)
+        raws = self.redis.hmget(ENTRIES_KEY, task_ids) if task_ids else []
+        return [json.loads(raw) for raw in raws if raw]
+
+    def count(self) -> int:
+        return self.redis.zcard(ORDER_KEY)
+
+    def remove(self, task_id: str):
+        pipe = self.redis.pipeline()
+        pipe.hdel(ENTRIES_KEY, task_id)
+        pipe.zrem(ORDER_KEY, task_id)
+        pipe.execute()
+
+    def _trim(self, now: float):
+        expired = self.redis.zrangebyscore(ORDER_KEY, 0, now - self.retention_seconds)
+        overflow = self.redis.zrange(ORDER_KEY, 0, -self.max_entries - 1)
+        stale = list({*expired, *overflow})
+        if stale:
+            pipe = self.redis.pipeline()
+            pipe.hdel(ENTRIES_KEY, *stale)
+            pipe.zrem(ORDER_KEY, *stale)
+            pipe.execute()
+
+
+dead_letters = DeadLetterQueue()
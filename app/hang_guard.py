@@ -0,0 +1,93 @@
+# Time limits for tasks run by the threads and solo pools, which Celery only enforces under prefork.
+
+# app/hang_guard.py
+
+import os
+import time
+import ctypes
+import logging
+import threading
+from typing import Callable
+from celery.exceptions import SoftTimeLimitExceeded
+from app.logging_config import flush_logging
+
+logger = logging.getLogger(__name__)
+
+
+class _RunningTask:
+    def __init__(self, thread_id: int, soft_deadline: float, hard_deadline: float):
+        self.thread_id = thread_id
+        self.soft_deadline = soft_deadline
+        self.hard_deadline = hard_deadline
+        self.interrupted = False
+
+
+class HangGuard:
+    """
+    Enforces the soft and hard time limits of the tasks running in threads of this process,
+    checking every `check_seconds`. Past its soft limit a task gets SoftTimeLimitExceeded raised
+    in its thread, which takes effect as soon as the thread runs Python code again, so it fails
+    and is dead-lettered like a prefork task. A task still running at its hard limit is stuck in
+    native code, and the whole process exits after `on_hard_limit(task_id, others)` has run: the
+    broker hands its unacknowledged tasks to other workers, as when Celery kills a prefork child,
+    and a document that keeps hanging is dead-lettered after TASK_MAX_DELIVERIES starts.
+    """
+
+    def __init__(self, check_seconds: float, on_hard_limit: Callable[[str, list[str]], None] | None = None):
+        self.check_seconds = check_seconds
+        self.on_hard_limit = on_hard_limit
+        self._lock = threading.Lock()
+        self._running: dict[str, _RunningTask] = {}
+        self._thread = None
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="hang-guard", daemon=True)
+            self._thread.start()
+
+    def task_started(self, task_id: str, soft_limit: float, hard_limit: float):
+        now = time.monotonic()
+        with self._lock:
+            self._running[task_id] = _RunningTask(threading.get_ident(), now + soft_limit, now + hard_limit)
+
+    def task_finished(self, task_id: str):
+        with self._lock:
+            self._running.pop(task_id, None)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.check_seconds)
+            try:
+                self.check()
+            except Exception:
+                logger.warning("Hang guard check failed.", exc_info=True)
+
+    def check(self, now: float | None = None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for task_id, task in self._running.items():
+                if now >= task.hard_deadline:
+                    hung, others = task_id, [other for other in self._running if other != task_id]
+                    break
+                # Under the lock, so the exception cannot reach a thread that has moved on to another task.
+                if now >= task.soft_deadline and not task.interrupted:
+                    logger.error(f"[TASK ID: {task_id}] Soft time limit exceeded, interrupting the task.")
+                    task.interrupted = True
+                    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(task.thread_id), ctypes.py_object(SoftTimeLimitExceeded))
+            else:
+                return
+        self._exit(hung, others)
+
+    def _exit(self, task_id: str, others: list[str]):
+        logger.critical(f"[TASK ID: {task_id}] Hard time limit exceeded, stopping the worker so its {len(others) + 1} unfinished tasks are redelivered.")
+        if self.on_hard_limit:
+            try:
+                self.on_hard_limit(task_id, others)
+            except Exception:
+                logger.warning("Could not prepare the tasks of this worker for redelivery.", exc_info=True)
+        flush_logging()
+        os._exit(1)
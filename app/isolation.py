@@ -0,0 +1,343 @@
+# Running one document in a supervised child process, with a memory cap and peak RSS accounting.
+
+# app/isolation.py
+
+import os
+import sys
+import copy
+import time
+import pickle
+import select
+import signal
+import logging
+import threading
+import multiprocessing
+from typing import Any, Callable
+from app.config import DOCUMENT_ISOLATION, DOCUMENT_MAX_RSS_BYTES, MEMORY_POLL_SECONDS, WARMUP_ENABLED, WARMUP_TIMEOUT
+from app.model_warmup import current_rss_bytes, warm_up_models
+from app.logging_config import setup_logging, flush_logging
+from app.progress import ProgressTracker
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+READ_SIZE = 1024 * 1024
+
+
+class DocumentMemoryExceeded(Exception):
+    """
+    The child analyzing a document went over DOCUMENT_MAX_RSS_BYTES and was killed.
+    """
+
+
+class DocumentProcessDied(Exception):
+    """
+    The child analyzing a document exited without a result, e.g. after a segfault in a native
+    library or a kill by the kernel's OOM killer.
+    """
+
+
+def process_rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm", "r", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def fork_is_safe() -> bool:
+    # A CUDA context does not survive fork(); children of a process that initialized one cannot use the GPU.
+    torch = sys.modules.get("torch")
+    return hasattr(os, "fork") and not (torch is not None and torch.cuda.is_initialized())
+
+
+def inference_device() -> str:
+    # Read from magic-pdf.json, which does not touch CUDA the way asking torch would.
+    try:
+        from magic_pdf.libs.config_reader import get_device
+        return str(get_device())
+    except Exception:
+        return "cpu"
+
+
+def isolation_mode() -> str | None:
+    """
+    How documents are isolated in this process: None without DOCUMENT_ISOLATION, "fork" for
+    children forked from the warmed process, "spawn" for the document helper, which is used
+    when the models run on a GPU or forking is not possible.
+    """
+    if not DOCUMENT_ISOLATION:
+        return None
+    return "fork" if inference_device() == "cpu" and fork_is_safe() else "spawn"
+
+
+def _run_child(write_fd: int, fn: Callable, args: tuple, kwargs: dict):
+    try:
+        payload = (True, fn(*args, **kwargs))
+    except BaseException as e:
+        payload = (False, e)
+    try:
+        data = pickle.dumps(payload)
+    except Exception:
+        data = pickle.dumps((False, RuntimeError(f"{type(payload[1]).__name__}: {payload[1]}")))
+    with os.fdopen(write_fd, "wb") as pipe:
+        pipe.write(data)
+
+
+def _reap(pid: int) -> tuple[int, int]:
+    """
+    Waits for the child and returns its exit status and its peak RSS according to the kernel.
+    """
+    _, status, rusage = os.wait4(pid, 0)
+    return status, rusage.ru_maxrss * 1024
+
+
+def run_isolated(fn: Callable, *args, max_rss_bytes: int = DOCUMENT_MAX_RSS_BYTES, **kwargs) -> tuple[Any, int]:
+    """
+    Calls `fn(*args, **kwargs)` in a forked child and returns its result and the child's peak
+    RSS. Arguments are inherited, not pickled, so callbacks and models work as in-process; only
+    the result is pickled back. The child's RSS is checked every MEMORY_POLL_SECONDS, and it is
+    killed when it exceeds `max_rss_bytes`. The child is also killed when this process is
+    interrupted, e.g. by a soft time limit.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        exit_code = 0
+        try:
+            _run_child(write_fd, fn, args, kwargs)
+        except BaseException:
+            exit_code = 1
+        finally:
+            # Skip atexit handlers and buffered I/O inherited from the worker, once this child's logs are out.
+            flush_logging()
+            os._exit(exit_code)
+
+    os.close(write_fd)
+    chunks, peak_rss, over_limit, status = [], 0, False, None
+    try:
+        while True:
+            ready, _, _ = select.select([read_fd], [], [], MEMORY_POLL_SECONDS)
+            if ready:
+                chunk = os.read(read_fd, READ_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            rss = process_rss_bytes(pid)
+            peak_rss = max(peak_rss, rss)
+            if max_rss_bytes and rss > max_rss_bytes:
+                over_limit = True
+                os.kill(pid, signal.SIGKILL)
+                break
+        status, child_peak_rss = _reap(pid)
+        peak_rss = max(peak_rss, child_peak_rss)
+    finally:
+        os.close(read_fd)
+        if status is None:
+            os.kill(pid, signal.SIGKILL)
+            _reap(pid)
+
+    if over_limit:
+        raise DocumentMemoryExceeded(f"The analysis used {peak_rss} bytes of memory, more than the limit of {max_rss_bytes} bytes.")
+    if not chunks:
+        if os.WIFSIGNALED(status):
+            raise DocumentProcessDied(f"The analysis process was killed by {signal.Signals(os.WTERMSIG(status)).name}.")
+        raise DocumentProcessDied(f"The analysis process exited with code {os.WEXITSTATUS(status)} without a result.")
+    succeeded, value = pickle.loads(b"".join(chunks))
+    if not succeeded:
+        raise value
+    return value, peak_rss
+
+
+def run_in_process(fn: Callable, *args, **kwargs) -> tuple[Any, int]:
+    """
+    Calls `fn(*args, **kwargs)` here and returns its result and the peak RSS of this process
+    while it ran, sampled every MEMORY_POLL_SECONDS.
+    """
+    peak_rss = current_rss_bytes()
+    finished = threading.Event()
+
+    def sample():
+        nonlocal peak_rss
+        while not finished.wait(MEMORY_POLL_SECONDS):
+            peak_rss = max(peak_rss, current_rss_bytes())
+
+    sampler = threading.Thread(target=sample, name="rss-sampler", daemon=True)
+    sampler.start()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        finished.set()
+        sampler.join()
+    return result, max(peak_rss, current_rss_bytes())
+
+
+# The pipe of the document helper to its worker process, in the helper
+_helper_conn = None
+
+
+class _RemoteCallback:
+    """
+    Stands in for a callback of the worker process inside the document helper and sends each
+    call back to the worker, which makes it there.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __call__(self, *args):
+        _helper_conn.send(("call", self.name, args))
+
+
+def _exit_with_parent(parent_pid: int):
+    # Killing a worker process, e.g. at its hard time limit, must not leave its helper analyzing on.
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    os._exit(1)
+
+
+def _serve_documents(conn, parent_pid: int, warm_up: bool):
+    global _helper_conn
+    _helper_conn = conn
+    setup_logging()
+    threading.Thread(target=_exit_with_parent, args=(parent_pid,), name="parent-watch", daemon=True).start()
+    try:
+        state = warm_up_models() if warm_up else {"ready": True, "modes": [], "warmup_seconds": 0.0, "model_memory_bytes": 0}
+    except Exception as e:
+        logger.error("Model warmup failed in the document helper, models will be loaded on first use.", exc_info=True)
+        state = {"ready": False, "error": str(e)}
+    conn.send(("ready", state))
+    while True:
+        try:
+            fn, args, kwargs = conn.recv()
+        except EOFError:
+            return
+        try:
+            payload = ("result", True, fn(*args, **kwargs))
+        except BaseException as e:
+            payload = ("result", False, e)
+        try:
+            conn.send(payload)
+        except Exception:
+            conn.send(("result", False, RuntimeError(f"{type(payload[2]).__name__}: {payload[2]}")))
+
+
+class DocumentHelper:
+    """
+    A process started with spawn rather than fork, so it can set up CUDA itself, that loads its
+    own models once and then analyzes the documents of this worker process one at a time. This
+    gives GPU workers the memory cap of DOCUMENT_ISOLATION: the helper's RSS is checked every
+    MEMORY_POLL_SECONDS and it is killed above `max_rss_bytes`, which here includes its models.
+    A killed or crashed helper is replaced for the next document, which pays for loading the
+    models again. Callbacks among the arguments, also the one of a ProgressTracker, are called
+    back in this process; everything else is pickled.
+    """
+
+    def __init__(self):
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._process = None
+        self._conn = None
+
+    def start(self) -> dict:
+        """
+        Starts the helper unless it is running, waits for it to load the models and returns its
+        warmup state.
+        """
+        if self._process is not None and self._process.is_alive():
+            return {"ready": True}
+        self.stop()
+        parent_conn, child_conn = self._context.Pipe()
+        self._process = self._context.Process(
+            target=_serve_documents, args=(child_conn, os.getpid(), WARMUP_ENABLED), name="document-helper", daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        logger.info(f"Started document helper process {self._process.pid}.")
+        if not parent_conn.poll(WARMUP_TIMEOUT):
+            self.stop()
+            raise DocumentProcessDied(f"The document helper did not load its models within {WARMUP_TIMEOUT}s.")
+        try:
+            _, state = parent_conn.recv()
+        except EOFError:
+            self.stop()
+            raise DocumentProcessDied("The document helper exited while loading its models.")
+        return {**state, "helper_pid": self._process.pid}
+
+    def stop(self):
+        if self._process is None:
+            return
+        if self._process.is_alive():
+            self._process.kill()
+        self._process.join()
+        self._conn.close()
+        self._process = self._conn = None
+
+    def run(self, fn: Callable, *args, max_rss_bytes: int = DOCUMENT_MAX_RSS_BYTES, **kwargs) -> tuple[Any, int]:
+        """
+        Calls `fn(*args, **kwargs)` in the helper and returns its result and the helper's peak
+        RSS while it ran.
+        """
+        callbacks, remote_kwargs = {}, {}
+        for name, value in kwargs.items():
+            if isinstance(value, ProgressTracker) and value.callback is not None:
+                callbacks[name] = value.callback
+                value = copy.copy(value)
+                value.callback = _RemoteCallback(name)
+            elif callable(value):
+                callbacks[name] = value
+                value = _RemoteCallback(name)
+            remote_kwargs[name] = value
+
+        with self._lock:
+            self.start()
+            pid = self._process.pid
+            self._conn.send((fn, args, remote_kwargs))
+            peak_rss, over_limit, message = 0, False, None
+            try:
+                while message is None:
+                    if self._conn.poll(MEMORY_POLL_SECONDS):
+                        try:
+                            received = self._conn.recv()
+                        except EOFError:
+                            break
+                        if received[0] == "call":
+                            callbacks[received[1]](*received[2])
+                        else:
+                            message = received
+                    rss = process_rss_bytes(pid)
+                    peak_rss = max(peak_rss, rss)
+                    if max_rss_bytes and rss > max_rss_bytes:
+                        over_limit = True
+                        break
+            finally:
+                # A helper that did not answer is over the limit, dead, or interrupted mid-document.
+                if message is None:
+                    self.stop()
+
+        if over_limit:
+            raise DocumentMemoryExceeded(f"The analysis used {peak_rss} bytes of memory, more than the limit of {max_rss_bytes} bytes.")
+        if message is None:
+            raise DocumentProcessDied(f"The document helper process {pid} exited without a result.")
+        _, succeeded, value = message
+        if not succeeded:
+            raise value
+        return value, peak_rss
+
+
+document_helper = DocumentHelper()
+
+
+def run_document(fn: Callable, *args, **kwargs) -> tuple[Any, int]:
+    """
+    Runs the analysis of one document as `isolation_mode()` says, in a forked child, in the
+    document helper or in-process, and returns its result and peak RSS.
+    """
+    mode = isolation_mode()
+    if mode == "fork":
+        return run_isolated(fn, *args, **kwargs)
+    if mode == "spawn":
+        return document_helper.run(fn, *args, **kwargs)
+    return run_in_process(fn, *args, **kwargs)
@@ -2,15 +2,188 @@
 
 # app/logging_config.py (final version)
 
-import logging
 import os
-from logging.handlers import RotatingFileHandler
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from rich.logging import RichHandler
+from rich.text import Text
+from rich.errors import MarkupError
+from app.config import (
+    LOG_DIR, LOG_LEVEL, LOG_MODE, LOG_QUEUE_SIZE, LOG_SAMPLE_INITIAL, LOG_SAMPLE_THEREAFTER,
+    LOG_SAMPLE_WINDOW_SECONDS
+)
+
+# Fields attached to every record logged while they are bound, e.g. the task a worker is running
+_log_context: contextvars.ContextVar[dict] = contextvars.ContextVar("log_context", default={})
+
+_queue_handler = None
+_listener = None
+
+
+def bind_log_context(**fields) -> contextvars.Token:
+    return _log_context.set({**_log_context.get(), **fields})
+
+
+def clear_log_context():
+    _log_context.set({})
+
+
+@contextmanager
+def log_context(**fields):
+    token = bind_log_context(**fields)
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def strip_markup(message: str) -> str:
+    try:
+        return Text.from_markup(message, emoji=False).plain
+    except MarkupError:
+        return message
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copies the bound log context onto each record as `record.context`. It runs in the thread
+    that logs, which is the one the context belongs to.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.context = _log_context.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through the first `initial` INFO and DEBUG records of each call site per `window_seconds`
+    and every `thereafter`-th one after that (none when it is 0). Warnings and errors always pass.
+    Call sites rather than messages are counted, since messages are formatted before logging.
+    """
+
+    def __init__(self, initial: int, thereafter: int, window_seconds: float):
+        super().__init__()
+        self.initial = initial
+        self.thereafter = thereafter
+        self.window_seconds = window_seconds
+        self._windows: dict[tuple[str, int], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or record.created - window[0] >= self.window_seconds:
+                window = self._windows[key] = [record.created, 0]
+            window[1] += 1
+            count = window[1]
+        return count <= self.initial or (self.thereafter > 0 and (count - self.initial) % self.thereafter == 0)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the bound log context as top-level fields and rich markup removed.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": strip_markup(record.getMessage()),
+            **getattr(record, "context", {}),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without formatting them and never waits for room in
+    the queue: when it is full, records are dropped and counted, and the count is logged once
+    there is room again.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the message is fixed here, so later changes to its arguments do not show; the listener formats.
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                self.queue.put_nowait(logging.makeLogRecord({
+                    "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": f"Dropped {dropped} log records because the log queue was full.",
+                }))
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _start_listener(handlers: list[logging.Handler]):
+    global _listener
+    _queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_listener_in_child():
+    # The listener thread does not survive fork(); the child gets a queue and a listener of its own.
+    if _listener is not None:
+        _start_listener(list(_listener.handlers))
+
+
+def flush_logging():
+    """
+    Writes out the records still queued for the listener and stops it. For processes that end
+    with os._exit(), which skips the atexit hook doing the same.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _setup_queue_logging(root_logger: logging.Logger, handlers: list[logging.Handler]):
+    """
+    Logs through a queue: the calling thread only filters the record and enqueues it, while a
+    listener thread formats it and does the file and console I/O.
+    """
+    global _queue_handler
+    for handler in handlers:
+        handler.setFormatter(JsonFormatter())
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(ContextFilter())
+    if LOG_SAMPLE_INITIAL:
+        _queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_INITIAL, LOG_SAMPLE_THEREAFTER, LOG_SAMPLE_WINDOW_SECONDS))
+    _start_listener(handlers)
+    root_logger.addHandler(_queue_handler)
+    atexit.register(flush_logging)
+    os.register_at_fork(after_in_child=_restart_listener_in_child)
+
 
 def setup_logging():
-    LOG_DIR = "/app/data/logs"
     LOG_FILE = os.path.join(LOG_DIR, "app.log")
-    LOG_LEVEL = "INFO"
     
     os.makedirs(LOG_DIR, exist_ok=True)
     
@@ -33,8 +206,11 @@ def setup_logging():
     root_logger.setLevel(LOG_LEVEL)
     
     if not root_logger.hasHandlers():
-        root_logger.addHandler(file_handler)
-        root_logger.addHandler(console_handler)
+        if LOG_MODE == "json":
+            _setup_queue_logging(root_logger, [file_handler, logging.StreamHandler(sys.stderr)])
+        else:
+            root_logger.addHandler(file_handler)
+            root_logger.addHandler(console_handler)
     
     logging.getLogger("uvicorn.access").disabled = True
     root_logger.info("Logging configured successfully. Ready to log.")
\ No newline at end of file
@@ -5,55 +5,268 @@
 
 
 import os
-import shutil
-import logging
-import io
+import json
+import time
+import uuid
+import tarfile
 import zipfile
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import StreamingResponse
+import logging
+import anyio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Header, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, Response, RedirectResponse
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, Field, ValidationError
+import redis.asyncio as aioredis
+from celery import group
 from celery.result import AsyncResult
-from app.worker import create_pdf_analysis_task, celery_app
+from app.worker import render_visualizations_task, celery_app
+from app.process_pdf import OUTPUT_KINDS, VISUALIZATION_KINDS, STREAM_FILENAME
+from app.cache import result_cache, compute_cache_key
+from app.submission import (
+    parse_outputs, parse_priority, parse_page_range, analysis_options, save_upload,
+    answer_from_cache, build_analysis_signature, validate_callback_url, prepare_signature,
+    withdraw_signature, enqueue_analysis, hand_off_upload, document_pages
+)
+from app.uploads import UploadLimitMiddleware, receive_pdf_upload
+from app.admission import AdmissionMiddleware, admission, client_id
+from app.task_status import fetch_task_states, error_message
+from app.notifications import TASK_EVENTS_CHANNEL, TERMINAL_STATES
+from app.batches import is_archive, iter_archive_pdfs, unique_filename, save_batch, load_batch, summarize_batch
+from app.model_warmup import list_worker_states
+from app.autoscaling import autoscaling_report
+from app.scheduling import choose_queue, analysis_queues, time_limits
+from app.metrics import MetricsMiddleware, QueueCollector, metrics_payload, forget_worker_process
+from prometheus_client import CONTENT_TYPE_LATEST
+from app.preclassify import load_document_profile
+from app.config import (
+    REDIS_URL, OUTPUT_DIR, SHARD_PAGES, BATCH_MAX_FILES, EVENT_STREAM_KEEPALIVE, MAX_UPLOAD_BYTES,
+    MAX_BATCH_UPLOAD_BYTES, CONTENT_LIST_MAX_PAGES, STREAM_POLL_SECONDS
+)
+from app.zipstream import ZipStream, collect_members, load_layout, save_layout
+from app.storage import storage, task_paths, remove_task_files
+from app.dead_letter import dead_letters
+from app.object_store import object_store
+from app.artifacts import (
+    ARTIFACTS, file_response, json_response, file_etag, image_file_path, image_media_type,
+    content_list_pages, content_stream_chunk, content_stream_from_list
+)
 from app.logging_config import setup_logging
 
 setup_logging()
 logger = logging.getLogger(__name__)
 
-CONTAINER_INPUT_DIR = "/app/data/input_pdfs"
-CONTAINER_OUTPUT_DIR = "/app/data/output"
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Folds this uvicorn process's live gauges out of the shared PROMETHEUS_MULTIPROC_DIR.
+    forget_worker_process(os.getpid())
 
 app = FastAPI(
     title="Magic PDF Analysis Service with Celery",
     description="An API to submit PDF analysis tasks, check their status, and download results.",
-    version="4.0.0"
+    version="4.0.0",
+    lifespan=lifespan
 )
+app.add_middleware(UploadLimitMiddleware, limits={"/process-pdf/": MAX_UPLOAD_BYTES, "/batches/": MAX_BATCH_UPLOAD_BYTES})
+# Outside the upload limits, so turned-away submissions do not wait for an upload slot.
+app.add_middleware(AdmissionMiddleware, paths=("/process-pdf/", "/batches/"))
+# Added last so it is outermost and also times requests rejected by the upload limits.
+app.add_middleware(MetricsMiddleware)
+queue_collector = QueueCollector(analysis_queues)
 
-@app.post("/process-pdf/", status_code=202, summary="Submit a PDF for processing")
-def submit_pdf_processing(file: UploadFile = File(..., description="The PDF file to be processed.")):
-    if not file.filename or not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="Invalid file type. Only PDF files are accepted.")
+class ProcessPdfForm(BaseModel):
+    shard_pages: int | None = Field(None, ge=0, description="Split documents into sub-tasks of this many pages (0 disables sharding). Defaults to the server setting.")
+    outputs: str | None = Field(None, description=f"Comma-separated outputs to generate, from: {', '.join(OUTPUT_KINDS)}. Defaults to the server setting.")
+    callback_url: str | None = Field(None, description="Optional http(s) URL that receives a JSON POST when the task finishes.")
+    priority: str = Field("auto", description="'high' forces the interactive queue, 'low' the bulk queue; 'auto' routes by document size.")
+    start_page: int | None = Field(None, ge=0, description="First page to analyze (0-based). Outputs keep the original page numbers.")
+    end_page: int | None = Field(None, ge=0, description="Last page to analyze, inclusive. Defaults to the last page of the document.")
+    text_only: bool = Field(False, description="Only extract text: skip formula and table recognition and leave images, tables and formulas out of the outputs.")
+    stream: bool = Field(False, description="Write finished pages to a JSONL content stream while the analysis runs (see /tasks/{task_id}/content_stream).")
 
-    name_without_ext = os.path.splitext(str(file.filename))[0]
-    task_output_dir = os.path.join(CONTAINER_OUTPUT_DIR, name_without_ext)
-    os.makedirs(task_output_dir, exist_ok=True)
-    
-    input_pdf_path = os.path.join(CONTAINER_INPUT_DIR, str(file.filename))
+# The body is parsed by receive_pdf_upload rather than by FastAPI, so it is described here.
+PROCESS_PDF_REQUEST_BODY = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object",
+    "required": ["file"],
+    "properties": {
+        "file": {"type": "string", "format": "binary", "description": "The PDF file to be processed."},
+        **ProcessPdfForm.model_json_schema()["properties"]
+    }
+}}}}}
+
+@app.post("/process-pdf/", status_code=202, summary="Submit a PDF for processing", openapi_extra=PROCESS_PDF_REQUEST_BODY)
+async def submit_pdf_processing(request: Request):
+    task_id = str(uuid.uuid4())
+    task_output_dir = os.path.join(OUTPUT_DIR, task_id)
+
+    def destination(filename: str) -> str:
+        # Checked from the part headers, before a byte of the file is written.
+        if not filename or not filename.lower().endswith(".pdf"):
+            raise HTTPException(status_code=400, detail="Invalid file type. Only PDF files are accepted.")
+        return task_paths(task_id, os.path.basename(filename))[0]
+
+    # The file is written to the task's upload path while the body arrives, never spooled first.
     try:
-        with open(input_pdf_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        logger.info(f"Received and saved file to: {input_pdf_path}")
-    except Exception as e:
-        logger.error(f"Error saving file: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Failed to save uploaded file: {e}")
-    finally:
-        file.file.close()
-
-    task = create_pdf_analysis_task.delay(
-        pdf_path=input_pdf_path,
-        output_dir=task_output_dir
+        upload = await receive_pdf_upload(request, "file", destination)
+        # Empty fields count as not sent, as they do for Form parameters.
+        form = ProcessPdfForm.model_validate({name: value for name, value in upload.fields.items() if value != ""})
+        selected_outputs = parse_outputs(form.outputs)
+        callback_url = validate_callback_url(form.callback_url)
+        priority = parse_priority(form.priority)
+        start_page, end_page = parse_page_range(form.start_page, form.end_page)
+        options = analysis_options(selected_outputs, start_page, end_page, form.text_only, form.stream)
+    except ValidationError as e:
+        remove_task_files(task_id)
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)])
+    except BaseException:
+        remove_task_files(task_id)
+        raise
+
+    # The cache lookup, page inspection and broker publish are short blocking calls.
+    try:
+        return await run_in_threadpool(
+            enqueue_analysis, task_id, upload.path, task_output_dir, upload.filename, upload.sha256, options,
+            shard_pages=SHARD_PAGES if form.shard_pages is None else form.shard_pages,
+            priority=priority,
+            callback_url=callback_url,
+            client=client_id(request.headers, request.client.host if request.client else None)
+        )
+    except BaseException:
+        remove_task_files(task_id)
+        raise
+
+@app.post("/batches/", status_code=202, summary="Submit many PDFs (or zip/tar archives of PDFs) as one batch")
+def submit_pdf_batch(
+    request: Request,
+    files: list[UploadFile] = File(..., description="PDF files and/or .zip/.tar/.tar.gz archives containing PDF files."),
+    outputs: str | None = Form(None, description=f"Comma-separated outputs to generate, from: {', '.join(OUTPUT_KINDS)}. Defaults to the server setting."),
+    callback_url: str | None = Form(None, description="Optional http(s) URL that receives a JSON POST whenever a task of the batch finishes."),
+    priority: str = Form("auto", description="'high' forces the interactive queue, 'low' the bulk queue; 'auto' routes each file by its size.")
+):
+    selected_outputs = parse_outputs(outputs)
+    callback_url = validate_callback_url(callback_url)
+    priority = parse_priority(priority)
+    options = analysis_options(selected_outputs)
+    used_names: set[str] = set()
+    # Every file is saved, checked and profiled before anything is recorded for any of them, so a
+    # file rejected later in the request leaves no tasks, webhooks or cache answers behind.
+    prepared: list[dict] = []
+
+    def prepare(filename: str, source):
+        if len(prepared) >= BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"A batch may contain at most {BATCH_MAX_FILES} PDF files.")
+        filename = unique_filename(filename, used_names)
+        task_id = str(uuid.uuid4())
+        input_pdf_path, task_output_dir = task_paths(task_id, filename)
+        entry = {"filename": filename, "task_id": task_id, "input_pdf_path": input_pdf_path}
+        prepared.append(entry)
+        sha256 = save_upload(source, input_pdf_path)
+        entry["cache_key"] = compute_cache_key(sha256, options=options)
+        entry["cached"] = result_cache.lookup(entry["cache_key"])
+        if not entry["cached"]:
+            entry["signature"], entry["document"] = build_analysis_signature(
+                task_id, input_pdf_path, task_output_dir, entry["cache_key"], options, priority=priority
+            )
+
+    try:
+        for upload in files:
+            filename = os.path.basename(str(upload.filename or ""))
+            try:
+                if is_archive(filename):
+                    try:
+                        for member_name, member in iter_archive_pdfs(filename, upload.file):
+                            prepare(member_name, member)
+                    except (zipfile.BadZipFile, tarfile.TarError) as e:
+                        raise HTTPException(status_code=400, detail=f"Could not read archive '{filename}': {e}")
+                elif filename.lower().endswith(".pdf"):
+                    prepare(filename, upload.file)
+                else:
+                    raise HTTPException(status_code=400, detail=f"Invalid file type for '{filename}'. Only PDF files and zip/tar archives are accepted.")
+            finally:
+                upload.file.close()
+
+        if not prepared:
+            raise HTTPException(status_code=400, detail="The batch does not contain any PDF files.")
+        for entry in prepared:
+            if not entry["cached"]:
+                hand_off_upload(entry["input_pdf_path"])
+    except BaseException:
+        for entry in prepared:
+            remove_task_files(entry["task_id"])
+        raise
+
+    uncached = [entry for entry in prepared if not entry["cached"]]
+    for entry in uncached:
+        prepare_signature(entry["signature"], callback_url, entry["document"])
+        storage.register(entry["task_id"])
+    try:
+        # All uncached documents are published through one group call on a single broker connection,
+        # before any cached one is answered, so a failed publish leaves nothing of the batch behind.
+        batch_id = group([entry["signature"] for entry in uncached]).apply_async().id if uncached else str(uuid.uuid4())
+    except BaseException:
+        for entry in prepared:
+            if not entry["cached"]:
+                withdraw_signature(entry["task_id"])
+            remove_task_files(entry["task_id"])
+        raise
+
+    tasks = []
+    for entry in prepared:
+        filename, task_id = entry["filename"], entry["task_id"]
+        if entry["cached"]:
+            answer_from_cache(entry["cache_key"], filename, callback_url, task_id, cached=entry["cached"])
+            tasks.append({"filename": filename, "task_id": task_id, "cached": True})
+        else:
+            tasks.append({"filename": filename, "task_id": task_id, "cached": False, "queue": entry["document"]["queue"]})
+    client = client_id(request.headers, request.client.host if request.client else None)
+    for entry in uncached:
+        admission.admit(entry["task_id"], document_pages(entry["document"]), client)
+    save_batch(batch_id, tasks, int(celery_app.conf.result_expires.total_seconds()))
+    logger.info(f"Submitted batch {batch_id} with {len(tasks)} files ({len(tasks) - len(uncached)} answered from cache).")
+
+    return {
+        "batch_id": batch_id,
+        "total": len(tasks),
+        "cached": len(tasks) - len(uncached),
+        "status_url": f"/batches/{batch_id}",
+        "download_url": f"/batches/{batch_id}/download"
+    }
+
+@app.get("/batches/{batch_id}", summary="Check the aggregate status and progress of a batch")
+def get_batch_status(batch_id: str):
+    manifest = load_batch(batch_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Batch not found or expired.")
+    states = {state["task_id"]: state["status"] for state in fetch_task_states([task["task_id"] for task in manifest["tasks"]], include_result=False)}
+    return summarize_batch(manifest, states)
+
+@app.get("/batches/{batch_id}/download", summary="Download the results of all finished tasks of a batch as one ZIP")
+def download_batch_results(batch_id: str):
+    manifest = load_batch(batch_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Batch not found or expired.")
+
+    members, seen_dirs = [], set()
+    for task in manifest["tasks"]:
+        task_result = AsyncResult(task["task_id"], app=celery_app)
+        if not task_result.successful():
+            continue
+        output_dir = task_result.result.get("output_directory")
+        if not output_dir or output_dir in seen_dirs or not object_store.fetch(output_dir):
+            continue
+        seen_dirs.add(output_dir)
+        members.extend(collect_members(output_dir, os.path.splitext(task["filename"])[0]))
+
+    if not members:
+        raise HTTPException(status_code=409, detail="No task of this batch has finished successfully yet.")
+
+    return StreamingResponse(
+        ZipStream(members),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=batch_{batch_id}.zip"}
     )
-    logger.info(f"Submitted task {task.id} for file '{file.filename}'. Output will be in '{task_output_dir}'")
-    
-    return {"task_id": task.id, "status_url": f"/tasks/status/{task.id}"}
 
 @app.get("/tasks/status/{task_id}", summary="Check the status of a task")
 def get_task_status(task_id: str):
@@ -61,14 +274,75 @@ def get_task_status(task_id: str):
     response = {
         "task_id": task_id,
         "status": task_result.status,
-        "result": task_result.result if task_result.ready() else None
+        "result": task_result.result if task_result.ready() else None,
+        # Stage, pages done and stage timings of a running analysis
+        "progress": task_result.info if task_result.status == "PROGRESS" else None,
+        # Page count, text coverage, image density and routing decided at submit time
+        "document": load_document_profile(task_id)
     }
     if task_result.failed():
-        response["result"] = str(task_result.info)
+        response["result"] = error_message(task_result.info)
+        # Reason, error and attempts, when the failure was final rather than a lost dependency
+        response["dead_letter"] = dead_letters.get(task_id)
     return response
 
+class BulkStatusRequest(BaseModel):
+    task_ids: list[str] = Field(..., max_length=10000, description="The task IDs to look up.")
+    include_result: bool = Field(True, description="Include the result summary of successful tasks, as `/tasks/status/{task_id}` does.")
+
+@app.post("/tasks/status", summary="Check the status of many tasks at once")
+def get_bulk_task_status(request: BulkStatusRequest):
+    return {"tasks": fetch_task_states(request.task_ids, request.include_result)}
+
+@app.get("/tasks/events", summary="Stream task state changes as Server-Sent Events")
+async def stream_task_events(
+    request: Request,
+    task_id: list[str] = Query([], description="Only stream events of these tasks. Streams every task when empty.")
+):
+    watched = set(task_id)
+
+    async def event_stream():
+        client = aioredis.from_url(REDIS_URL, decode_responses=True)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(TASK_EVENTS_CHANNEL)
+        try:
+            # Subscribe first, then send a snapshot, so no transition falls in between.
+            pending = set(watched)
+            if watched:
+                for state in await run_in_threadpool(fetch_task_states, list(watched)):
+                    yield f"event: task\ndata: {json.dumps(state, default=str)}\n\n"
+                    if state["status"] in TERMINAL_STATES:
+                        pending.discard(state["task_id"])
+                if not pending:
+                    return
+
+            while not await request.is_disconnected():
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=EVENT_STREAM_KEEPALIVE)
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                event = json.loads(message["data"])
+                if watched and event["task_id"] not in watched:
+                    continue
+                yield f"event: task\ndata: {message['data']}\n\n"
+                if watched and event["status"] in TERMINAL_STATES:
+                    pending.discard(event["task_id"])
+                    if not pending:
+                        return
+        finally:
+            await pubsub.unsubscribe(TASK_EVENTS_CHANNEL)
+            await pubsub.aclose()
+            await client.aclose()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.get("/tasks/result/download/{task_id}", summary="Download the results of a completed task")
-def download_task_result(task_id: str):
+def download_task_result(
+    task_id: str,
+    presigned: bool | None = Query(None, description="Redirect to a presigned URL of the object store instead of streaming through the API. Defaults to yes when the store supports it."),
+    range_header: str | None = Header(None, alias="Range"),
+    if_range: str | None = Header(None, alias="If-Range")
+):
     task_result = AsyncResult(task_id, app=celery_app)
 
     if not task_result.ready():
@@ -78,25 +352,263 @@ def download_task_result(task_id: str):
     
     result_data = task_result.result
     output_dir = result_data.get("output_directory")
+    # Outputs are stored per task id; the archive is still laid out under the document name.
+    dir_name = os.path.splitext(os.path.basename(result_data["input_file"]))[0]
+
+    if output_dir and _wants_presigned(presigned):
+        url = object_store.archive_url(task_id, output_dir, dir_name, f"results_{dir_name}.zip")
+        if url:
+            return RedirectResponse(url, status_code=307)
 
-    if not output_dir or not os.path.isdir(output_dir):
+    if not output_dir or not object_store.fetch(output_dir):
         logger.error(f"Output directory not found for task {task_id}: {output_dir}")
         raise HTTPException(status_code=404, detail="Result directory not found.")
     
-    zip_io = io.BytesIO()
-    dir_name = os.path.basename(output_dir)
-
-    with zipfile.ZipFile(zip_io, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, _, files in os.walk(output_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                archive_path = os.path.relpath(file_path, output_dir)
-                zipf.write(file_path, arcname=os.path.join(dir_name, archive_path))
-    
-    zip_io.seek(0)
-    
-    return StreamingResponse(
-        zip_io,
-        media_type="application/zip",
-        headers={"Content-Disposition": f"attachment; filename=results_{dir_name}.zip"}
-    )
\ No newline at end of file
+    zip_stream = ZipStream(collect_members(output_dir, dir_name))
+    etag = zip_stream.etag
+    # Sizes and CRCs of the members from an earlier download, so resuming compresses nothing twice.
+    zip_stream.layout = load_layout(etag)
+    headers = {
+        "Content-Disposition": f"attachment; filename=results_{dir_name}.zip",
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+    }
+
+    if range_header and (not if_range or if_range == etag):
+        had_layout = zip_stream.layout is not None
+        total = zip_stream.size()
+        if not had_layout:
+            save_layout(etag, zip_stream.layout)
+        byte_range = _parse_byte_range(range_header, total)
+        if byte_range is None:
+            raise HTTPException(status_code=416, detail="Requested range not satisfiable.", headers={"Content-Range": f"bytes */{total}"})
+        start, end = byte_range
+        headers.update({"Content-Range": f"bytes {start}-{end}/{total}", "Content-Length": str(end - start + 1)})
+        logger.info(f"Resuming download of task {task_id} at byte {start} of {total}")
+        return StreamingResponse(zip_stream.iter_range(start, end), status_code=206, media_type="application/zip", headers=headers)
+
+    return StreamingResponse(_remember_layout(zip_stream, etag), media_type="application/zip", headers=headers)
+
+def _remember_layout(zip_stream: ZipStream, etag: str):
+    had_layout = zip_stream.layout is not None
+    yield from zip_stream
+    if not had_layout:
+        save_layout(etag, zip_stream.layout)
+
+def _parse_byte_range(range_header: str, total: int) -> tuple[int, int] | None:
+    """
+    Parses a single `bytes=start-end` range (including open-ended and suffix forms).
+    Returns None when the range cannot be satisfied.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec or "-" not in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), total - 1) if last else total - 1
+        else:
+            start = max(total - int(last), 0)
+            end = total - 1
+    except ValueError:
+        return None
+    if start > end or start >= total:
+        return None
+    return start, end
+
+def _wants_presigned(presigned: bool | None) -> bool:
+    return object_store.presigns and presigned is not False
+
+def _finished_result(task_id: str) -> dict:
+    task_result = AsyncResult(task_id, app=celery_app)
+    if not task_result.ready():
+        raise HTTPException(status_code=409, detail="Task is still processing. Please wait.")
+    if task_result.failed():
+        raise HTTPException(status_code=404, detail="Task failed and has no result.")
+    result_data = task_result.result
+    # Files fetched from an object store to serve them here are pruned once they are old.
+    object_store.prune_local()
+    output_dir = result_data.get("output_directory")
+    if not output_dir or not object_store.exists(output_dir):
+        raise HTTPException(status_code=404, detail="Result directory not found.")
+    return result_data
+
+def _artifact_path(result_data: dict, artifact: str, fetch: bool = True) -> str:
+    """
+    Returns the path of an artifact of a finished task. With `fetch`, it is copied from the
+    object store first, so it can be read locally.
+    """
+    if artifact not in ARTIFACTS:
+        raise HTTPException(status_code=404, detail=f"Unknown artifact '{artifact}'. Choose from: {', '.join(ARTIFACTS)}.")
+    path = result_data.get("generated_files", {}).get(ARTIFACTS[artifact][0])
+    if not path or not (object_store.fetch(path) if fetch else object_store.exists(path)):
+        raise HTTPException(status_code=404, detail=f"'{artifact}' was not generated for this task.")
+    return path
+
+@app.get("/tasks/result/{task_id}/images/{image_path:path}", summary="Download a single extracted image of a completed task")
+def get_task_image(
+    task_id: str,
+    image_path: str,
+    presigned: bool | None = Query(None, description="Redirect to a presigned URL of the object store. Defaults to yes when the store supports it."),
+    if_none_match: str | None = Header(None, alias="If-None-Match")
+):
+    path = image_file_path(_finished_result(task_id)["output_directory"], image_path)
+    if path is not None and _wants_presigned(presigned) and object_store.exists(path):
+        return RedirectResponse(object_store.presigned_url(path), status_code=307)
+    if path is None or not object_store.fetch(path) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Image not found.")
+    # Images are already compressed.
+    return file_response(path, image_media_type(path), if_none_match, None, compressible=False)
+
+@app.get("/tasks/result/{task_id}/content_list/pages", summary="Get the content list items of a page range")
+def get_content_list_pages(
+    task_id: str,
+    start_page: int = Query(0, ge=0, description="First page (0-based, matching page_idx)."),
+    end_page: int | None = Query(None, ge=0, description=f"Last page, inclusive. Defaults to start_page + 9; at most {CONTENT_LIST_MAX_PAGES} pages per request."),
+    if_none_match: str | None = Header(None, alias="If-None-Match"),
+    accept_encoding: str | None = Header(None, alias="Accept-Encoding")
+):
+    end_page = start_page + 9 if end_page is None else end_page
+    if end_page < start_page:
+        raise HTTPException(status_code=400, detail="end_page must not be smaller than start_page.")
+    end_page = min(end_page, start_page + CONTENT_LIST_MAX_PAGES - 1)
+
+    result_data = _finished_result(task_id)
+    path = _artifact_path(result_data, "content_list")
+    etag = f'{file_etag(path)[:-1]}-{start_page}-{end_page}"'
+    payload = content_list_pages(path, start_page, end_page, result_data.get("page_count"))
+    return json_response({"task_id": task_id, **payload}, etag, if_none_match, accept_encoding)
+
+@app.get("/tasks/result/{task_id}/{artifact}", summary="Download a single result file (markdown, content_list, middle_json, model_json)")
+def get_task_artifact(
+    task_id: str,
+    artifact: str,
+    presigned: bool | None = Query(None, description="Redirect to a presigned URL of the object store. Defaults to yes when the store supports it."),
+    if_none_match: str | None = Header(None, alias="If-None-Match"),
+    accept_encoding: str | None = Header(None, alias="Accept-Encoding")
+):
+    result_data = _finished_result(task_id)
+    if _wants_presigned(presigned):
+        path = _artifact_path(result_data, artifact, fetch=False)
+        return RedirectResponse(object_store.presigned_url(path, os.path.basename(path)), status_code=307)
+    path = _artifact_path(result_data, artifact)
+    return file_response(path, ARTIFACTS[artifact][1], if_none_match, accept_encoding)
+
+@app.get("/tasks/{task_id}/content_stream", summary="Tail the page-by-page content of a task, also while it is running")
+def get_content_stream(
+    task_id: str,
+    request: Request,
+    offset: int = Query(0, ge=0, description="Byte offset to continue from, as returned in X-Stream-Offset."),
+    follow: bool = Query(False, description="Keep the response open and send pages as they finish, until the task ends.")
+):
+    task_result = AsyncResult(task_id, app=celery_app)
+    if task_result.failed():
+        raise HTTPException(status_code=404, detail="Task failed and has no result.")
+
+    if task_result.successful():
+        result_data = _finished_result(task_id)
+        path = result_data.get("generated_files", {}).get("content_stream")
+        data = object_store.read_from(path, offset) if path else None
+        if data is not None:
+            chunk, next_offset = content_stream_chunk(data, offset)
+        else:
+            start_page, end_page = result_data.get("page_range") or (0, result_data.get("page_count", 0) - 1)
+            chunk = content_stream_from_list(_artifact_path(result_data, "content_list"), start_page, end_page)[offset:]
+            next_offset = offset + len(chunk)
+        return Response(chunk, media_type="application/x-ndjson", headers={"X-Stream-Offset": str(next_offset), "X-Stream-Complete": "true"})
+
+    document = load_document_profile(task_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Task not found or expired.")
+    if not document.get("stream"):
+        raise HTTPException(status_code=409, detail="Task was not submitted with stream=true; its content is available once it finishes.")
+    path = os.path.join(OUTPUT_DIR, task_id, STREAM_FILENAME)
+
+    if not follow:
+        chunk, next_offset = content_stream_chunk(object_store.read_from(path, offset) or b"", offset)
+        return Response(chunk, media_type="application/x-ndjson", headers={"X-Stream-Offset": str(next_offset), "X-Stream-Complete": "false"})
+
+    async def follow_stream(offset: int):
+        # Polls from the event loop, so a follower holds no threadpool thread while it waits for pages.
+        last_sent = time.monotonic()
+        while not await request.is_disconnected():
+            # Checked before reading, so the lines written just before the task ended are still sent.
+            finished = await run_in_threadpool(AsyncResult(task_id, app=celery_app).ready)
+            data = await run_in_threadpool(object_store.read_from, path, offset)
+            chunk, offset = content_stream_chunk(data or b"", offset)
+            if chunk:
+                yield chunk
+                last_sent = time.monotonic()
+            if finished:
+                return
+            if time.monotonic() - last_sent >= EVENT_STREAM_KEEPALIVE:
+                # A blank line keeps proxies from closing an idle response; it is not part of the stream's offsets.
+                yield b"\n"
+                last_sent = time.monotonic()
+            await anyio.sleep(STREAM_POLL_SECONDS)
+
+    return StreamingResponse(follow_stream(offset), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
+
+@app.post("/tasks/{task_id}/visualizations", status_code=202, summary="Render debug visual reports for a completed task")
+def request_visualizations(
+    task_id: str,
+    kinds: list[str] = Query(list(VISUALIZATION_KINDS), description=f"Visual reports to render, from: {', '.join(VISUALIZATION_KINDS)}.")
+):
+    unknown = [kind for kind in kinds if kind not in VISUALIZATION_KINDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown visual reports {unknown}. Choose from: {', '.join(VISUALIZATION_KINDS)}.")
+
+    task_result = AsyncResult(task_id, app=celery_app)
+    if not task_result.ready():
+        raise HTTPException(status_code=409, detail="Task is still processing. Please wait.")
+    if task_result.failed():
+        raise HTTPException(status_code=404, detail="Task failed and has no result to visualize.")
+
+    result_data = task_result.result
+    output_dir = result_data.get("output_directory")
+    if not output_dir or not object_store.exists(output_dir):
+        raise HTTPException(status_code=404, detail="Result directory not found.")
+
+    task = render_visualizations_task.apply_async(
+        kwargs={"pdf_path": result_data["input_file"], "output_dir": output_dir, "kinds": kinds},
+        queue=choose_queue(result_data.get("page_count", 0)),
+        **time_limits(result_data.get("page_count", 0))
+    )
+    logger.info(f"Submitted visualization task {task.id} for task {task_id}: {kinds}")
+    return {"task_id": task.id, "status_url": f"/tasks/status/{task.id}", "download_url": f"/tasks/result/download/{task_id}"}
+
+@app.get("/cache/stats", summary="Report result cache hit/miss counters and size")
+def get_cache_stats():
+    return result_cache.stats()
+
+@app.get("/storage/usage", summary="Report the disk space held by task inputs and outputs")
+def get_storage_usage():
+    return storage.usage()
+
+@app.get("/dead-letters", summary="List analysis tasks that failed for good, newest first")
+def list_dead_letters(limit: int = Query(100, ge=1, le=1000, description="Maximum number of entries to return.")):
+    return {"total": dead_letters.count(), "entries": dead_letters.list(limit)}
+
+@app.get("/metrics", summary="Prometheus metrics of the API and the Celery queues")
+def get_metrics():
+    # Worker-side metrics (stage durations, throughput, memory) are served by each worker's exporter.
+    return Response(metrics_payload([queue_collector]), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/workers/status", summary="Report model warmup and readiness of each worker process")
+def get_workers_status():
+    workers = list_worker_states()
+    return {
+        "ready": sum(1 for worker in workers if worker.get("ready")),
+        "total": len(workers),
+        "workers": workers
+    }
+
+@app.get("/autoscaling", summary="Report the backlog in pages, recent pages/sec per worker and the worker count to drain it in time")
+def get_autoscaling():
+    # Polled by an autoscaler: scale worker processes (replicas x --concurrency) to `recommended_workers`.
+    try:
+        return autoscaling_report()
+    except Exception as e:
+        logger.error(f"Failed to build the autoscaling report: {e}", exc_info=True)
+        raise HTTPException(status_code=503, detail="The backlog could not be read. Please retry later.")
@@ -0,0 +1,216 @@
+# Prometheus metrics of the API, the Celery queues and the analysis pipeline.
+
+# app/metrics.py
+
+import os
+import json
+import time
+import logging
+from prometheus_client import (
+    Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, generate_latest, multiprocess,
+    start_http_server
+)
+from prometheus_client.core import GaugeMetricFamily
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Set in worker containers: child processes write their samples to files in this directory.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+# kombu's Redis transport keeps one list per priority step; step 0 uses the plain queue name.
+_PRIORITY_SEPARATOR = "\x06\x16"
+_PRIORITY_STEPS = (3, 6, 9)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "mineru_http_request_duration_seconds", "Latency of HTTP requests.",
+    ["method", "route", "status"]
+)
+UPLOAD_BYTES = Counter("mineru_upload_bytes_total", "Bytes of uploaded PDF files saved to disk.")
+UPLOAD_SIZE_BYTES = Histogram(
+    "mineru_upload_size_bytes", "Size of uploaded PDF files.",
+    buckets=(64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6, 1e9, float("inf"))
+)
+
+STAGE_SECONDS = Histogram(
+    "mineru_stage_duration_seconds", "Time spent per document in each pipeline stage.", ["stage"],
+    buckets=(0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, float("inf"))
+)
+DOCUMENTS = Counter("mineru_documents_processed_total", "Analyzed documents by analysis mode.", ["mode"])
+PAGES = Counter("mineru_pages_processed_total", "Analyzed pages by analysis mode.", ["mode"])
+PAGES_PER_SECOND = Histogram(
+    "mineru_inference_pages_per_second", "Inference throughput per document.", ["mode"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, float("inf"))
+)
+INFERENCE_BATCH_DOCUMENTS = Histogram(
+    "mineru_inference_batch_documents", "Documents per micro-batched inference call.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, float("inf"))
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "mineru_task_queue_wait_seconds", "Time tasks spent in the queue before a worker started them.", ["queue"],
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600, float("inf"))
+)
+TASKS = Counter("mineru_tasks_total", "Finished Celery tasks by name and state.", ["task", "state"])
+DEAD_LETTERS = Counter("mineru_dead_letter_tasks_total", "Analysis tasks that failed for good, by reason.", ["task", "reason"])
+PEAK_RSS_BYTES = Histogram(
+    "mineru_task_peak_rss_bytes", "Peak resident memory while running one task.", ["task"],
+    buckets=(256e6, 512e6, 1e9, 2e9, 4e9, 8e9, 16e9, 32e9, float("inf"))
+)
+ADMISSION_REJECTIONS = Counter("mineru_admission_rejections_total", "Submissions turned away by admission control, by reason.", ["reason"])
+WORKER_RSS_BYTES = Gauge(
+    "mineru_worker_rss_bytes", "Resident memory of each worker process.", multiprocess_mode="liveall"
+)
+
+
+def record_upload(size_bytes: int):
+    UPLOAD_BYTES.inc(size_bytes)
+    UPLOAD_SIZE_BYTES.observe(size_bytes)
+
+
+def record_analysis(result: dict, task: str):
+    """
+    Records stage durations, peak memory, page counts and throughput from the summary of a
+    finished analysis.
+    """
+    if "peak_rss_bytes" in result:
+        PEAK_RSS_BYTES.labels(task=task).observe(result["peak_rss_bytes"])
+    for stage, seconds in result.get("stage_seconds", {}).items():
+        STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    mode = result.get("analysis_mode")
+    if not mode:
+        return
+    mode = mode.lower()
+    # Only the requested page range went through inference.
+    start_page, end_page = result.get("page_range") or (0, result.get("page_count", 0) - 1)
+    pages = end_page - start_page + 1
+    DOCUMENTS.labels(mode=mode).inc()
+    PAGES.labels(mode=mode).inc(pages)
+    inference_seconds = result.get("stage_seconds", {}).get("doc_analyze")
+    if pages and inference_seconds:
+        PAGES_PER_SECOND.labels(mode=mode).observe(pages / inference_seconds)
+
+
+def _queue_keys(queue: str) -> list[str]:
+    return [queue] + [f"{queue}{_PRIORITY_SEPARATOR}{step}" for step in _PRIORITY_STEPS]
+
+
+def queue_depths(queues: list[str]) -> dict[str, int]:
+    pipe = get_redis().pipeline(transaction=False)
+    for queue in queues:
+        for key in _queue_keys(queue):
+            pipe.llen(key)
+    lengths = pipe.execute()
+    steps = len(_PRIORITY_STEPS) + 1
+    return {queue: sum(lengths[index * steps:(index + 1) * steps]) for index, queue in enumerate(queues)}
+
+
+class QueueCollector:
+    """
+    Reads the depth and the age of the oldest waiting message of each Celery queue straight
+    from the Redis broker at scrape time. Ages come from the `submitted_at` header stamped on
+    every published task.
+    """
+
+    def __init__(self, queues):
+        self.queues = queues
+
+    def collect(self):
+        depth = GaugeMetricFamily("mineru_queue_depth", "Messages waiting in each Celery queue.", labels=["queue"])
+        age = GaugeMetricFamily("mineru_queue_oldest_task_age_seconds", "Age of the oldest waiting message in each Celery queue.", labels=["queue"])
+        try:
+            client = get_redis()
+            now = time.time()
+            for queue in self.queues():
+                keys = _queue_keys(queue)
+                pipe = client.pipeline(transaction=False)
+                for key in keys:
+                    pipe.llen(key)
+                    # Messages are pushed on the left and consumed from the right.
+                    pipe.lindex(key, -1)
+                replies = pipe.execute()
+                lengths, oldest = replies[0::2], replies[1::2]
+                submitted = [
+                    json.loads(raw).get("headers", {}).get("submitted_at")
+                    for raw in oldest if raw
+                ]
+                submitted = [value for value in submitted if value]
+                depth.add_metric([queue], sum(lengths))
+                age.add_metric([queue], now - min(submitted) if submitted else 0.0)
+        except Exception:
+            logger.warning("Could not read Celery queue metrics from the broker.", exc_info=True)
+            return
+        yield depth
+        yield age
+
+
+class MetricsMiddleware:
+    """
+    Times every HTTP request and labels it with the route template rather than the raw path,
+    so task ids do not blow up the label cardinality.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started_at = time.perf_counter()
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status)
+            ).observe(time.perf_counter() - started_at)
+
+
+def _multiprocess_registry() -> CollectorRegistry:
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_payload(collectors=()) -> bytes:
+    """
+    Renders this process's metrics (or those of all processes in multiprocess mode) followed
+    by the samples of `collectors`, which are evaluated on every scrape.
+    """
+    registry = _multiprocess_registry() if MULTIPROC_DIR else REGISTRY
+    scrape_registry = CollectorRegistry()
+    for collector in collectors:
+        scrape_registry.register(collector)
+    return generate_latest(registry) + generate_latest(scrape_registry)
+
+
+def start_worker_exporter(port: int):
+    """
+    Serves the metrics of all child processes of this worker on `port`. Sample files left over
+    from earlier runs are removed first.
+    """
+    if not MULTIPROC_DIR or not port:
+        return
+    for name in os.listdir(MULTIPROC_DIR):
+        if name.endswith(".db") and not name.endswith(f"_{os.getpid()}.db"):
+            os.remove(os.path.join(MULTIPROC_DIR, name))
+    start_http_server(port, registry=_multiprocess_registry())
+    logger.info(f"Serving worker metrics on port {port}")
+
+
+def forget_worker_process(pid: int):
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,120 @@
+# Preloads the layout/MFD/OCR models once per worker process and reports readiness.
+
+# app/model_warmup.py
+
+import os
+import json
+import time
+import socket
+import logging
+import resource
+import threading
+from app.config import WARMUP_MODES, WORKER_HEARTBEAT_SECONDS, WORKER_STALE_SECONDS
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+WORKERS_KEY = "mineru:workers"
+
+# The state this process last reported, re-sent with a fresh `last_seen` by the heartbeat thread
+_state: dict = {}
+_heartbeat_pid = None
+_heartbeat_stop = threading.Event()
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is the peak rather than the current RSS, but it is the best we have off Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def warm_up_models(modes: list[str] = WARMUP_MODES) -> dict:
+    """
+    Loads the models `doc_analyze` will ask `ModelSingleton` for, so they stay resident in this
+    process and the first task does not pay for loading them.
+    """
+    from magic_pdf.model.doc_analyze_by_custom_model import ModelSingleton
+
+    rss_before = current_rss_bytes()
+    started_at = time.perf_counter()
+    model_manager = ModelSingleton()
+    for mode in modes:
+        logger.info(f"Loading {mode} models into worker process {os.getpid()}...")
+        model_manager.get_model(mode == "ocr", False)
+    warmup_seconds = time.perf_counter() - started_at
+    rss_after = current_rss_bytes()
+
+    logger.info(f"✓ Models {modes} ready in {warmup_seconds:.1f}s, using {(rss_after - rss_before) / 2**20:.0f} MiB.")
+    return {
+        "ready": True,
+        "modes": modes,
+        "warmup_seconds": round(warmup_seconds, 3),
+        "model_memory_bytes": max(rss_after - rss_before, 0),
+        "rss_bytes": rss_after,
+        "ready_at": time.time(),
+    }
+
+
+def report_worker_state(state: dict):
+    """
+    Publishes the state of this worker process and keeps it fresh: a heartbeat thread re-sends
+    it every WORKER_HEARTBEAT_SECONDS, so a process that dies without clearing it ages out.
+    """
+    global _state, _heartbeat_pid
+    _state = {"worker": worker_id(), **state}
+    _write_state()
+    # Threads do not survive fork(), so a forked process starts its own.
+    if _heartbeat_pid != os.getpid():
+        _heartbeat_pid = os.getpid()
+        _heartbeat_stop.clear()
+        threading.Thread(target=_heartbeat, name="worker-heartbeat", daemon=True).start()
+
+
+def _write_state():
+    get_redis().hset(WORKERS_KEY, worker_id(), json.dumps({**_state, "last_seen": time.time()}))
+
+
+def _heartbeat():
+    while not _heartbeat_stop.wait(WORKER_HEARTBEAT_SECONDS):
+        try:
+            if not _heartbeat_stop.is_set():
+                _write_state()
+        except Exception:
+            logger.warning("Could not refresh the worker state.", exc_info=True)
+
+
+def clear_worker_state():
+    global _heartbeat_pid
+    _heartbeat_stop.set()
+    _heartbeat_pid = None
+    get_redis().hdel(WORKERS_KEY, worker_id())
+
+
+def list_worker_states() -> list[dict]:
+    """
+    The states of the worker processes seen within WORKER_STALE_SECONDS; older ones belong to
+    processes that were killed or lost with their node, and are removed.
+    """
+    redis_client = get_redis()
+    cutoff = time.time() - WORKER_STALE_SECONDS
+    states, stale = [], []
+    for worker, raw in redis_client.hgetall(WORKERS_KEY).items():
+        state = json.loads(raw)
+        if state.get("last_seen", 0) < cutoff:
+            stale.append(worker)
+        else:
+            states.append(state)
+    if stale:
+        redis_client.hdel(WORKERS_KEY, *stale)
+        logger.info(f"Dropped {len(stale)} worker processes not seen for {WORKER_STALE_SECONDS}s: {', '.join(stale)}")
+    return states
@@ -0,0 +1,52 @@
+# Push notifications for task state changes: a Redis pub/sub channel and webhook callbacks.
+
+# app/notifications.py
+
+import json
+import time
+import logging
+import urllib.request
+from urllib.parse import urlparse
+from app.config import WEBHOOK_TIMEOUT
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+TASK_EVENTS_CHANNEL = "mineru:task-events"
+WEBHOOK_KEY_PREFIX = "mineru:webhook"
+TERMINAL_STATES = ("SUCCESS", "FAILURE", "REVOKED")
+
+
+def publish_task_event(task_id: str, status: str, **data):
+    event = {"task_id": task_id, "status": status, "timestamp": time.time(), **data}
+    try:
+        get_redis().publish(TASK_EVENTS_CHANNEL, json.dumps(event, default=str))
+    except Exception:
+        logger.warning(f"Could not publish event {status} for task {task_id}.", exc_info=True)
+
+
+def is_valid_callback_url(url: str) -> bool:
+    parsed = urlparse(url)
+    return parsed.scheme in ("http", "https") and bool(parsed.netloc)
+
+
+def register_webhook(task_id: str, url: str, ttl_seconds: int):
+    get_redis().set(f"{WEBHOOK_KEY_PREFIX}:{task_id}", url, ex=ttl_seconds)
+
+
+def pop_webhook(task_id: str) -> str | None:
+    return get_redis().getdel(f"{WEBHOOK_KEY_PREFIX}:{task_id}")
+
+
+def post_webhook(url: str, payload: dict):
+    """
+    POSTs `payload` as JSON to `url`. Raises on network errors and non-2xx responses.
+    """
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload, default=str).encode("utf-8"),
+        headers={"Content-Type": "application/json", "User-Agent": "mineru-api-webhook"},
+        method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT) as response:
+        logger.info(f"Delivered webhook for task {payload.get('task_id')} to {url} ({response.status})")
@@ -0,0 +1,379 @@
+# Storage backends for uploads and outputs: a volume shared by web and workers, or an S3-compatible object store.
+
+# app/object_store.py
+
+import io
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import mimetypes
+import threading
+from typing import Iterable, Iterator
+from app.config import (
+    INPUT_DIR, OUTPUT_DIR, STORAGE_BACKEND, STORAGE_RETENTION_SECONDS, S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL,
+    S3_REGION, S3_MAX_POOL_CONNECTIONS, S3_MULTIPART_THRESHOLD, S3_MULTIPART_CHUNKSIZE, S3_TRANSFER_CONCURRENCY,
+    S3_PRESIGN_SECONDS
+)
+from app.zipstream import ZipStream, collect_members
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, ReadTimeoutError, ConnectionClosedError
+    # Network failures worth retrying a task for
+    TRANSIENT_STORE_ERRORS = (BotoConnectionError, ReadTimeoutError, ConnectionClosedError)
+except ImportError:  # boto3 is only needed with STORAGE_BACKEND=s3
+    boto3 = None
+    TRANSIENT_STORE_ERRORS = ()
+
+logger = logging.getLogger(__name__)
+
+# Key prefix of each local root; object keys mirror the paths below them.
+ROOTS = (("inputs", INPUT_DIR), ("outputs", OUTPUT_DIR))
+ARCHIVES_PREFIX = "archives"
+PRUNE_INTERVAL = 300
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
+
+
+def _remove_local(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class LocalObjectStore:
+    """
+    Keeps uploads and outputs in INPUT_DIR and OUTPUT_DIR on a volume that web and workers
+    share. The local paths already are the stored files, so publishing and fetching do nothing.
+    """
+
+    shared_filesystem = True
+    presigns = False
+
+    def publish(self, path: str):
+        pass
+
+    def fetch(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def read_from(self, path: str, offset: int) -> bytes | None:
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def size(self, path: str) -> int:
+        return directory_size(path) if os.path.isdir(path) else os.path.getsize(path) if os.path.isfile(path) else 0
+
+    def delete(self, path: str):
+        pass
+
+    def delete_task(self, task_id: str):
+        pass
+
+    def release(self, path: str):
+        pass
+
+    def prune_local(self):
+        pass
+
+    def presigned_url(self, path: str, filename: str | None = None) -> str | None:
+        return None
+
+    def archive_url(self, task_id: str, output_dir: str, dir_name: str, filename: str) -> str | None:
+        return None
+
+
+class _ChunkReader(io.RawIOBase):
+    """
+    A read-only file object over an iterator of byte chunks, for uploading a stream.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+class S3ObjectStore:
+    """
+    Keeps uploads and outputs in an S3-compatible bucket, so web and workers need no shared
+    filesystem. INPUT_DIR and OUTPUT_DIR become scratch space on each node: workers fetch the
+    input before a task and publish the outputs after it, and the web redirects downloads to
+    presigned URLs or fetches the files it serves itself.
+    """
+
+    shared_filesystem = False
+
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX, endpoint_url: str | None = S3_ENDPOINT_URL,
+                 region: str | None = S3_REGION, presign_seconds: int = S3_PRESIGN_SECONDS,
+                 local_max_age: int = STORAGE_RETENTION_SECONDS):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs boto3 (pip install boto3).")
+        self.bucket = bucket
+        self.prefix = f"{prefix.strip('/')}/" if prefix.strip("/") else ""
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.presign_seconds = presign_seconds
+        self.local_max_age = local_max_age
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_TRANSFER_CONCURRENCY
+        )
+        self._client = None
+        self._client_pid = None
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    @property
+    def presigns(self) -> bool:
+        return self.presign_seconds > 0
+
+    @property
+    def client(self):
+        # One pooled, thread-safe client per process; connections must not cross a fork.
+        if self._client is None or self._client_pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._client_pid != os.getpid():
+                    client = boto3.session.Session().client(
+                        "s3", endpoint_url=self.endpoint_url, region_name=self.region,
+                        config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS, retries={"max_attempts": 5, "mode": "standard"})
+                    )
+                    self._ensure_bucket(client)
+                    self._client, self._client_pid = client, os.getpid()
+        return self._client
+
+    def _ensure_bucket(self, client):
+        try:
+            client.head_bucket(Bucket=self.bucket)
+        except ClientError:
+            logger.info(f"Creating bucket '{self.bucket}'")
+            client.create_bucket(Bucket=self.bucket)
+
+    def key(self, path: str) -> str:
+        path = os.path.abspath(path)
+        for prefix, root in ROOTS:
+            root = os.path.abspath(root)
+            if path == root or path.startswith(root + os.sep):
+                relative = os.path.relpath(path, root).replace(os.sep, "/")
+                return f"{self.prefix}{prefix}" if relative == "." else f"{self.prefix}{prefix}/{relative}"
+        raise ValueError(f"'{path}' is neither in INPUT_DIR nor in OUTPUT_DIR.")
+
+    def _local_path(self, key: str) -> str:
+        relative = key[len(self.prefix):]
+        prefix, _, rest = relative.partition("/")
+        return os.path.join(dict(ROOTS)[prefix], *rest.split("/"))
+
+    def _list(self, prefix: str) -> Iterator[dict]:
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix):
+            yield from page.get("Contents", [])
+
+    def _objects(self, path: str) -> dict[str, dict]:
+        """
+        Returns the objects stored for the file or the directory at `path`, by key.
+        """
+        key = self.key(path)
+        return {obj["Key"]: obj for obj in self._list(key) if obj["Key"] == key or obj["Key"].startswith(key + "/")}
+
+    def _has_key(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def publish(self, path: str):
+        """
+        Uploads the file or directory at `path`. Files whose object already has the same size
+        are skipped, so publishing a directory again only uploads what changed. Large files go
+        up as concurrent multipart uploads.
+        """
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = [os.path.join(root, file) for root, _, names in os.walk(path) for file in names]
+        existing = self._objects(path)
+        uploaded = 0
+        for file_path in files:
+            key = self.key(file_path)
+            try:
+                size = os.path.getsize(file_path)
+            except FileNotFoundError:
+                continue
+            if existing.get(key, {}).get("Size") == size:
+                continue
+            content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+            self.client.upload_file(file_path, self.bucket, key, ExtraArgs={"ContentType": content_type}, Config=self.transfer_config)
+            uploaded += 1
+        logger.info(f"Published {uploaded} of {len(files)} files of '{path}' to s3://{self.bucket}/{self.key(path)}")
+
+    def fetch(self, path: str) -> bool:
+        """
+        Downloads the objects of the file or directory at `path` that are missing locally and
+        returns whether anything is stored there. Downloaded files take the modification time of
+        their object, so the ETags derived from them are the same on every node.
+        """
+        objects = self._objects(path)
+        for key, obj in objects.items():
+            local_path = self._local_path(key)
+            if os.path.isfile(local_path) and os.path.getsize(local_path) == obj["Size"]:
+                continue
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            # Unique, because shards of one document on this node fetch the same input concurrently.
+            partial_path = f"{local_path}.{uuid.uuid4().hex}.part"
+            self.client.download_file(self.bucket, key, partial_path, Config=self.transfer_config)
+            modified_at = obj["LastModified"].timestamp()
+            os.utime(partial_path, (modified_at, modified_at))
+            os.replace(partial_path, local_path)
+        return bool(objects)
+
+    def read_from(self, path: str, offset: int) -> bytes | None:
+        """
+        Returns the bytes of the file at `path` from `offset` on, or None when it is not stored.
+        Read from the bucket rather than fetched, since the file may still be growing.
+        """
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key(path), Range=f"bytes={offset}-")
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code == "InvalidRange":
+                return b""
+            if code in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return response["Body"].read()
+
+    def exists(self, path: str) -> bool:
+        key = self.key(path)
+        listing = self.client.list_objects_v2(Bucket=self.bucket, Prefix=f"{key}/", MaxKeys=1)
+        return listing.get("KeyCount", 0) > 0 or self._has_key(key)
+
+    def size(self, path: str) -> int:
+        return sum(obj["Size"] for obj in self._objects(path).values())
+
+    def _delete_keys(self, keys: list[str]):
+        for start in range(0, len(keys), 1000):
+            batch = keys[start:start + 1000]
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True})
+
+    def delete(self, path: str):
+        self._delete_keys(list(self._objects(path)))
+
+    def delete_task(self, task_id: str):
+        self.delete(os.path.join(INPUT_DIR, task_id))
+        self.delete(os.path.join(OUTPUT_DIR, task_id))
+        self._delete_keys([obj["Key"] for obj in self._list(f"{self.prefix}{ARCHIVES_PREFIX}/{task_id}/")])
+
+    def release(self, path: str):
+        """
+        Removes the local copy of a published file or directory, and the task directory of a
+        file once it is empty.
+        """
+        _remove_local(path)
+        if not os.path.isdir(path):
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+
+    def prune_local(self):
+        """
+        Removes task directories of the local scratch space that are older than the retention
+        period, such as copies fetched for serving or left behind by shards. Runs at most every
+        PRUNE_INTERVAL seconds per process.
+        """
+        now = time.time()
+        if now - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        cutoff = now - self.local_max_age
+        for _, root in ROOTS:
+            if not os.path.isdir(root):
+                continue
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        _remove_local(path)
+                except OSError:
+                    pass
+
+    def _presign(self, key: str, filename: str | None = None) -> str:
+        params = {"Bucket": self.bucket, "Key": key}
+        if filename:
+            params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=self.presign_seconds)
+
+    def presigned_url(self, path: str, filename: str | None = None) -> str | None:
+        return self._presign(self.key(path), filename) if self.presigns else None
+
+    def archive_url(self, task_id: str, output_dir: str, dir_name: str, filename: str) -> str | None:
+        """
+        Returns a presigned URL of the ZIP of a task's outputs. The archive is built and uploaded
+        on first use and kept until the outputs change, so later downloads skip the API entirely.
+        """
+        if not self.presigns:
+            return None
+        objects = self._objects(output_dir)
+        if not objects:
+            return None
+        digest = hashlib.sha1(dir_name.encode("utf-8"))
+        for key in sorted(objects):
+            digest.update(f"\0{key}\0{objects[key]['Size']}".encode("utf-8"))
+        archive_prefix = f"{self.prefix}{ARCHIVES_PREFIX}/{task_id}/"
+        archive_key = f"{archive_prefix}{digest.hexdigest()}.zip"
+
+        if not self._has_key(archive_key):
+            self._delete_keys([obj["Key"] for obj in self._list(archive_prefix)])
+            self.fetch(output_dir)
+            reader = io.BufferedReader(_ChunkReader(ZipStream(collect_members(output_dir, dir_name))), buffer_size=S3_MULTIPART_CHUNKSIZE)
+            self.client.upload_fileobj(reader, self.bucket, archive_key, ExtraArgs={"ContentType": "application/zip"}, Config=self.transfer_config)
+            logger.info(f"Uploaded results archive of task {task_id} -> s3://{self.bucket}/{archive_key}")
+        return self._presign(archive_key, filename)
+
+
+def create_object_store():
+    if STORAGE_BACKEND == "s3":
+        return S3ObjectStore()
+    if STORAGE_BACKEND != "local":
+        raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}'. Choose 'local' or 's3'.")
+    return LocalObjectStore()
+
+
+object_store = create_object_store()
@@ -0,0 +1,78 @@
+# Cheap pre-classification of uploaded PDFs, done at submit time before any model is involved.
+
+# app/preclassify.py
+
+import os
+import json
+import fitz
+from app.config import PRECLASSIFY_SAMPLE_PAGES, PRECLASSIFY_SKIP_CLASSIFY
+from app.redis_client import get_redis
+
+DOCUMENT_KEY_PREFIX = "mineru:document"
+MIN_TEXT_CHARS = 50
+MAX_GARBLED_RATIO = 0.05
+# Coverage bounds outside of which the text layer is conclusive and classify() can be skipped
+TEXT_COVERAGE_TXT = 0.9
+IMAGE_COVERAGE_TXT = 0.5
+IMAGE_COVERAGE_OCR = 0.8
+
+
+def _has_text_layer(page) -> bool:
+    text = page.get_text("text").strip()
+    if len(text) < MIN_TEXT_CHARS:
+        return False
+    # Glyphs without a unicode mapping come out as U+FFFD; such a text layer is useless.
+    return text.count("\ufffd") / len(text) <= MAX_GARBLED_RATIO
+
+
+def _image_coverage(page) -> float:
+    page_area = abs(page.rect) or 1.0
+    covered = 0.0
+    for image in page.get_image_info():
+        covered += abs(fitz.Rect(image["bbox"]) & page.rect)
+    return min(covered / page_area, 1.0)
+
+
+def profile_pdf(pdf_path: str, sample_pages: int = PRECLASSIFY_SAMPLE_PAGES) -> dict:
+    """
+    Measures page count, text-layer coverage and image density on evenly spaced sample pages.
+    `parse_method` is "txt" or "ocr" when the sample is conclusive and None when classify()
+    still has to decide; `likely_ocr` is the best guess either way and is used for routing.
+    """
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+        step = max(page_count // max(sample_pages, 1), 1)
+        sampled = list(range(0, page_count, step))[:sample_pages]
+        text_pages = sum(1 for index in sampled if _has_text_layer(doc[index]))
+        image_coverage = sum(_image_coverage(doc[index]) for index in sampled)
+
+    text_coverage = text_pages / len(sampled) if sampled else 0.0
+    image_coverage = image_coverage / len(sampled) if sampled else 0.0
+    parse_method = None
+    if text_coverage >= TEXT_COVERAGE_TXT and image_coverage < IMAGE_COVERAGE_TXT:
+        parse_method = "txt"
+    elif text_coverage == 0.0 and (image_coverage >= IMAGE_COVERAGE_OCR or not sampled):
+        parse_method = "ocr"
+
+    return {
+        "page_count": page_count,
+        "size_bytes": os.path.getsize(pdf_path),
+        "sampled_pages": len(sampled),
+        "text_coverage": round(text_coverage, 3),
+        "image_coverage": round(image_coverage, 3),
+        "likely_ocr": parse_method == "ocr" or (parse_method is None and text_coverage < 0.5),
+        "parse_method": parse_method if PRECLASSIFY_SKIP_CLASSIFY else None,
+    }
+
+
+def save_document_profile(task_id: str, profile: dict, ttl_seconds: int):
+    get_redis().set(f"{DOCUMENT_KEY_PREFIX}:{task_id}", json.dumps(profile), ex=ttl_seconds)
+
+
+def delete_document_profile(task_id: str):
+    get_redis().delete(f"{DOCUMENT_KEY_PREFIX}:{task_id}")
+
+
+def load_document_profile(task_id: str) -> dict | None:
+    raw = get_redis().get(f"{DOCUMENT_KEY_PREFIX}:{task_id}")
+    return json.loads(raw) if raw else None
@@ -5,29 +5,43 @@
 
 
 import os
+import json
+import time
+import shutil
 import logging
-from rich.console import Console
-from magic_pdf.data.data_reader_writer import FileBasedDataWriter, FileBasedDataReader
+from typing import Callable
+import fitz
+from magic_pdf.data.data_reader_writer import DataWriter, FileBasedDataWriter, FileBasedDataReader
 from magic_pdf.data.dataset import PymuDocDataset
 from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze
 from magic_pdf.config.enums import SupportedPdfParseMethod
+from magic_pdf.operators.models import InferenceResult
+from magic_pdf.operators.pipes import PipeResult
+from app.config import PROGRESS_PAGE_WINDOW, STREAM_PAGE_WINDOW, LOW_MEMORY_MIN_PAGES, LOW_MEMORY_WINDOW_PAGES
+from app.progress import ProgressTracker
+from app.batching import inference_batcher
 
 logger = logging.getLogger(__name__)
 
-def analyze_pdf(pdf_path: str, output_dir: str):
-    logger.info(f"Analysis started. All outputs will be saved to: {output_dir}")
+SHARD_DIR_NAME = ".shards"
+# Append-only JSONL of finished pages, written while a streamed analysis runs
+STREAM_FILENAME = "content_stream.jsonl"
 
-    name_without_ext = os.path.splitext(os.path.basename(pdf_path))[0]
-    local_image_dir = os.path.join(output_dir, "images")
-    os.makedirs(local_image_dir, exist_ok=True)
-    image_dir_relative_path = "images"
+OUTPUT_KINDS = ("markdown", "content_list", "model_pdf", "layout_pdf", "spans_pdf")
+VISUALIZATION_KINDS = ("model_pdf", "layout_pdf", "spans_pdf")
+# Blocks a text-only analysis leaves out of every output
+VISUAL_BLOCK_TYPES = ("image", "table", "interline_equation")
 
-    image_writer = FileBasedDataWriter(local_image_dir)
-    result_writer = FileBasedDataWriter(output_dir)
-    
-    reader = FileBasedDataReader("")
-    logger.info("✓ Environment prepared.")
+class DiscardingDataWriter(DataWriter):
+    """
+    Stands in for the image writer of text-only analyses, which keep no cropped images.
+    """
+
+    def write(self, path: str, data: bytes):
+        pass
 
+def _load_dataset(pdf_path: str) -> PymuDocDataset:
+    reader = FileBasedDataReader("")
     try:
         pdf_bytes = reader.read(pdf_path)
         ds = PymuDocDataset(pdf_bytes)
@@ -35,69 +49,517 @@ def analyze_pdf(pdf_path: str, output_dir: str):
     except Exception as e:
         logger.error(f"Failed to read or load PDF file: {e}", exc_info=True)
         raise
+    return ds
 
-    console = Console()
-    with console.status("[bold yellow]Running AI model analysis...", spinner="dots") as status:
-        is_ocr = ds.classify() == SupportedPdfParseMethod.OCR
-        if is_ocr:
-            status.update("[yellow]Scanned document detected, starting OCR mode analysis...")
-            logger.info("Analysis Mode: OCR")
-            infer_result = ds.apply(doc_analyze, ocr=True)
-            status.update("[yellow]OCR analysis finished, building document structure...")
-            pipe_result = infer_result.pipe_ocr_mode(image_writer)
-        else:
-            status.update("[yellow]Native PDF detected, starting text mode analysis...")
-            logger.info("Analysis Mode: Text")
-            infer_result = ds.apply(doc_analyze, ocr=False)
-            status.update("[yellow]Text analysis finished, building document structure...")
-            pipe_result = infer_result.pipe_txt_mode(image_writer)
+def _write_outputs(infer_result, pipe_result, output_dir: str, name_without_ext: str, outputs: list[str], progress: ProgressTracker) -> dict:
+    local_image_dir = os.path.join(output_dir, "images")
+    image_dir_relative_path = "images"
+    result_writer = FileBasedDataWriter(output_dir)
+    md_path = content_list_json_path = None
 
-    logger.info("✓ AI model analysis complete.")
-    logger.info("Generating and saving output files...")
-    
     try:
+        if "markdown" in outputs:
+            md_path = f"{name_without_ext}.md"
+            with progress.stage("dump_md"):
+                pipe_result.dump_md(result_writer, md_path, image_dir_relative_path)
+            logger.info(f"Generated Markdown file -> {os.path.join(output_dir, md_path)}")
+
+        if "content_list" in outputs:
+            content_list_json_path = f"{name_without_ext}_content_list.json"
+            with progress.stage("dump_content_list"):
+                pipe_result.dump_content_list(result_writer, content_list_json_path, image_dir_relative_path)
+            logger.info(f"Generated content list JSON -> {os.path.join(output_dir, content_list_json_path)}")
+
+        # The middle and model JSON are always kept: visual reports are rendered from them on demand.
+        middle_json_path = f'{name_without_ext}_middle.json'
+        with progress.stage("dump_middle_json"):
+            pipe_result.dump_middle_json(result_writer, middle_json_path)
+        logger.info(f"Generated middle structure JSON -> {os.path.join(output_dir, middle_json_path)}")
+
+        model_json_path = f'{name_without_ext}_model.json'
+        with progress.stage("dump_model_json"):
+            result_writer.write_string(model_json_path, json.dumps(infer_result.get_infer_res(), ensure_ascii=False))
+        logger.info(f"Generated model inference JSON -> {os.path.join(output_dir, model_json_path)}")
+
+        visual_reports = _draw_visualizations(
+            infer_result, pipe_result, output_dir, name_without_ext,
+            [kind for kind in VISUALIZATION_KINDS if kind in outputs], progress
+        )
+
+    except Exception as e:
+        logger.error("An error occurred while generating output files.", exc_info=True)
+        raise
+
+    logger.info("[bold green]✓ All output files generated successfully.[/bold green]")
+
+    return {
+        "markdown": os.path.join(output_dir, md_path) if md_path else None,
+        "content_list_json": os.path.join(output_dir, content_list_json_path) if content_list_json_path else None,
+        "middle_json": os.path.join(output_dir, middle_json_path),
+        "model_json": os.path.join(output_dir, model_json_path),
+        "visual_reports": visual_reports,
+        "image_dir": local_image_dir
+    }
+
+def _draw_visualizations(infer_result, pipe_result, output_dir: str, name_without_ext: str, kinds: list[str], progress: ProgressTracker) -> list[str]:
+    visual_reports = []
+    if "model_pdf" in kinds:
         model_pdf_path = os.path.join(output_dir, f"{name_without_ext}_model.pdf")
-        infer_result.draw_model(model_pdf_path)
+        with progress.stage("draw_model"):
+            infer_result.draw_model(model_pdf_path)
         logger.info(f"Generated model visual report -> {model_pdf_path}")
-        
-        # ... (other draw and dump calls) ...
+        visual_reports.append(model_pdf_path)
+
+    if "layout_pdf" in kinds:
         layout_pdf_path = os.path.join(output_dir, f"{name_without_ext}_layout.pdf")
-        pipe_result.draw_layout(layout_pdf_path)
+        with progress.stage("draw_layout"):
+            pipe_result.draw_layout(layout_pdf_path)
         logger.info(f"Generated layout visual report -> {layout_pdf_path}")
-        
+        visual_reports.append(layout_pdf_path)
+
+    if "spans_pdf" in kinds:
         span_pdf_path = os.path.join(output_dir, f"{name_without_ext}_spans.pdf")
-        pipe_result.draw_span(span_pdf_path)
+        with progress.stage("draw_span"):
+            pipe_result.draw_span(span_pdf_path)
         logger.info(f"Generated spans visual report -> {span_pdf_path}")
+        visual_reports.append(span_pdf_path)
+    return visual_reports
 
-        md_path = f"{name_without_ext}.md"
-        pipe_result.dump_md(result_writer, md_path, image_dir_relative_path)
-        logger.info(f"Generated Markdown file -> {os.path.join(output_dir, md_path)}")
+def render_visualizations(pdf_path: str, output_dir: str, kinds: list[str], progress: ProgressTracker | None = None) -> dict:
+    """
+    Draws the requested visual reports for a finished analysis from its stored middle/model JSON
+    and the original PDF, without running inference again.
+    """
+    logger.info(f"Rendering visual reports {kinds} for: {output_dir}")
+    name_without_ext = os.path.splitext(os.path.basename(pdf_path))[0]
 
-        content_list_json_path = f"{name_without_ext}_content_list.json"
-        pipe_result.dump_content_list(result_writer, content_list_json_path, image_dir_relative_path)
-        logger.info(f"Generated content list JSON -> {os.path.join(output_dir, content_list_json_path)}")
+    with open(os.path.join(output_dir, f"{name_without_ext}_middle.json"), "r", encoding="utf-8") as f:
+        middle_json = json.load(f)
+    with open(os.path.join(output_dir, f"{name_without_ext}_model.json"), "r", encoding="utf-8") as f:
+        model_list = json.load(f)
 
-        middle_json_path = f'{name_without_ext}_middle.json'
-        pipe_result.dump_middle_json(result_writer, middle_json_path)
-        logger.info(f"Generated middle structure JSON -> {os.path.join(output_dir, middle_json_path)}")
+    progress = progress or ProgressTracker()
+    with progress.stage("read"):
+        ds = _load_dataset(pdf_path)
+    visual_reports = _draw_visualizations(
+        InferenceResult(model_list, ds), PipeResult(middle_json, ds), output_dir, name_without_ext, kinds, progress
+    )
+    return {
+        "status": "success",
+        "input_file": pdf_path,
+        "output_directory": output_dir,
+        "visual_reports": visual_reports,
+        "stage_seconds": progress.stage_seconds
+    }
 
-    except Exception as e:
-        logger.error("An error occurred while generating output files.", exc_info=True)
-        raise
+def _infer_pages(ds, is_ocr: bool, start_page: int, end_page: int, progress: ProgressTracker):
+    """
+    Runs doc_analyze over pages `start_page`..`end_page` in windows of PROGRESS_PAGE_WINDOW pages,
+    reporting pages done after each window. Returns the model list for the whole document, with
+    empty entries outside the range, exactly as a single doc_analyze call would. Small documents
+    analyzed whole go through the micro-batcher when it is enabled.
+    """
+    if inference_batcher.accepts(ds, start_page, end_page):
+        model_list = inference_batcher.analyze(ds, is_ocr)
+        if model_list is not None:
+            progress.pages_finished(end_page - start_page + 1)
+            return InferenceResult(model_list, ds)
+    window = PROGRESS_PAGE_WINDOW or (end_page - start_page + 1)
+    model_list = None
+    for window_start in range(start_page, end_page + 1, window):
+        window_end = min(window_start + window - 1, end_page)
+        window_result = ds.apply(doc_analyze, ocr=is_ocr, start_page_id=window_start, end_page_id=window_end)
+        window_models = window_result.get_infer_res()
+        if model_list is None:
+            model_list = window_models
+        else:
+            model_list[window_start:window_end + 1] = window_models[window_start:window_end + 1]
+        progress.pages_finished(window_end - start_page + 1)
+    return InferenceResult(model_list, ds)
 
-    logger.info("[bold green]✓ All output files generated successfully.[/bold green]")
+def _needs_ocr(ds, parse_method: str | None, progress: ProgressTracker) -> bool:
+    """
+    Uses the submit-time pre-classification when there is one and falls back to classify().
+    """
+    if parse_method in ("ocr", "txt"):
+        logger.info(f"Using pre-classified parse method '{parse_method}', skipping classify().")
+        return parse_method == "ocr"
+    with progress.stage("classify"):
+        return ds.classify() == SupportedPdfParseMethod.OCR
+
+def _strip_visual_blocks(pipe_result, ds) -> PipeResult:
+    # Text-only runs use the same models as full ones, so workers keep a single warm model set,
+    # and leave images, tables and formulas out afterwards.
+    middle_json = json.loads(pipe_result.get_middle_json())
+    for page in middle_json["pdf_info"]:
+        page["para_blocks"] = [block for block in page.get("para_blocks", []) if block.get("type") not in VISUAL_BLOCK_TYPES]
+        for key in ("images", "tables", "interline_equations"):
+            page[key] = []
+    return PipeResult(middle_json, ds)
+
+def _run_pipeline(ds, is_ocr: bool, image_writer, start_page: int, end_page: int, progress: ProgressTracker, text_only: bool = False):
+    """
+    Runs inference and the txt/ocr pipe over pages `start_page`..`end_page`. Pages outside the
+    range stay in the results as empty pages, so every page keeps its original index.
+    """
+    with progress.stage("doc_analyze"):
+        infer_result = _infer_pages(ds, is_ocr, start_page, end_page, progress)
+    if is_ocr:
+        with progress.stage("pipe_ocr_mode"):
+            pipe_result = infer_result.pipe_ocr_mode(image_writer, start_page_id=start_page, end_page_id=end_page)
+    else:
+        with progress.stage("pipe_txt_mode"):
+            pipe_result = infer_result.pipe_txt_mode(image_writer, start_page_id=start_page, end_page_id=end_page)
+    if text_only:
+        pipe_result = _strip_visual_blocks(pipe_result, ds)
+    return infer_result, pipe_result
+
+def stream_lines(pages: dict[int, list], start_page: int, end_page: int) -> list[str]:
+    """
+    Formats content list items grouped by page as content stream lines, one per page.
+    """
+    return [
+        json.dumps({"page_idx": page_idx, "items": pages.get(page_idx, [])}, ensure_ascii=False) + "\n"
+        for page_idx in range(start_page, end_page + 1)
+    ]
+
+def _append_to_stream(stream, page_infos: list[dict], ds):
+    items = PipeResult({"pdf_info": page_infos}, ds).get_content_list("images")
+    pages: dict[int, list] = {}
+    for item in items:
+        pages.setdefault(item.get("page_idx", 0), []).append(item)
+    stream.writelines(stream_lines(pages, page_infos[0]["page_idx"], page_infos[-1]["page_idx"]))
+    stream.flush()
+
+def _run_pipeline_streaming(ds, is_ocr: bool, image_writer, start_page: int, end_page: int, progress: ProgressTracker,
+                            text_only: bool, stream_path: str, on_flush: Callable[[str], None] | None = None):
+    """
+    Like `_run_pipeline`, but runs inference and the pipe window by window and appends the
+    content of each finished window to the JSONL stream at `stream_path`, one line per page,
+    so readers can start on the first pages while the rest is still being analyzed. Paragraphs
+    that continue across a window boundary are not joined.
+    """
+    window = STREAM_PAGE_WINDOW or (end_page - start_page + 1)
+    model_list = middle_json = None
+    started_at = time.perf_counter()
+    with open(stream_path, "w", encoding="utf-8") as stream:
+        for window_start in range(start_page, end_page + 1, window):
+            window_end = min(window_start + window - 1, end_page)
+            with progress.stage("doc_analyze"):
+                window_models = ds.apply(doc_analyze, ocr=is_ocr, start_page_id=window_start, end_page_id=window_end).get_infer_res()
+            with progress.stage("pipe_ocr_mode" if is_ocr else "pipe_txt_mode"):
+                window_infer = InferenceResult(window_models, ds)
+                if is_ocr:
+                    window_pipe = window_infer.pipe_ocr_mode(image_writer, start_page_id=window_start, end_page_id=window_end)
+                else:
+                    window_pipe = window_infer.pipe_txt_mode(image_writer, start_page_id=window_start, end_page_id=window_end)
+                if text_only:
+                    window_pipe = _strip_visual_blocks(window_pipe, ds)
+            window_middle = json.loads(window_pipe.get_middle_json())
+            if model_list is None:
+                model_list, middle_json = window_models, window_middle
+            else:
+                model_list[window_start:window_end + 1] = window_models[window_start:window_end + 1]
+                middle_json["pdf_info"][window_start:window_end + 1] = window_middle["pdf_info"][window_start:window_end + 1]
+
+            with progress.stage("stream"):
+                _append_to_stream(stream, window_middle["pdf_info"][window_start:window_end + 1], ds)
+                if on_flush:
+                    on_flush(stream_path)
+            progress.pages_finished(window_end - start_page + 1, time.perf_counter() - started_at)
+    return InferenceResult(model_list, ds), PipeResult(middle_json, ds)
+
+def _window_dataset(source, start_page: int, end_page: int) -> PymuDocDataset:
+    """
+    Copies pages `start_page`..`end_page` of the open source document into a PDF of their own, so
+    the dataset the models work on parses, renders and holds only those pages.
+    """
+    with fitz.open() as window_doc:
+        window_doc.insert_pdf(source, from_page=start_page, to_page=end_page)
+        return PymuDocDataset(window_doc.tobytes())
+
+def _shift_pages(model_list: list[dict], pdf_info: list[dict], offset: int):
+    # Pages of a window document are numbered from 0; give them their index in the source document.
+    for entry in model_list:
+        entry["page_info"]["page_no"] += offset
+    for page in pdf_info:
+        page["page_idx"] += offset
+        for block in page.get("para_blocks", []):
+            if "page_num" in block:
+                block["page_num"] = f"page_{page['page_idx']}"
+
+def _skipped_pages(source, first_page: int, last_page: int) -> tuple[list[dict], list[dict]]:
+    """
+    The model and middle-JSON entries doc_analyze and the pipe give pages outside the analyzed range.
+    """
+    model_list, pdf_info = [], []
+    for page_idx in range(first_page, last_page + 1):
+        rect = source.load_page(page_idx).rect
+        model_list.append({"layout_dets": [], "page_info": {"page_no": page_idx, "width": 0, "height": 0}})
+        pdf_info.append({
+            "preproc_blocks": [], "page_idx": page_idx, "page_size": [rect.width, rect.height], "images": [], "tables": [],
+            "interline_equations": [], "discarded_blocks": [], "need_drop": True, "drop_reason": "skip page", "para_blocks": [],
+        })
+    return model_list, pdf_info
+
+def _analyze_pdf_windowed(source, pdf_path: str, output_dir: str, outputs: list[str], progress: ProgressTracker, parse_method: str | None,
+                          start_page: int, end_page: int, text_only: bool, image_writer, stream_path: str | None = None,
+                          on_stream_flush: Callable[[str], None] | None = None) -> dict:
+    """
+    Low-memory variant of `analyze_pdf` for long documents. MuPDF reads the input file on demand
+    instead of it being loaded whole; pages `start_page`..`end_page` are copied LOW_MEMORY_WINDOW_PAGES
+    at a time into a window document that is rendered, analyzed and piped on its own and then
+    dropped together with its page images. The results of each window are spilled to a shard
+    file, and the shard files are merged as for a sharded analysis, so peak memory follows the
+    window size rather than the page count. Paragraphs that continue across a window boundary
+    are not joined, and without a pre-classified parse method the first window decides between
+    OCR and text mode. Cropped images are named after the window document's own content and
+    page numbers, so windows do not overwrite each other's. Requested visual reports are not
+    drawn; they are listed as `deferred_outputs`.
+    """
+    spill_dir = os.path.join(output_dir, SHARD_DIR_NAME)
+    os.makedirs(spill_dir, exist_ok=True)
+    page_count = len(source)
+    progress.total_pages = end_page - start_page + 1
+    logger.info(f"Analyzing pages {start_page}-{end_page} of {page_count} in windows of {LOW_MEMORY_WINDOW_PAGES} pages{' (text only)' if text_only else ''}")
+
+    is_ocr = None
+    spill_paths = []
+    started_at = time.perf_counter()
+    stream = open(stream_path, "w", encoding="utf-8") if stream_path else None
+    try:
+        for window_start, window_end in plan_page_ranges(end_page - start_page + 1, LOW_MEMORY_WINDOW_PAGES, start_page):
+            with progress.stage("read"):
+                ds = _window_dataset(source, window_start, window_end)
+            if is_ocr is None:
+                is_ocr = _needs_ocr(ds, parse_method, progress)
+                logger.info(f"Analysis Mode: {'OCR' if is_ocr else 'Text'}")
+            with progress.stage("doc_analyze"):
+                model_list = ds.apply(doc_analyze, ocr=is_ocr).get_infer_res()
+            with progress.stage("pipe_ocr_mode" if is_ocr else "pipe_txt_mode"):
+                infer_result = InferenceResult(model_list, ds)
+                pipe_result = infer_result.pipe_ocr_mode(image_writer) if is_ocr else infer_result.pipe_txt_mode(image_writer)
+                if text_only:
+                    pipe_result = _strip_visual_blocks(pipe_result, ds)
+            middle_json = json.loads(pipe_result.get_middle_json())
+            pdf_info = middle_json["pdf_info"]
+            _shift_pages(model_list, pdf_info, window_start)
+
+            if stream:
+                with progress.stage("stream"):
+                    _append_to_stream(stream, pdf_info, ds)
+                    if on_stream_flush:
+                        on_stream_flush(stream_path)
+            # Pages outside the analyzed range go with the first and last window, as in a sharded analysis.
+            if window_start == start_page and start_page > 0:
+                skipped_models, skipped_info = _skipped_pages(source, 0, start_page - 1)
+                model_list, pdf_info = skipped_models + model_list, skipped_info + pdf_info
+            if window_end == end_page and end_page < page_count - 1:
+                skipped_models, skipped_info = _skipped_pages(source, end_page + 1, page_count - 1)
+                model_list, pdf_info = model_list + skipped_models, pdf_info + skipped_info
+
+            spill = {
+                "start_page": window_start,
+                "end_page": window_end,
+                "analysis_mode": "OCR" if is_ocr else "Text",
+                "text_only": text_only,
+                "parse_type": middle_json.get("_parse_type"),
+                "version_name": middle_json.get("_version_name"),
+                "model_list": model_list,
+                "pdf_info": pdf_info,
+            }
+            spill_path = os.path.join(spill_dir, f"pages_{window_start:05d}_{window_end:05d}.json")
+            with open(spill_path, "w", encoding="utf-8") as f:
+                json.dump(spill, f, ensure_ascii=False)
+            spill_paths.append(spill_path)
+            del ds, infer_result, pipe_result, middle_json, model_list, pdf_info, spill
+            progress.pages_finished(window_end - start_page + 1, time.perf_counter() - started_at)
+    finally:
+        if stream:
+            stream.close()
+
+    logger.info("✓ AI model analysis complete.")
+    # Drawing the visual reports takes the whole document in memory, which is what this mode avoids;
+    # they are left to POST /tasks/{task_id}/visualizations.
+    deferred = [kind for kind in outputs if kind in VISUALIZATION_KINDS]
+    if deferred:
+        logger.info(f"Deferring visual reports {deferred} of a low-memory analysis; they can be rendered on demand.")
+    # Stage timings were recorded on `progress` as the windows ran, so the spills carry none to add up.
+    result_summary = merge_pdf_shards(pdf_path, output_dir, spill_paths, [kind for kind in outputs if kind not in deferred], progress)
+    result_summary["windows"] = result_summary.pop("shards")
+    if deferred:
+        result_summary["deferred_outputs"] = deferred
+    result_summary["generated_files"]["content_stream"] = stream_path
+    return result_summary
+
+def _page_range(ds, start_page: int, end_page: int | None) -> tuple[int, int]:
+    last_page = len(ds) - 1 if end_page is None else min(end_page, len(ds) - 1)
+    if start_page > last_page:
+        raise ValueError(f"start_page {start_page} is beyond the last page of the document ({len(ds)} pages).")
+    return start_page, last_page
+
+def analyze_pdf(pdf_path: str, output_dir: str, outputs: list[str] = OUTPUT_KINDS, progress: ProgressTracker | None = None, parse_method: str | None = None,
+                start_page: int = 0, end_page: int | None = None, text_only: bool = False, stream: bool = False,
+                on_stream_flush: Callable[[str], None] | None = None):
+    logger.info(f"Analysis started. All outputs will be saved to: {output_dir}")
+    progress = progress or ProgressTracker()
+
+    name_without_ext = os.path.splitext(os.path.basename(pdf_path))[0]
+    local_image_dir = os.path.join(output_dir, "images")
+    os.makedirs(local_image_dir, exist_ok=True)
+
+    image_writer = DiscardingDataWriter() if text_only else FileBasedDataWriter(local_image_dir)
+    logger.info("✓ Environment prepared.")
+    stream_path = os.path.join(output_dir, STREAM_FILENAME) if stream else None
+
+    if LOW_MEMORY_MIN_PAGES:
+        with fitz.open(pdf_path) as source:
+            first_page, last_page = _page_range(source, start_page, end_page)
+            if last_page - first_page + 1 >= LOW_MEMORY_MIN_PAGES:
+                return _analyze_pdf_windowed(
+                    source, pdf_path, output_dir, outputs, progress, parse_method, first_page, last_page, text_only,
+                    image_writer, stream_path, on_stream_flush
+                )
+
+    with progress.stage("read"):
+        ds = _load_dataset(pdf_path)
+    start_page, end_page = _page_range(ds, start_page, end_page)
+    progress.total_pages = end_page - start_page + 1
+
+    is_ocr = _needs_ocr(ds, parse_method, progress)
+    if is_ocr:
+        logger.info("Scanned document detected. Analysis Mode: OCR")
+    else:
+        logger.info("Native PDF detected. Analysis Mode: Text")
+    if start_page > 0 or end_page < len(ds) - 1 or text_only:
+        logger.info(f"Analyzing pages {start_page}-{end_page} of {len(ds)}{' (text only)' if text_only else ''}")
+    if stream:
+        infer_result, pipe_result = _run_pipeline_streaming(
+            ds, is_ocr, image_writer, start_page, end_page, progress, text_only, stream_path, on_stream_flush
+        )
+    else:
+        infer_result, pipe_result = _run_pipeline(ds, is_ocr, image_writer, start_page, end_page, progress, text_only)
+
+    logger.info("✓ AI model analysis complete.")
+    logger.info("Generating and saving output files...")
+    generated_files = _write_outputs(infer_result, pipe_result, output_dir, name_without_ext, outputs, progress)
+    generated_files["content_stream"] = stream_path
     
     result_summary = {
         "status": "success",
         "input_file": pdf_path,
         "analysis_mode": "OCR" if is_ocr else "Text",
         "output_directory": output_dir,
-        "generated_files": {
-            "markdown": os.path.join(output_dir, md_path),
-            "content_list_json": os.path.join(output_dir, content_list_json_path),
-            "middle_json": os.path.join(output_dir, middle_json_path),
-            "visual_reports": [model_pdf_path, layout_pdf_path, span_pdf_path],
-            "image_dir": local_image_dir
-        }
+        "page_count": len(ds),
+        "page_range": [start_page, end_page],
+        "text_only": text_only,
+        "stage_seconds": progress.stage_seconds,
+        "generated_files": generated_files
+    }
+    return result_summary
+
+def plan_page_ranges(page_count: int, pages_per_shard: int, first_page: int = 0) -> list[tuple[int, int]]:
+    """
+    Splits `page_count` pages starting at `first_page` into inclusive (start_page, end_page)
+    ranges of at most `pages_per_shard` pages.
+    """
+    last_page = first_page + page_count
+    return [
+        (start, min(start + pages_per_shard, last_page) - 1)
+        for start in range(first_page, last_page, pages_per_shard)
+    ]
+
+def analyze_pdf_pages(pdf_path: str, output_dir: str, start_page: int, end_page: int, progress: ProgressTracker | None = None, parse_method: str | None = None,
+                      text_only: bool = False, first_page: int = 0, last_page: int | None = None) -> str:
+    """
+    Runs inference and the txt/ocr pipe over one page range of the document. Images go straight
+    into the final `images` directory; the model and middle-JSON entries of the range are written
+    to a shard file that `merge_pdf_shards` stitches back together. Returns the shard file path.
+    `first_page`..`last_page` is the part of the document all shards together analyze; the
+    shards at either end also keep the empty entries of the skipped pages before and after it.
+    """
+    logger.info(f"Shard analysis started for pages {start_page}-{end_page} of {pdf_path}")
+
+    local_image_dir = os.path.join(output_dir, "images")
+    shard_dir = os.path.join(output_dir, SHARD_DIR_NAME)
+    os.makedirs(local_image_dir, exist_ok=True)
+    os.makedirs(shard_dir, exist_ok=True)
+    image_writer = DiscardingDataWriter() if text_only else FileBasedDataWriter(local_image_dir)
+
+    progress = progress or ProgressTracker(total_pages=end_page - start_page + 1)
+    with progress.stage("read"):
+        ds = _load_dataset(pdf_path)
+    # classify() looks at the whole document, so every shard reaches the same decision.
+    is_ocr = _needs_ocr(ds, parse_method, progress)
+    infer_result, pipe_result = _run_pipeline(ds, is_ocr, image_writer, start_page, end_page, progress, text_only)
+
+    middle_json = json.loads(pipe_result.get_middle_json())
+    keep_from = 0 if start_page == first_page else start_page
+    keep_to = len(ds) if end_page == (len(ds) - 1 if last_page is None else last_page) else end_page + 1
+    shard = {
+        "start_page": start_page,
+        "end_page": end_page,
+        "analysis_mode": "OCR" if is_ocr else "Text",
+        "text_only": text_only,
+        "parse_type": middle_json.get("_parse_type"),
+        "version_name": middle_json.get("_version_name"),
+        "model_list": infer_result.get_infer_res()[keep_from:keep_to],
+        "pdf_info": middle_json["pdf_info"][keep_from:keep_to],
+        "stage_seconds": progress.stage_seconds,
+    }
+    shard_path = os.path.join(shard_dir, f"pages_{start_page:05d}_{end_page:05d}.json")
+    with open(shard_path, "w", encoding="utf-8") as f:
+        json.dump(shard, f, ensure_ascii=False)
+
+    logger.info(f"✓ Shard for pages {start_page}-{end_page} written -> {shard_path}")
+    return shard_path
+
+def merge_pdf_shards(pdf_path: str, output_dir: str, shard_paths: list[str], outputs: list[str] = OUTPUT_KINDS, progress: ProgressTracker | None = None):
+    """
+    Combines the shard files of a sharded analysis into the same outputs `analyze_pdf` produces.
+    Stage timings are summed over all shards.
+    """
+    logger.info(f"Merging {len(shard_paths)} shards into: {output_dir}")
+    progress = progress or ProgressTracker()
+
+    shards = []
+    for shard_path in shard_paths:
+        with open(shard_path, "r", encoding="utf-8") as f:
+            shards.append(json.load(f))
+    shards.sort(key=lambda shard: shard["start_page"])
+
+    model_list, pdf_info = [], []
+    for shard in shards:
+        model_list.extend(shard["model_list"])
+        pdf_info.extend(shard["pdf_info"])
+        for stage, seconds in shard.get("stage_seconds", {}).items():
+            progress.stage_seconds[stage] = round(progress.stage_seconds.get(stage, 0.0) + seconds, 3)
+    progress.total_pages = progress.pages_done = sum(shard["end_page"] - shard["start_page"] + 1 for shard in shards)
+
+    # The text outputs are made from the results alone; only the visual reports draw on the original pages.
+    ds = None
+    if any(kind in outputs for kind in VISUALIZATION_KINDS):
+        with progress.stage("read"):
+            ds = _load_dataset(pdf_path)
+    infer_result = InferenceResult(model_list, ds)
+    pipe_result = PipeResult(
+        {"pdf_info": pdf_info, "_parse_type": shards[0]["parse_type"], "_version_name": shards[0]["version_name"]},
+        ds
+    )
+
+    name_without_ext = os.path.splitext(os.path.basename(pdf_path))[0]
+    generated_files = _write_outputs(infer_result, pipe_result, output_dir, name_without_ext, outputs, progress)
+    shutil.rmtree(os.path.join(output_dir, SHARD_DIR_NAME), ignore_errors=True)
+
+    return {
+        "status": "success",
+        "input_file": pdf_path,
+        "analysis_mode": shards[0]["analysis_mode"],
+        "output_directory": output_dir,
+        "page_count": len(pdf_info),
+        "page_range": [shards[0]["start_page"], shards[-1]["end_page"]],
+        "text_only": shards[0].get("text_only", False),
+        "shards": len(shards),
+        "stage_seconds": progress.stage_seconds,
+        "generated_files": generated_files
     }
-    return result_summary
\ No newline at end of file
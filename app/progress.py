@@ -0,0 +1,73 @@
+# Stage and page progress of a running analysis, reported through a callback.
+
+# app/progress.py
+
+import time
+import logging
+from contextlib import contextmanager
+from typing import Callable
+from app.logging_config import log_context
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressTracker:
+    """
+    Records which stage an analysis is in, how many pages went through inference, and how long
+    each stage took. Every change is pushed to `callback` as a JSON-serializable snapshot.
+    """
+
+    def __init__(self, total_pages: int = 0, callback: Callable[[dict], None] | None = None):
+        self.total_pages = total_pages
+        self.pages_done = 0
+        self.current_stage: str | None = None
+        self.stage_seconds: dict[str, float] = {}
+        self.callback = callback
+        self.started_at = time.perf_counter()
+        self._stage_started_at = self.started_at
+        self._inference_seconds = 0.0
+
+    @contextmanager
+    def stage(self, name: str):
+        self.current_stage = name
+        self._stage_started_at = time.perf_counter()
+        self._emit()
+        try:
+            with log_context(stage=name):
+                yield self
+        finally:
+            elapsed = time.perf_counter() - self._stage_started_at
+            self.stage_seconds[name] = round(self.stage_seconds.get(name, 0.0) + elapsed, 3)
+            logger.info(f"Stage '{name}' finished in {elapsed:.2f}s")
+
+    def pages_finished(self, pages_done: int, elapsed_seconds: float | None = None):
+        """
+        Records inference progress. `elapsed_seconds` is the time spent on those pages, when it
+        is not simply the time since the current stage started.
+        """
+        self.pages_done = pages_done
+        self._inference_seconds = time.perf_counter() - self._stage_started_at if elapsed_seconds is None else elapsed_seconds
+        self._emit()
+
+    def snapshot(self) -> dict:
+        eta_seconds = None
+        if self.pages_done and self.total_pages > self.pages_done:
+            seconds_per_page = self._inference_seconds / self.pages_done
+            eta_seconds = round(seconds_per_page * (self.total_pages - self.pages_done), 1)
+        return {
+            "stage": self.current_stage,
+            "pages_done": self.pages_done,
+            "total_pages": self.total_pages,
+            "elapsed_seconds": round(time.perf_counter() - self.started_at, 3),
+            "stage_seconds": dict(self.stage_seconds),
+            "inference_eta_seconds": eta_seconds,
+        }
+
+    def _emit(self):
+        if self.callback is None:
+            return
+        try:
+            self.callback(self.snapshot())
+        except Exception:
+            # Progress is best effort and must never fail the analysis itself.
+            logger.warning("Could not report progress.", exc_info=True)
@@ -0,0 +1,12 @@
+# Shared Redis connection used for service bookkeeping outside of Celery.
+
+# app/redis_client.py
+
+from functools import lru_cache
+import redis
+from app.config import REDIS_URL
+
+
+@lru_cache(maxsize=1)
+def get_redis() -> redis.Redis:
+    return redis.Redis.from_url(REDIS_URL, decode_responses=True)
@@ -0,0 +1,46 @@
+# Size-aware routing of analysis tasks onto the interactive and bulk queues.
+
+# app/scheduling.py
+
+from app.config import (
+    INTERACTIVE_QUEUE, BULK_QUEUE, INTERACTIVE_MAX_PAGES, INTERACTIVE_MAX_BYTES, OCR_PAGE_COST, SPLIT_OCR_QUEUES,
+    TASK_TIME_LIMIT_BASE, TASK_TIME_LIMIT_PER_PAGE, TASK_MAX_TIME_LIMIT, TASK_TIME_LIMIT_GRACE
+)
+
+PRIORITIES = ("auto", "high", "low")
+
+
+def choose_queue(page_count: int, size_bytes: int = 0, likely_ocr: bool = False, priority: str = "auto") -> str:
+    """
+    `high` and `low` pin a task to the interactive or bulk queue; `auto` sends documents whose
+    estimated cost fits the interactive limits to the interactive queue. With SPLIT_OCR_QUEUES,
+    likely scans go to the "_ocr" variant of the chosen queue.
+    """
+    if priority == "high":
+        queue = INTERACTIVE_QUEUE
+    elif priority == "low":
+        queue = BULK_QUEUE
+    else:
+        cost = page_count * (OCR_PAGE_COST if likely_ocr else 1)
+        if cost <= INTERACTIVE_MAX_PAGES and size_bytes <= INTERACTIVE_MAX_BYTES:
+            queue = INTERACTIVE_QUEUE
+        else:
+            queue = BULK_QUEUE
+    return f"{queue}_ocr" if SPLIT_OCR_QUEUES and likely_ocr else queue
+
+
+def time_limits(page_count: int, likely_ocr: bool = False) -> dict:
+    """
+    Returns the Celery time limit options, in seconds, for a task that analyzes `page_count`
+    pages. Pages are weighted like in the queue routing, so scans get more time per page.
+    """
+    cost = page_count * (OCR_PAGE_COST if likely_ocr else 1)
+    soft = min(TASK_TIME_LIMIT_BASE + cost * TASK_TIME_LIMIT_PER_PAGE, TASK_MAX_TIME_LIMIT)
+    return {"soft_time_limit": soft, "time_limit": soft + TASK_TIME_LIMIT_GRACE}
+
+
+def analysis_queues() -> list[str]:
+    queues = [INTERACTIVE_QUEUE, BULK_QUEUE]
+    if SPLIT_OCR_QUEUES:
+        queues += [f"{queue}_ocr" for queue in queues]
+    return queues
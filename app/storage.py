@@ -0,0 +1,189 @@
+# Per-task storage of uploads and outputs, with retention and garbage collection.
+
+# app/storage.py
+
+import os
+import json
+import time
+import shutil
+import logging
+from typing import Callable
+from app.config import (
+    INPUT_DIR, OUTPUT_DIR, STORAGE_RETENTION_SECONDS, STORAGE_HIGH_WATERMARK, STORAGE_LOW_WATERMARK,
+    STORAGE_ORPHAN_MIN_AGE_SECONDS
+)
+from app.cache import result_cache
+from app.object_store import object_store
+from app.preclassify import DOCUMENT_KEY_PREFIX
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+STORAGE_PREFIX = "mineru:storage"
+ENTRIES_KEY = f"{STORAGE_PREFIX}:entries"
+LRU_KEY = f"{STORAGE_PREFIX}:lru"
+
+
+def task_paths(task_id: str, filename: str) -> tuple[str, str]:
+    """
+    Returns (input_pdf_path, output_dir) of a task. Both live in a directory named after the
+    task id, so uploads with the same filename never share files.
+    """
+    input_pdf_path = os.path.join(INPUT_DIR, task_id, filename)
+    output_dir = os.path.join(OUTPUT_DIR, task_id)
+    os.makedirs(os.path.dirname(input_pdf_path), exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    return input_pdf_path, output_dir
+
+
+def remove_task_files(task_id: str):
+    shutil.rmtree(os.path.join(INPUT_DIR, task_id), ignore_errors=True)
+    shutil.rmtree(os.path.join(OUTPUT_DIR, task_id), ignore_errors=True)
+    object_store.delete_task(task_id)
+
+
+def task_size(task_id: str) -> int:
+    return object_store.size(os.path.join(INPUT_DIR, task_id)) + object_store.size(os.path.join(OUTPUT_DIR, task_id))
+
+
+def disk_usage(path: str = OUTPUT_DIR) -> dict:
+    # A fresh volume has no output directory until the first task writes one.
+    os.makedirs(path, exist_ok=True)
+    usage = shutil.disk_usage(path)
+    return {"total_bytes": usage.total, "used_bytes": usage.used, "free_bytes": usage.free, "used_ratio": usage.used / usage.total}
+
+
+class StorageRegistry:
+    """
+    Tracks the files held for each task, ordered by last use. Tasks answered from the cache are
+    recorded as aliases of the task whose output they point to, and using an alias keeps that
+    output alive.
+    """
+
+    def __init__(self, retention_seconds: int = STORAGE_RETENTION_SECONDS,
+                 high_watermark: float = STORAGE_HIGH_WATERMARK, low_watermark: float = STORAGE_LOW_WATERMARK):
+        self.retention_seconds = retention_seconds
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+
+    @property
+    def redis(self):
+        return get_redis()
+
+    def register(self, task_id: str):
+        entry = {"created_at": time.time(), "size_bytes": 0, "aliases": []}
+        pipe = self.redis.pipeline()
+        pipe.hset(ENTRIES_KEY, task_id, json.dumps(entry))
+        pipe.zadd(LRU_KEY, {task_id: time.time()})
+        pipe.execute()
+
+    def unregister(self, task_id: str):
+        pipe = self.redis.pipeline()
+        pipe.hdel(ENTRIES_KEY, task_id)
+        pipe.zrem(LRU_KEY, task_id)
+        pipe.execute()
+
+    def add_alias(self, output_dir: str, alias_task_id: str):
+        result_cache.add_alias(output_dir)
+        owner = os.path.basename(os.path.normpath(output_dir))
+        raw = self.redis.hget(ENTRIES_KEY, owner)
+        if not raw:
+            return
+        entry = json.loads(raw)
+        entry["aliases"].append(alias_task_id)
+        pipe = self.redis.pipeline()
+        pipe.hset(ENTRIES_KEY, owner, json.dumps(entry))
+        pipe.zadd(LRU_KEY, {owner: time.time()})
+        pipe.execute()
+
+    def record_size(self, task_id: str):
+        raw = self.redis.hget(ENTRIES_KEY, task_id)
+        if not raw:
+            return
+        entry = json.loads(raw)
+        entry["size_bytes"] = task_size(task_id)
+        self.redis.hset(ENTRIES_KEY, task_id, json.dumps(entry))
+
+    def usage(self) -> dict:
+        entries = [json.loads(raw) for raw in self.redis.hvals(ENTRIES_KEY)]
+        oldest = self.redis.zrange(LRU_KEY, 0, 0, withscores=True)
+        return {
+            "tasks": len(entries),
+            "aliases": sum(len(entry["aliases"]) for entry in entries),
+            "held_bytes": sum(entry["size_bytes"] for entry in entries),
+            "oldest_use_age_seconds": time.time() - oldest[0][1] if oldest else None,
+            "retention_seconds": self.retention_seconds,
+            "high_watermark": self.high_watermark,
+            "low_watermark": self.low_watermark,
+            "disk": disk_usage(),
+        }
+
+    def collect_garbage(self, forget_task: Callable[[str], None]) -> dict:
+        """
+        Removes the files of tasks unused for longer than the retention period, then keeps
+        removing the least recently used ones while the disk is above the high watermark, until
+        it is below the low one. `forget_task` is called for every removed task id and alias.
+        """
+        removed, freed_bytes = 0, 0
+        cutoff = time.time() - self.retention_seconds
+        for task_id in self.redis.zrangebyscore(LRU_KEY, 0, cutoff):
+            freed_bytes += self._remove(task_id, forget_task)
+            removed += 1
+        orphans = self._remove_orphans(min(cutoff, time.time() - STORAGE_ORPHAN_MIN_AGE_SECONDS))
+
+        by_watermark = 0
+        # With an object store the local disk only holds scratch files; it says nothing about the bucket.
+        if object_store.shared_filesystem and disk_usage()["used_ratio"] > self.high_watermark:
+            for task_id in self.redis.zrange(LRU_KEY, 0, -1):
+                if disk_usage()["used_ratio"] <= self.low_watermark:
+                    break
+                freed_bytes += self._remove(task_id, forget_task)
+                by_watermark += 1
+
+        if removed or by_watermark or orphans:
+            logger.info(f"Storage GC removed {removed} expired tasks, {by_watermark} tasks over the watermark and {orphans} orphaned files, freeing {freed_bytes} bytes.")
+        return {"expired": removed, "watermark": by_watermark, "orphans": orphans, "freed_bytes": freed_bytes}
+
+    def _remove_orphans(self, cutoff: float) -> int:
+        """
+        Deletes files and directories older than `cutoff` that no task owns, such as outputs
+        written before storage was keyed by task id or uploads of requests that failed midway.
+        A task being submitted writes its files before it is registered, so `cutoff` must lie
+        well before the start of any submission still in progress.
+        """
+        removed = 0
+        for root in (INPUT_DIR, OUTPUT_DIR):
+            if not os.path.isdir(root):
+                continue
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                if self.redis.hexists(ENTRIES_KEY, name) or os.path.getmtime(path) >= cutoff:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+                removed += 1
+        return removed
+
+    def _remove(self, task_id: str, forget_task: Callable[[str], None]) -> int:
+        raw = self.redis.hget(ENTRIES_KEY, task_id)
+        entry = json.loads(raw) if raw else {"aliases": []}
+        size_bytes = task_size(task_id)
+        remove_task_files(task_id)
+        result_cache.forget_directory(os.path.join(OUTPUT_DIR, task_id))
+        task_ids = [task_id, *entry["aliases"]]
+        for forgotten in task_ids:
+            try:
+                forget_task(forgotten)
+            except Exception:
+                logger.warning(f"Could not forget task {forgotten}.", exc_info=True)
+        pipe = self.redis.pipeline()
+        pipe.hdel(ENTRIES_KEY, task_id)
+        pipe.zrem(LRU_KEY, task_id)
+        pipe.delete(*[f"{DOCUMENT_KEY_PREFIX}:{forgotten}" for forgotten in task_ids])
+        pipe.execute()
+        return size_bytes
+
+
+storage = StorageRegistry()
@@ -0,0 +1,253 @@
+# Helpers shared by the single-file and batch submission endpoints.
+
+# app/submission.py
+
+import os
+import time
+import uuid
+import hashlib
+import logging
+from typing import BinaryIO
+from fastapi import HTTPException
+from celery import states, chord, group
+from app.worker import (
+    create_pdf_analysis_task, analyze_pdf_shard_task, merge_pdf_shards_task, deliver_webhook_task,
+    celery_app
+)
+from app.process_pdf import plan_page_ranges, OUTPUT_KINDS
+from app.cache import result_cache, compute_cache_key
+from app.notifications import publish_task_event, register_webhook, pop_webhook, is_valid_callback_url
+from app.uploads import looks_like_pdf
+from app.metrics import record_upload
+from app.storage import storage, remove_task_files
+from app.object_store import object_store
+from app.scheduling import PRIORITIES, choose_queue, time_limits
+from app.preclassify import profile_pdf, save_document_profile, delete_document_profile
+from app.admission import admission
+from app.config import UPLOAD_CHUNK_SIZE, SHARD_MIN_PAGES, DEFAULT_OUTPUTS
+
+logger = logging.getLogger(__name__)
+
+
+def parse_outputs(outputs: str | None) -> list[str]:
+    if outputs is None:
+        return list(DEFAULT_OUTPUTS)
+    selected = sorted({kind.strip() for kind in outputs.split(",") if kind.strip()})
+    unknown = [kind for kind in selected if kind not in OUTPUT_KINDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown outputs {unknown}. Choose from: {', '.join(OUTPUT_KINDS)}.")
+    return selected
+
+
+def parse_page_range(start_page: int | None, end_page: int | None) -> tuple[int, int | None]:
+    start_page = start_page or 0
+    if end_page is not None and end_page < start_page:
+        raise HTTPException(status_code=400, detail="end_page must not be smaller than start_page.")
+    return start_page, end_page
+
+
+def analysis_options(outputs: list[str], start_page: int = 0, end_page: int | None = None, text_only: bool = False, stream: bool = False) -> dict:
+    """
+    The options that change what an analysis produces, as they go into the cache key. Defaults
+    are left out, so whole-document results keep the keys they were cached under.
+    """
+    options = {"outputs": outputs}
+    if start_page or end_page is not None:
+        options["pages"] = [start_page, end_page]
+    if text_only:
+        options["text_only"] = True
+    # Streamed analyses do not join paragraphs across page windows, so their outputs differ slightly.
+    if stream:
+        options["stream"] = True
+    return options
+
+
+def save_upload(source: BinaryIO, dest_path: str) -> str:
+    """
+    Copies an uploaded file to `dest_path` in chunks and returns its SHA-256 hex digest.
+    Files that do not start with a PDF header are rejected.
+    """
+    sha256 = hashlib.sha256()
+    try:
+        with open(dest_path, "wb") as buffer:
+            for index, chunk in enumerate(iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b"")):
+                if index == 0 and not looks_like_pdf(chunk):
+                    raise HTTPException(status_code=400, detail=f"'{os.path.basename(dest_path)}' is not a PDF document.")
+                sha256.update(chunk)
+                buffer.write(chunk)
+            record_upload(buffer.tell())
+        logger.info(f"Received and saved file to: {dest_path}")
+    except HTTPException:
+        os.remove(dest_path)
+        raise
+    except Exception as e:
+        logger.error(f"Error saving file: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to save uploaded file: {e}")
+    return sha256.hexdigest()
+
+
+def parse_priority(priority: str | None) -> str:
+    priority = (priority or "auto").strip().lower()
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority '{priority}'. Choose from: {', '.join(PRIORITIES)}.")
+    return priority
+
+
+def profile_upload(pdf_path: str) -> dict:
+    try:
+        return profile_pdf(pdf_path)
+    except Exception as e:
+        logger.error(f"Could not open uploaded PDF '{pdf_path}': {e}")
+        raise HTTPException(status_code=400, detail="The uploaded file is not a readable PDF.")
+
+
+def validate_callback_url(callback_url: str | None) -> str | None:
+    if callback_url and not is_valid_callback_url(callback_url):
+        raise HTTPException(status_code=400, detail="callback_url must be an absolute http(s) URL.")
+    return callback_url or None
+
+
+def answer_from_cache(cache_key: str, filename: str, callback_url: str | None = None, task_id: str | None = None, cached: dict | None = None) -> str | None:
+    """
+    On a cache hit, records a finished task that points at the cached output and returns its id.
+    The files saved for `task_id` are not needed then and are removed. `cached` is the cache
+    entry when the caller has already looked it up.
+    """
+    cached = cached or result_cache.lookup(cache_key)
+    if not cached:
+        return None
+    task_id = task_id or str(uuid.uuid4())
+    remove_task_files(task_id)
+    storage.add_alias(cached["result"]["output_directory"], task_id)
+    celery_app.backend.store_result(task_id, cached["result"], states.SUCCESS)
+    publish_task_event(task_id, states.SUCCESS, result=cached["result"])
+    if callback_url:
+        deliver_webhook_task.delay(callback_url, {"task_id": task_id, "status": states.SUCCESS, "result": cached["result"]})
+    logger.info(f"Cache hit for '{filename}', answered with task {task_id} from '{cached['result']['output_directory']}'")
+    return task_id
+
+
+def hand_off_upload(input_pdf_path: str):
+    """
+    Makes a saved upload available to the workers, wherever they run. The web keeps no copy of
+    it when uploads go to an object store.
+    """
+    try:
+        object_store.publish(input_pdf_path)
+    except Exception as e:
+        logger.error(f"Could not store upload '{input_pdf_path}': {e}", exc_info=True)
+        raise HTTPException(status_code=503, detail="Could not store the uploaded file. Please retry later.")
+    object_store.release(input_pdf_path)
+
+
+def prepare_signature(signature, callback_url: str | None, document: dict | None = None):
+    """
+    Fixes the task id of `signature` up front and registers its webhook and document profile
+    before anything is published, so a fast task cannot finish before they are known.
+    """
+    task_id = signature.freeze().id
+    ttl_seconds = int(celery_app.conf.result_expires.total_seconds())
+    if callback_url:
+        register_webhook(task_id, callback_url, ttl_seconds)
+    if document:
+        save_document_profile(task_id, document, ttl_seconds)
+    return task_id
+
+
+def withdraw_signature(task_id: str):
+    """
+    Undoes `prepare_signature` and the storage registration for a task that was never published.
+    """
+    pop_webhook(task_id)
+    delete_document_profile(task_id)
+    storage.unregister(task_id)
+
+
+def document_pages(document: dict) -> int:
+    start_page, end_page = document["page_range"]
+    return end_page - start_page + 1
+
+
+def enqueue_analysis(task_id: str, input_pdf_path: str, output_dir: str, filename: str, sha256: str, options: dict,
+                     shard_pages: int = 0, priority: str = "auto", callback_url: str | None = None, client: str = "unknown") -> dict:
+    """
+    Answers a saved upload from the cache or publishes its analysis under `task_id`, and returns
+    the submit response. `options` are built by `analysis_options`. Published analyses count as
+    outstanding work of `client` for admission control.
+    """
+    cache_key = compute_cache_key(sha256, options=options)
+    if answer_from_cache(cache_key, filename, callback_url, task_id):
+        return {"task_id": task_id, "status_url": f"/tasks/status/{task_id}", "cached": True}
+
+    signature, document = build_analysis_signature(task_id, input_pdf_path, output_dir, cache_key, options, shard_pages, priority)
+    prepare_signature(signature, callback_url, document)
+    storage.register(task_id)
+    try:
+        hand_off_upload(input_pdf_path)
+        task = signature.apply_async()
+    except BaseException:
+        withdraw_signature(task_id)
+        raise
+    admission.admit(task.id, document_pages(document), client)
+    logger.info(f"Submitted task {task.id} for file '{filename}' to queue '{document['queue']}'. Output will be in '{output_dir}'")
+    return {"task_id": task.id, "status_url": f"/tasks/status/{task.id}", "cached": False, "queue": document["queue"]}
+
+
+def build_analysis_signature(task_id: str, input_pdf_path: str, output_dir: str, cache_key: str, options: dict,
+                             shard_pages: int = 0, priority: str = "auto"):
+    """
+    Returns the Celery signature that analyzes one saved PDF as `task_id` with the given
+    `analysis_options`, and the pre-classification of the document including the queue it is
+    routed to. The signature is a single task, or a chord of page-range shards followed by a
+    merge when the selected pages are enough to shard. Streamed analyses are never sharded, as
+    their pages must arrive in order. All tasks of one document share its queue and skip
+    classify() when the pre-classification is conclusive. Each task gets time limits scaled by
+    the pages it analyzes.
+    """
+    outputs = options["outputs"]
+    start_page, end_page = options.get("pages", (0, None))
+    text_only = options.get("text_only", False)
+    stream = options.get("stream", False)
+    document = profile_upload(input_pdf_path)
+    page_count = document["page_count"]
+    if start_page >= page_count:
+        raise HTTPException(status_code=400, detail=f"start_page {start_page} is beyond the last page of the document ({page_count} pages).")
+    end_page = page_count - 1 if end_page is None else min(end_page, page_count - 1)
+    selected_pages = end_page - start_page + 1
+    # Routing goes by the pages that are analyzed, not by the size of the whole document.
+    queue = choose_queue(selected_pages, document["size_bytes"] * selected_pages // page_count, document["likely_ocr"], priority)
+    document["page_range"] = [start_page, end_page]
+    document["stream"] = stream
+    document["queue"] = queue
+    limits = time_limits(selected_pages, document["likely_ocr"])
+    document["time_limits"] = limits
+    if shard_pages and not stream and selected_pages >= max(SHARD_MIN_PAGES, shard_pages + 1):
+        page_ranges = plan_page_ranges(selected_pages, shard_pages, start_page)
+        shards = group(
+            analyze_pdf_shard_task.s(
+                pdf_path=input_pdf_path, output_dir=output_dir, start_page=start, end_page=end,
+                parse_method=document["parse_method"], text_only=text_only, first_page=start_page, last_page=end_page,
+                document_task_id=task_id
+            ).set(queue=queue, **time_limits(end - start + 1, document["likely_ocr"]))
+            for start, end in page_ranges
+        )
+        logger.info(f"Sharding '{input_pdf_path}' (pages {start_page}-{end_page} of {page_count}) into {len(page_ranges)} sub-tasks")
+        return chord(shards, merge_pdf_shards_task.s(
+            pdf_path=input_pdf_path,
+            output_dir=output_dir,
+            cache_key=cache_key,
+            submitted_at=time.time(),
+            outputs=outputs
+        ).set(queue=queue, task_id=task_id, **limits)), document
+
+    return create_pdf_analysis_task.s(
+        pdf_path=input_pdf_path,
+        output_dir=output_dir,
+        cache_key=cache_key,
+        outputs=outputs,
+        parse_method=document["parse_method"],
+        start_page=start_page,
+        end_page=end_page,
+        text_only=text_only,
+        stream=stream
+    ).set(queue=queue, task_id=task_id, **limits), document
@@ -0,0 +1,58 @@
+# Bulk lookup of task states straight from the Celery result backend.
+
+# app/task_status.py
+
+from celery.backends.redis import RedisBackend
+from celery.result import AsyncResult
+from app.worker import celery_app
+from app.dead_letter import dead_letters
+
+MGET_CHUNK_SIZE = 1000
+
+
+def error_message(error) -> str:
+    """
+    Returns the message of a failed task's error, whether it is the exception itself or the
+    serialized form a result meta decodes to.
+    """
+    return str(celery_app.backend.exception_to_python(error))
+
+
+def _describe(task_id: str, meta: dict | None, include_result: bool) -> dict:
+    if meta is None:
+        return {"task_id": task_id, "status": "PENDING", "result": None, "progress": None}
+    status = meta["status"]
+    result = meta.get("result")
+    progress = result if status == "PROGRESS" else None
+    state = {"task_id": task_id, "status": status, "result": None, "progress": progress}
+    if status == "FAILURE":
+        state["result"] = error_message(result)
+        state["dead_letter"] = dead_letters.get(task_id)
+    elif status == "SUCCESS" and include_result:
+        state["result"] = result
+    return state
+
+
+def fetch_task_states(task_ids: list[str], include_result: bool = True) -> list[dict]:
+    """
+    Resolves many task states at once, in the shape of `/tasks/status/{task_id}` without the
+    document profile. With the Redis result backend all metas are read with pipelined MGET
+    calls instead of one GET per task.
+    """
+    backend = celery_app.backend
+    if not isinstance(backend, RedisBackend):
+        states = []
+        for task_id in task_ids:
+            task_result = AsyncResult(task_id, app=celery_app)
+            states.append(_describe(task_id, {"status": task_result.status, "result": task_result.result}, include_result))
+        return states
+
+    pipe = backend.client.pipeline(transaction=False)
+    for start in range(0, len(task_ids), MGET_CHUNK_SIZE):
+        pipe.mget([backend.get_key_for_task(task_id) for task_id in task_ids[start:start + MGET_CHUNK_SIZE]])
+    values = [value for chunk in pipe.execute() for value in chunk]
+
+    return [
+        _describe(task_id, backend.decode_result(value) if value else None, include_result)
+        for task_id, value in zip(task_ids, values)
+    ]
@@ -0,0 +1,240 @@
+# Non-blocking upload handling: request body limits, upload concurrency and streaming to disk.
+
+# app/uploads.py
+
+import os
+import asyncio
+import hashlib
+import logging
+from typing import Callable
+import anyio
+from fastapi import HTTPException, Request
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.responses import JSONResponse
+from app.config import UPLOAD_CHUNK_SIZE, UPLOAD_CONCURRENCY, UPLOAD_IO_THREADS
+from app.metrics import record_upload
+
+logger = logging.getLogger(__name__)
+
+PDF_MAGIC = b"%PDF-"
+# Form fields other than the file are small options; anything longer is not one
+MAX_FORM_FIELD_BYTES = 64 * 1024
+
+# Upload file I/O gets its own small thread pool so it never competes with the default
+# AnyIO limiter that serves the sync status and download endpoints.
+_upload_io_limiter: anyio.CapacityLimiter | None = None
+
+
+def looks_like_pdf(head: bytes) -> bool:
+    # The header may be preceded by junk bytes, but must sit within the first KiB.
+    return PDF_MAGIC in head[:1024]
+
+
+def _limiter() -> anyio.CapacityLimiter:
+    global _upload_io_limiter
+    if _upload_io_limiter is None:
+        _upload_io_limiter = anyio.CapacityLimiter(UPLOAD_IO_THREADS)
+    return _upload_io_limiter
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class UploadLimitMiddleware:
+    """
+    Guards the upload endpoints. Requests whose Content-Length exceeds the limit are rejected
+    before any byte of the body is read, and chunked bodies are cut off as soon as they cross it.
+    At most `max_concurrent` upload bodies are read at a time; further uploads wait without
+    their bodies being consumed, so the kernel applies TCP backpressure to the clients.
+    """
+
+    def __init__(self, app, limits: dict[str, int], max_concurrent: int = UPLOAD_CONCURRENCY):
+        self.app = app
+        self.limits = limits
+        self.max_concurrent = max_concurrent
+        self._semaphore: asyncio.Semaphore | None = None
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self.limits.get(scope.get("path", "")) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            await self._reject(max_bytes)(scope, receive, send)
+            return
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        received = 0
+        too_large = rejected = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    too_large = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal rejected
+            # Once the body was cut off, whatever the app answers is replaced by the 413.
+            if not too_large:
+                await send(message)
+            elif not rejected:
+                rejected = True
+                await self._reject(max_bytes)(scope, receive, send)
+
+        async with self._semaphore:
+            try:
+                await self.app(scope, limited_receive, guarded_send)
+            except _BodyTooLarge:
+                if not rejected:
+                    await self._reject(max_bytes)(scope, receive, send)
+
+    @staticmethod
+    def _reject(max_bytes: int) -> JSONResponse:
+        return JSONResponse(status_code=413, content={"detail": f"Upload exceeds the limit of {max_bytes} bytes."})
+
+
+class StreamedUpload:
+    """
+    What `receive_pdf_upload` took from a request: the text fields of the form, and the file
+    part's filename, SHA-256 hex digest, size and where it was written.
+    """
+
+    def __init__(self, fields: dict[str, str], filename: str, path: str, sha256: str, size: int):
+        self.fields = fields
+        self.filename = filename
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+
+
+class _MultipartEvents:
+    """
+    Collects the callbacks of the multipart parser, which are synchronous, so the parts can be
+    handled with awaits after each chunk of the body has been fed to it.
+    """
+
+    def __init__(self):
+        self.events: list[tuple] = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: dict[bytes, bytes] = {}
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": lambda data, start, end: self._append_header("_header_field", data[start:end]),
+            "on_header_value": lambda data, start, end: self._append_header("_header_value", data[start:end]),
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": lambda: self.events.append(("begin", self._headers)),
+            "on_part_data": lambda data, start, end: self.events.append(("data", bytes(data[start:end]))),
+            "on_part_end": lambda: self.events.append(("end",)),
+        }
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _append_header(self, name: str, data: bytes):
+        setattr(self, name, getattr(self, name) + data)
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+
+def _write_chunk(buffer, data: bytes):
+    buffer.write(data)
+
+
+async def receive_pdf_upload(request: Request, file_field: str, destination: Callable[[str], str]) -> StreamedUpload:
+    """
+    Parses a multipart/form-data body while it arrives and writes the part named `file_field`
+    straight to the path `destination(filename)` returns, hashing it on the way; the file is not
+    spooled anywhere first. The upload is rejected as soon as its first KiB does not carry a PDF
+    header. `destination` may raise an HTTPException to refuse the filename. The other parts are
+    returned as text fields of at most MAX_FORM_FIELD_BYTES each.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload.")
+
+    events = _MultipartEvents()
+    parser = MultipartParser(options[b"boundary"], events.callbacks())
+    limiter = _limiter()
+    fields: dict[str, str] = {}
+    sha256 = hashlib.sha256()
+    filename = path = buffer = None
+    size = 0
+    head = b""
+    part_name = field_value = None
+
+    async def write(data: bytes, last: bool = False):
+        nonlocal size, head
+        if head is not None:
+            # The header may sit anywhere in the first KiB, so that much is held back for the check.
+            head += data
+            if len(head) < 1024 and not last:
+                return
+            if not looks_like_pdf(head):
+                raise HTTPException(status_code=400, detail="The uploaded file is not a PDF document.")
+            data, head = head, None
+        sha256.update(data)
+        size += len(data)
+        await anyio.to_thread.run_sync(_write_chunk, buffer, data, limiter=limiter)
+
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except FormParserError as e:
+                raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+            for event in events.events:
+                if event[0] == "begin":
+                    _, disposition = parse_options_header(event[1].get(b"content-disposition", b""))
+                    part_name = disposition.get(b"name", b"").decode("utf-8", "replace")
+                    if part_name == file_field and path is None:
+                        filename = disposition.get(b"filename", b"").decode("utf-8", "replace")
+                        path = destination(filename)
+                        buffer = await anyio.to_thread.run_sync(open, path, "wb", limiter=limiter)
+                    else:
+                        field_value = b""
+                elif event[0] == "data":
+                    if part_name == file_field and buffer is not None and not buffer.closed:
+                        await write(event[1])
+                    elif field_value is not None:
+                        field_value += event[1]
+                        if len(field_value) > MAX_FORM_FIELD_BYTES:
+                            raise HTTPException(status_code=400, detail=f"Form field '{part_name}' is too long.")
+                elif event[0] == "end":
+                    if part_name == file_field and buffer is not None and not buffer.closed:
+                        await write(b"", last=True)
+                        await anyio.to_thread.run_sync(buffer.close, limiter=limiter)
+                    elif field_value is not None:
+                        fields[part_name] = field_value.decode("utf-8", "replace")
+                    part_name = field_value = None
+            events.events.clear()
+        parser.finalize()
+    except BaseException:
+        if buffer is not None:
+            buffer.close()
+            os.remove(path)
+        raise
+
+    if buffer is None or not buffer.closed:
+        if buffer is not None:
+            buffer.close()
+            os.remove(path)
+        raise HTTPException(status_code=400, detail=f"The upload has no complete '{file_field}' part.")
+    record_upload(size)
+    logger.info(f"Received and saved file to: {path}")
+    return StreamedUpload(fields, filename, path, sha256.hexdigest(), size)
@@ -5,24 +5,460 @@
 
 # app/worker.py
 
+import os
+import gc
+import time
 import logging
-from celery import Celery
-from app.logging_config import setup_logging
-from app.process_pdf import analyze_pdf
+from datetime import timedelta
+import redis
+from celery import Celery, Task
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.concurrency import get_implementation
+from celery.concurrency.prefork import TaskPool as PreforkPool
+from celery.signals import (
+    worker_init, worker_shutdown, worker_process_init, worker_process_shutdown, before_task_publish,
+    task_prerun, task_postrun, task_success, task_failure
+)
+from app.logging_config import setup_logging, bind_log_context, clear_log_context
+from app.process_pdf import (
+    analyze_pdf, analyze_pdf_pages, merge_pdf_shards, render_visualizations, OUTPUT_KINDS,
+    SHARD_DIR_NAME
+)
+from app.cache import result_cache
+from app.storage import storage
+from app.object_store import object_store, TRANSIENT_STORE_ERRORS
+from app.dead_letter import (
+    dead_letters, RepeatedWorkerLossError, REASON_ERROR, REASON_TIMEOUT, REASON_RETRIES_EXHAUSTED, REASON_WORKER_LOST, REASON_MEMORY_LIMIT, REASON_CRASHED
+)
+from app.isolation import (
+    run_document, isolation_mode, inference_device, document_helper, DocumentMemoryExceeded,
+    DocumentProcessDied
+)
+from app.hang_guard import HangGuard
+from app.admission import admission
+from app.config import (
+    REDIS_URL, WARMUP_ENABLED, WARMUP_TIMEOUT, WEBHOOK_MAX_RETRIES, INTERACTIVE_QUEUE, BULK_QUEUE, WORKER_PREFETCH_MULTIPLIER, WORKER_METRICS_PORT,
+    STORAGE_RETENTION_SECONDS, STORAGE_GC_INTERVAL, TASK_MAX_TIME_LIMIT, TASK_TIME_LIMIT_GRACE, TASK_MAX_RETRIES, TASK_RETRY_BACKOFF_MAX,
+    DOCUMENT_ISOLATION, WORKER_MAX_TASKS_PER_CHILD, WORKER_MAX_MEMORY_PER_CHILD, LOG_MODE, MICRO_BATCH_SIZE, WORKER_HANG_CHECK_SECONDS
+)
+from app.model_warmup import warm_up_models, report_worker_state, clear_worker_state, current_rss_bytes, worker_id
+from app.notifications import publish_task_event, pop_webhook, post_webhook
+from app.progress import ProgressTracker
+from app import metrics
 
 setup_logging()
 logger = logging.getLogger(__name__)
 
-redis_url = "redis://redis:6379/0"
+redis_url = REDIS_URL
 
 celery_app = Celery("tasks", broker=redis_url, backend=redis_url)
-celery_app.conf.update(task_track_started=True)
+celery_app.conf.update(
+    task_track_started=True,
+    # Child processes load the models before reporting in, which takes far longer than the 4s default.
+    worker_proc_alive_timeout=WARMUP_TIMEOUT,
+    # Analyses are routed per document at submit time (see app/scheduling.py); anything else
+    # that is not routed explicitly is heavy work and lands on the bulk queue.
+    task_default_queue=BULK_QUEUE,
+    task_routes={
+        "deliver_webhook_task": {"queue": INTERACTIVE_QUEUE},
+        "collect_garbage_task": {"queue": INTERACTIVE_QUEUE},
+    },
+    # Results live exactly as long as the files they point to.
+    result_expires=timedelta(seconds=STORAGE_RETENTION_SECONDS),
+    beat_schedule={
+        "collect-storage-garbage": {"task": "collect_garbage_task", "schedule": STORAGE_GC_INTERVAL},
+    },
+    # A process only reserves the task it is about to run, so a long scan does not hold
+    # short documents hostage in its prefetch buffer.
+    worker_prefetch_multiplier=WORKER_PREFETCH_MULTIPLIER,
+    # Recycling of worker processes; Celery takes the memory limit in KiB.
+    worker_max_tasks_per_child=WORKER_MAX_TASKS_PER_CHILD or None,
+    worker_max_memory_per_child=WORKER_MAX_MEMORY_PER_CHILD // 1024 or None,
+    # Analysis tasks are acknowledged only when they finish (see AnalysisTask). Redis hands an
+    # unacknowledged task to another worker after the visibility timeout, so it has to outlast a
+    # reserved task waiting behind a running one plus its own run, each up to the hard time limit.
+    broker_transport_options={"visibility_timeout": 2 * (TASK_MAX_TIME_LIMIT + TASK_TIME_LIMIT_GRACE) + 600},
+    # Celery would otherwise swap the queue-fed JSON logging for its own synchronous handlers.
+    worker_hijack_root_logger=LOG_MODE != "json"
+)
 
-@celery_app.task(bind=True, name="create_pdf_analysis_task")
-def create_pdf_analysis_task(self, pdf_path: str, output_dir: str):
+# Failures that say nothing about the document and are worth retrying after a pause
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, redis.exceptions.ConnectionError, redis.exceptions.TimeoutError, *TRANSIENT_STORE_ERRORS)
+
+class AnalysisTask(Task):
+    """
+    Base of the tasks that run the models on a document. They are acknowledged late and handed
+    back to the queue when the worker process dies, so an OOM kill or a crash does not lose
+    them; a document that keeps killing workers is dead-lettered after TASK_MAX_DELIVERIES
+    starts. Transient errors are retried with exponential backoff. Anything else, a soft
+    time limit or exhausted retries puts the task in the dead-letter queue, under the task id
+    the client holds.
+    """
+
+    acks_late = True
+    reject_on_worker_lost = True
+    autoretry_for = TRANSIENT_ERRORS
+    retry_backoff = True
+    retry_backoff_max = TASK_RETRY_BACKOFF_MAX
+    max_retries = TASK_MAX_RETRIES
+
+    def __call__(self, *args, **kwargs):
+        task_id = self.request.id
+        dead_letters.count_delivery(task_id)
+        try:
+            return super().__call__(*args, **kwargs)
+        finally:
+            try:
+                dead_letters.clear_deliveries(task_id)
+            except Exception:
+                logger.warning(f"[TASK ID: {task_id}] Could not clear the delivery count.", exc_info=True)
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        if isinstance(exc, RepeatedWorkerLossError):
+            reason = REASON_WORKER_LOST
+        elif isinstance(exc, SoftTimeLimitExceeded):
+            reason = REASON_TIMEOUT
+        elif isinstance(exc, DocumentMemoryExceeded):
+            reason = REASON_MEMORY_LIMIT
+        elif isinstance(exc, DocumentProcessDied):
+            reason = REASON_CRASHED
+        elif isinstance(exc, TRANSIENT_ERRORS):
+            reason = REASON_RETRIES_EXHAUSTED
+        else:
+            reason = REASON_ERROR
+        try:
+            dead_letters.add(
+                kwargs.get("document_task_id") or task_id, self.name, reason, f"{type(exc).__name__}: {exc}",
+                attempts=self.request.retries + 1, failed_task_id=task_id, kwargs=kwargs, hostname=self.request.hostname
+            )
+            metrics.DEAD_LETTERS.labels(task=self.name, reason=reason).inc()
+        except Exception:
+            logger.warning(f"[TASK ID: {task_id}] Could not dead-letter the task.", exc_info=True)
+
+@worker_init.connect
+def serve_worker_metrics(**kwargs):
+    try:
+        metrics.start_worker_exporter(WORKER_METRICS_PORT)
+    except Exception:
+        logger.warning("Could not start the worker metrics exporter.", exc_info=True)
+
+@worker_process_init.connect
+def preload_models(**kwargs):
+    if isolation_mode() == "spawn":
+        # The document helper runs every document with models of its own; loading them here too would only hold a second copy.
+        logger.info(f"DOCUMENT_ISOLATION: inference runs on '{inference_device()}', documents go to a spawned helper process with its own models.")
+        report_worker_state({"ready": False})
+        try:
+            report_worker_state(document_helper.start())
+        except Exception as e:
+            logger.error("The document helper did not start; it is started again for the first document.", exc_info=True)
+            report_worker_state({"ready": False, "error": str(e)})
+        return
+    if not WARMUP_ENABLED:
+        report_worker_state({"ready": True, "modes": [], "warmup_seconds": 0.0, "model_memory_bytes": 0})
+        return
+    report_worker_state({"ready": False})
+    try:
+        report_worker_state(warm_up_models())
+    except Exception as e:
+        # Tasks can still run; doc_analyze will load the models lazily as before.
+        logger.error("Model warmup failed, models will be loaded on first use.", exc_info=True)
+        report_worker_state({"ready": False, "error": str(e)})
+        return
+    if DOCUMENT_ISOLATION:
+        # Keeps the garbage collector from writing to the warmed objects in every document child,
+        # which would copy their pages instead of sharing them.
+        gc.freeze()
+
+def _runs_tasks_in_main_process(worker) -> bool:
+    # The threads and solo pools never start child processes, so worker_process_* signals do not fire.
+    return not issubclass(get_implementation(worker.pool_cls), PreforkPool)
+
+def _forget_lost_runs(task_id: str, others: list[str]):
+    # The other tasks of a worker stopped by the hang guard did nothing wrong; their next start counts as the first.
+    for other in others:
+        dead_letters.clear_deliveries(other)
+
+# Celery only enforces soft_time_limit/time_limit in the prefork pool; the guard takes over elsewhere.
+hang_guard = HangGuard(WORKER_HANG_CHECK_SECONDS, on_hard_limit=_forget_lost_runs)
+
+@worker_init.connect
+def guard_pool_limits(sender=None, **kwargs):
+    if sender is None:
+        return
+    if _runs_tasks_in_main_process(sender):
+        hang_guard.start()
+        logger.info(
+            f"The {get_implementation(sender.pool_cls).__module__.rsplit('.', 1)[-1]} pool does not enforce the task time limits; "
+            f"checking them every {WORKER_HANG_CHECK_SECONDS}s instead. A task past its hard limit stops the whole worker."
+        )
+    elif MICRO_BATCH_SIZE > 1:
+        logger.warning("MICRO_BATCH_SIZE is set, but the prefork pool runs one task per process, so nothing is batched. Use --pool threads to batch.")
+
+@task_prerun.connect
+def start_time_limits(task_id=None, task=None, **kwargs):
+    if task is None or not hang_guard.active:
+        return
+    time_limit, soft_time_limit = task.request.timelimit or (None, None)
+    soft_time_limit = soft_time_limit or task.soft_time_limit or TASK_MAX_TIME_LIMIT
+    hang_guard.task_started(task_id, soft_time_limit, time_limit or task.time_limit or soft_time_limit + TASK_TIME_LIMIT_GRACE)
+
+@task_postrun.connect
+def stop_time_limits(task_id=None, **kwargs):
+    hang_guard.task_finished(task_id)
+
+@worker_init.connect
+def preload_models_in_main_process(sender=None, **kwargs):
+    # With the threads pool all tasks share these models, which micro-batching relies on.
+    if sender is not None and _runs_tasks_in_main_process(sender):
+        preload_models()
+
+@worker_shutdown.connect
+def forget_main_process_worker(sender=None, **kwargs):
+    if sender is not None and _runs_tasks_in_main_process(sender):
+        stop_document_helper()
+        forget_worker()
+
+@worker_process_shutdown.connect
+def stop_document_helper(**kwargs):
+    document_helper.stop()
+
+@worker_process_shutdown.connect
+def forget_worker(pid=None, **kwargs):
+    metrics.forget_worker_process(pid or os.getpid())
+    try:
+        clear_worker_state()
+    except Exception:
+        logger.warning("Could not clear worker readiness state.", exc_info=True)
+
+@before_task_publish.connect
+def stamp_submission_time(headers=None, **kwargs):
+    # Read back by the queue age metrics and the queue wait histogram.
+    if headers is not None:
+        headers.setdefault("submitted_at", time.time())
+
+# Tasks whose ids are handed out to clients; shard sub-tasks and webhook deliveries stay quiet.
+CLIENT_FACING_TASKS = ("create_pdf_analysis_task", "merge_pdf_shards_task", "render_visualizations_task")
+
+@task_prerun.connect
+def announce_task_started(task_id=None, task=None, **kwargs):
+    if task is None:
+        return
+    submitted_at = task.request.get("submitted_at")
+    if submitted_at:
+        queue = (task.request.delivery_info or {}).get("routing_key") or "unknown"
+        metrics.QUEUE_WAIT_SECONDS.labels(queue=queue).observe(max(time.time() - submitted_at, 0.0))
+    if task.name in CLIENT_FACING_TASKS:
+        publish_task_event(task_id, "STARTED")
+
+@task_prerun.connect
+def bind_task_log_context(task_id=None, kwargs=None, **extra):
+    # Shards log under the id of the document they belong to.
+    kwargs = kwargs or {}
+    pdf_path = kwargs.get("pdf_path")
+    bind_log_context(task_id=kwargs.get("document_task_id") or task_id, filename=os.path.basename(pdf_path) if pdf_path else None)
+
+@task_postrun.connect
+def clear_task_log_context(**kwargs):
+    clear_log_context()
+
+@task_prerun.connect
+def prune_scratch_space(**kwargs):
+    try:
+        object_store.prune_local()
+    except Exception:
+        logger.warning("Could not prune local scratch space.", exc_info=True)
+
+@task_postrun.connect
+def record_task_metrics(task=None, state=None, **kwargs):
+    if task is not None:
+        metrics.TASKS.labels(task=task.name, state=state or "UNKNOWN").inc()
+    metrics.WORKER_RSS_BYTES.set(current_rss_bytes())
+
+@task_success.connect
+def announce_task_succeeded(sender=None, result=None, **kwargs):
+    if sender is not None and sender.name in CLIENT_FACING_TASKS:
+        if isinstance(result, dict):
+            metrics.record_analysis(result, sender.name)
+            _record_storage(result)
+        _notify_finished(sender.request.id, "SUCCESS", result=result)
+
+@task_failure.connect
+def announce_task_failed(sender=None, task_id=None, exception=None, **kwargs):
+    if sender is not None and sender.name in CLIENT_FACING_TASKS:
+        _notify_finished(task_id, "FAILURE", error=str(exception))
+
+# Tasks whose success finishes the document a client submitted
+DOCUMENT_TASKS = ("create_pdf_analysis_task", "merge_pdf_shards_task")
+
+@task_success.connect
+def release_admitted_document(sender=None, **kwargs):
+    if sender is not None and sender.name in DOCUMENT_TASKS:
+        _release_admission(sender.request.id, worker_id())
+
+@task_failure.connect
+def release_failed_document(sender=None, task_id=None, kwargs=None, **extra):
+    # A failed shard fails its whole document.
+    if isinstance(sender, AnalysisTask):
+        _release_admission((kwargs or {}).get("document_task_id") or task_id, worker_id())
+
+def _release_admission(task_id: str, worker: str):
+    try:
+        admission.release(task_id, worker=worker)
+    except Exception:
+        logger.warning(f"[TASK ID: {task_id}] Could not release the task from admission control.", exc_info=True)
+
+# Tasks whose running time counts as busy for the pages per second behind GET /autoscaling
+BUSY_TASKS = ("create_pdf_analysis_task", "analyze_pdf_shard_task", "merge_pdf_shards_task")
+_busy_since: dict[str, float] = {}
+
+@task_prerun.connect
+def start_busy_clock(task_id=None, task=None, **kwargs):
+    if task is not None and task.name in BUSY_TASKS:
+        _busy_since[task_id] = time.monotonic()
+
+@task_postrun.connect
+def stop_busy_clock(task_id=None, **kwargs):
+    started_at = _busy_since.pop(task_id, None)
+    if started_at is None:
+        return
+    try:
+        admission.record_busy(worker_id(), time.monotonic() - started_at)
+    except Exception:
+        logger.warning(f"[TASK ID: {task_id}] Could not record the worker's busy time.", exc_info=True)
+
+def _notify_finished(task_id: str, status: str, **data):
+    publish_task_event(task_id, status, **data)
+    try:
+        callback_url = pop_webhook(task_id)
+    except Exception:
+        logger.warning(f"[TASK ID: {task_id}] Could not look up the webhook.", exc_info=True)
+        return
+    if callback_url:
+        deliver_webhook_task.delay(callback_url, {"task_id": task_id, "status": status, **data})
+
+def _progress_tracker(task, announce: bool = True) -> ProgressTracker:
+    """
+    Returns a tracker that stores each snapshot as the task's PROGRESS state and, for tasks
+    whose ids clients hold, publishes it on the task event channel as well.
+    """
+    def report(snapshot: dict):
+        task.update_state(state="PROGRESS", meta=snapshot)
+        if announce:
+            publish_task_event(task.request.id, "PROGRESS", progress=snapshot)
+    return ProgressTracker(callback=report)
+
+def _record_storage(result: dict):
+    # Outputs live in a directory named after the task that owns them.
+    try:
+        storage.record_size(os.path.basename(result["output_directory"]))
+    except Exception:
+        logger.warning("Could not record the storage size of a result.", exc_info=True)
+
+def _release(*paths: str):
+    # Drops local copies once they are in the object store; a no-op on a shared volume.
+    for path in paths:
+        try:
+            object_store.release(path)
+        except Exception:
+            logger.warning(f"Could not release local copy '{path}'.", exc_info=True)
+
+def _cache_result(task_id: str, cache_key: str | None, result: dict, processing_seconds: float):
+    if not cache_key:
+        return
+    try:
+        result_cache.store(cache_key, result, processing_seconds)
+    except Exception:
+        logger.warning(f"[TASK ID: {task_id}] Could not cache the result.", exc_info=True)
+
+@celery_app.task(bind=True, base=AnalysisTask, name="create_pdf_analysis_task")
+def create_pdf_analysis_task(self, pdf_path: str, output_dir: str, cache_key: str | None = None, outputs: list[str] = OUTPUT_KINDS, parse_method: str | None = None,
+                             start_page: int = 0, end_page: int | None = None, text_only: bool = False, stream: bool = False):
     logger.info(f"[TASK ID: {self.request.id}] Task received for PDF: {pdf_path}")
+    started_at = time.perf_counter()
     try:
-        return analyze_pdf(pdf_path, output_dir)
+        object_store.fetch(pdf_path)
+        result, peak_rss_bytes = run_document(
+            analyze_pdf, pdf_path, output_dir, outputs, progress=_progress_tracker(self), parse_method=parse_method,
+            start_page=start_page, end_page=end_page, text_only=text_only,
+            stream=stream, on_stream_flush=object_store.publish
+        )
+        result["peak_rss_bytes"] = peak_rss_bytes
+        object_store.publish(output_dir)
     except Exception as e:
         logger.error(f"[TASK ID: {self.request.id}] Task failed spectacularly.", exc_info=True)
-        raise e
\ No newline at end of file
+        raise e
+
+    _cache_result(self.request.id, cache_key, result, time.perf_counter() - started_at)
+    _release(pdf_path, output_dir)
+    return result
+
+@celery_app.task(bind=True, base=AnalysisTask, name="analyze_pdf_shard_task")
+def analyze_pdf_shard_task(self, pdf_path: str, output_dir: str, start_page: int, end_page: int, parse_method: str | None = None,
+                           text_only: bool = False, first_page: int = 0, last_page: int | None = None, document_task_id: str | None = None):
+    logger.info(f"[TASK ID: {self.request.id}] Shard received for PDF: {pdf_path}, pages {start_page}-{end_page}")
+    try:
+        progress = _progress_tracker(self, announce=False)
+        progress.total_pages = end_page - start_page + 1
+        object_store.fetch(pdf_path)
+        shard_path, peak_rss_bytes = run_document(
+            analyze_pdf_pages, pdf_path, output_dir, start_page, end_page, progress=progress, parse_method=parse_method,
+            text_only=text_only, first_page=first_page, last_page=last_page
+        )
+        metrics.PEAK_RSS_BYTES.labels(task=self.name).observe(peak_rss_bytes)
+        # Other shards of the document may still be writing here, so the local copy is kept for the merge.
+        object_store.publish(output_dir)
+        return shard_path
+    except Exception as e:
+        logger.error(f"[TASK ID: {self.request.id}] Shard failed.", exc_info=True)
+        raise e
+
+@celery_app.task(bind=True, base=AnalysisTask, name="merge_pdf_shards_task")
+def merge_pdf_shards_task(self, shard_paths: list[str], pdf_path: str, output_dir: str, cache_key: str | None = None, submitted_at: float | None = None, outputs: list[str] = OUTPUT_KINDS):
+    logger.info(f"[TASK ID: {self.request.id}] Merging {len(shard_paths)} shards for PDF: {pdf_path}")
+    try:
+        object_store.fetch(pdf_path)
+        object_store.fetch(output_dir)
+        result, peak_rss_bytes = run_document(merge_pdf_shards, pdf_path, output_dir, shard_paths, outputs, progress=_progress_tracker(self))
+        result["peak_rss_bytes"] = peak_rss_bytes
+        object_store.delete(os.path.join(output_dir, SHARD_DIR_NAME))
+        object_store.publish(output_dir)
+    except Exception as e:
+        logger.error(f"[TASK ID: {self.request.id}] Merge failed.", exc_info=True)
+        raise e
+
+    _cache_result(self.request.id, cache_key, result, time.time() - (submitted_at or time.time()))
+    _release(pdf_path, output_dir)
+    return result
+
+@celery_app.task(bind=True, base=AnalysisTask, name="render_visualizations_task")
+def render_visualizations_task(self, pdf_path: str, output_dir: str, kinds: list[str]):
+    logger.info(f"[TASK ID: {self.request.id}] Rendering visual reports {kinds} for PDF: {pdf_path}")
+    try:
+        object_store.fetch(pdf_path)
+        object_store.fetch(output_dir)
+        result, peak_rss_bytes = run_document(render_visualizations, pdf_path, output_dir, kinds, progress=_progress_tracker(self))
+        result["peak_rss_bytes"] = peak_rss_bytes
+        object_store.publish(output_dir)
+    except Exception as e:
+        logger.error(f"[TASK ID: {self.request.id}] Rendering visual reports failed.", exc_info=True)
+        raise e
+
+    _release(pdf_path, output_dir)
+    return result
+
+@celery_app.task(
+    name="deliver_webhook_task",
+    autoretry_for=(OSError,),
+    retry_backoff=True,
+    retry_backoff_max=600,
+    max_retries=WEBHOOK_MAX_RETRIES
+)
+def deliver_webhook_task(url: str, payload: dict):
+    post_webhook(url, payload)
+
+@celery_app.task(name="collect_garbage_task")
+def collect_garbage_task():
+    summary = storage.collect_garbage(forget_task=lambda task_id: celery_app.AsyncResult(task_id).forget())
+    summary["stale_admissions"] = admission.prune()
+    return summary
@@ -0,0 +1,224 @@
+# A streaming ZIP writer that yields the archive chunk by chunk instead of building it in memory.
+
+# app/zipstream.py
+
+import os
+import json
+import time
+import zlib
+import struct
+import hashlib
+import zipfile
+from typing import Iterator
+from app.config import STORAGE_RETENTION_SECONDS
+from app.redis_client import get_redis
+
+CHUNK_SIZE = 64 * 1024
+ZIP64_LIMIT = (1 << 31) - 1
+LAYOUT_KEY_PREFIX = "mineru:zip_layout"
+
+# Members that are already compressed are stored as-is; deflating them only burns CPU.
+STORED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".zip", ".gz")
+STORED_SUFFIXES = ("_model.pdf", "_layout.pdf", "_spans.pdf")
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_RECORD = struct.Struct("<IHHHHIIH")
+_ZIP64_END_RECORD = struct.Struct("<IQHHIIQQQQ")
+_ZIP64_LOCATOR = struct.Struct("<IIQI")
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+
+def _dos_datetime(timestamp: float) -> tuple[int, int]:
+    t = time.localtime(max(timestamp, 315532800))  # the DOS epoch starts in 1980
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def is_precompressed(arcname: str) -> bool:
+    lowered = arcname.lower()
+    return lowered.endswith(STORED_EXTENSIONS) or lowered.endswith(STORED_SUFFIXES)
+
+
+def collect_members(output_dir: str, prefix: str) -> list[tuple[str, str]]:
+    """
+    Lists (file_path, arcname) pairs under `output_dir` in a stable order, so that the same
+    directory always produces the same archive bytes and byte ranges can be resumed.
+    """
+    members = []
+    for root, dirs, files in os.walk(output_dir):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            archive_path = os.path.relpath(file_path, output_dir)
+            members.append((file_path, os.path.join(prefix, archive_path).replace(os.sep, "/")))
+    return members
+
+
+def _layout_key(etag: str) -> str:
+    digest = etag.strip('"')
+    return f"{LAYOUT_KEY_PREFIX}:{digest}"
+
+
+def load_layout(etag: str) -> list[list[int]] | None:
+    raw = get_redis().get(_layout_key(etag))
+    return json.loads(raw) if raw else None
+
+
+def save_layout(etag: str, layout: list[list[int]] | None):
+    # Kept as long as the outputs it describes; a changed directory gets a different ETag anyway.
+    if layout is not None:
+        get_redis().set(_layout_key(etag), json.dumps(layout), ex=STORAGE_RETENTION_SECONDS)
+
+
+class ZipStream:
+    """
+    Writes a ZIP archive as an iterator of byte chunks. Sizes and CRCs go into data descriptors
+    after each member, so nothing but the current chunk is ever held in memory. ZIP64 records
+    are emitted automatically for large members, offsets or member counts.
+
+    `layout` holds the (crc, compressed size, size) of every member once a full pass has
+    computed them, or as saved by an earlier stream with the same `etag`. With it, `size()`
+    needs no compression and `iter_range()` skips the members before the range unread.
+    """
+
+    def __init__(self, members: list[tuple[str, str]], chunk_size: int = CHUNK_SIZE):
+        self.members = members
+        self.chunk_size = chunk_size
+        self.layout: list[list[int]] | None = None
+
+    @property
+    def etag(self) -> str:
+        digest = hashlib.sha1()
+        for file_path, arcname in self.members:
+            stat = os.stat(file_path)
+            digest.update(f"{arcname}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8"))
+        return f'"{digest.hexdigest()}"'
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self._generate(measure=False):
+            yield chunk
+
+    def size(self) -> int:
+        """
+        Returns the exact archive length. Without a layout, deflated members are compressed
+        once to measure them, their output is discarded, and the layout is kept.
+        """
+        return sum(len(chunk) if isinstance(chunk, bytes) else chunk for chunk in self._generate(measure=True))
+
+    def iter_range(self, start: int, end: int) -> Iterator[bytes]:
+        """
+        Yields bytes `start` to `end` (inclusive) of the archive.
+        """
+        position = 0
+        for chunk in self._generate(measure=False, skip_before=start):
+            chunk_length = chunk if isinstance(chunk, int) else len(chunk)
+            chunk_end = position + chunk_length
+            if chunk_end > start:
+                yield chunk[max(start - position, 0):end + 1 - position]
+            position = chunk_end
+            if position > end:
+                break
+
+    def _generate(self, measure: bool, skip_before: int = 0):
+        """
+        Yields the archive as byte chunks, or as the lengths of member data that need not be
+        produced: all of it when measuring, and data of laid out members that ends before
+        `skip_before`.
+        """
+        offset = 0
+        central_directory = []
+        layout = []
+
+        for index, (file_path, arcname) in enumerate(self.members):
+            stat = os.stat(file_path)
+            name = arcname.encode("utf-8")
+            method = zipfile.ZIP_STORED if is_precompressed(arcname) else zipfile.ZIP_DEFLATED
+            zip64 = stat.st_size >= ZIP64_LIMIT
+            dos_time, dos_date = _dos_datetime(stat.st_mtime)
+            flags = _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8
+            version = 45 if zip64 else 20
+
+            extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0) if zip64 else b""
+            local_header = _LOCAL_HEADER.pack(
+                0x04034B50, version, flags, method, dos_time, dos_date, 0,
+                0xFFFFFFFF if zip64 else 0, 0xFFFFFFFF if zip64 else 0, len(name), len(extra)
+            ) + name + extra
+            yield local_header
+
+            crc, compressed_size, file_size = 0, 0, 0
+            known = self.layout[index] if self.layout else None
+            if known and (measure or offset + len(local_header) + known[1] <= skip_before):
+                crc, compressed_size, file_size = known
+                yield compressed_size
+            elif measure and method == zipfile.ZIP_STORED:
+                file_size = compressed_size = stat.st_size
+                with open(file_path, "rb") as f:
+                    for data in iter(lambda: f.read(self.chunk_size), b""):
+                        crc = zlib.crc32(data, crc)
+                yield compressed_size
+            else:
+                compressor = zlib.compressobj(6, zlib.DEFLATED, -15) if method == zipfile.ZIP_DEFLATED else None
+                with open(file_path, "rb") as f:
+                    for data in iter(lambda: f.read(self.chunk_size), b""):
+                        file_size += len(data)
+                        crc = zlib.crc32(data, crc)
+                        if compressor:
+                            data = compressor.compress(data)
+                        if data:
+                            compressed_size += len(data)
+                            yield len(data) if measure else data
+                if compressor:
+                    data = compressor.flush()
+                    compressed_size += len(data)
+                    yield len(data) if measure else data
+
+            if zip64:
+                yield struct.pack("<IIQQ", 0x08074B50, crc, compressed_size, file_size)
+            else:
+                yield struct.pack("<IIII", 0x08074B50, crc, compressed_size, file_size)
+
+            layout.append([crc, compressed_size, file_size])
+            central_directory.append(
+                (name, method, flags, version, dos_time, dos_date, crc, compressed_size, file_size, offset)
+            )
+            offset += len(local_header) + compressed_size + (24 if zip64 else 16)
+
+        central_offset = offset
+        for name, method, flags, version, dos_time, dos_date, crc, compressed_size, file_size, header_offset in central_directory:
+            zip64_fields = []
+            if file_size >= 0xFFFFFFFF or compressed_size >= 0xFFFFFFFF or version == 45:
+                zip64_fields += [file_size, compressed_size]
+                file_size = compressed_size = 0xFFFFFFFF
+            if header_offset >= 0xFFFFFFFF:
+                zip64_fields.append(header_offset)
+                header_offset = 0xFFFFFFFF
+            extra = b""
+            if zip64_fields:
+                extra = struct.pack(f"<HH{len(zip64_fields)}Q", 0x0001, 8 * len(zip64_fields), *zip64_fields)
+                version = 45
+            record = _CENTRAL_HEADER.pack(
+                0x02014B50, (3 << 8) | version, version, flags, method, dos_time, dos_date, crc,
+                compressed_size, file_size, len(name), len(extra), 0, 0, 0, 0o100644 << 16, header_offset
+            ) + name + extra
+            offset += len(record)
+            yield record
+
+        self.layout = layout
+        count = len(central_directory)
+        central_size = offset - central_offset
+        if count >= 0xFFFF or central_offset >= 0xFFFFFFFF or central_size >= 0xFFFFFFFF:
+            yield _ZIP64_END_RECORD.pack(
+                0x06064B50, 44, 45, 45, 0, 0, count, count, central_size, central_offset
+            )
+            yield _ZIP64_LOCATOR.pack(0x07064B50, 0, offset, 1)
+            yield _END_RECORD.pack(
+                0x06054B50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                min(central_size, 0xFFFFFFFF), min(central_offset, 0xFFFFFFFF), 0
+            )
+        else:
+            yield _END_RECORD.pack(0x06054B50, 0, 0, count, count, central_size, central_offset, 0)
+
@@ -9,14 +9,37 @@ import csv
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
-def check_and_download(base_url: str, task_id: str, download_dir: str) -> dict:
+def fetch_statuses(base_url: str, task_ids: list, chunk_size: int = 1000) -> dict:
+    """
+    Looks up the status of many tasks with the bulk status endpoint.
+
+    Args:
+        base_url: The base URL of the API service.
+        task_ids: The IDs of the tasks to look up.
+        chunk_size: How many task IDs are sent per request.
+
+    Returns:
+        A dictionary mapping each task ID to its status.
+    """
+    bulk_url = f"{base_url.rstrip('/')}/tasks/status"
+    statuses = {}
+    for start in range(0, len(task_ids), chunk_size):
+        response = requests.post(bulk_url, json={"task_ids": task_ids[start:start + chunk_size]}, timeout=30)
+        response.raise_for_status()
+        statuses.update({task["task_id"]: task["status"] for task in response.json()["tasks"]})
+    return statuses
+
+def check_and_download(base_url: str, task_id: str, download_dir: str, retries: int = 3, status: str | None = None) -> dict:
     """
     Checks the status of a task, and if successful, downloads the result.
+    Interrupted downloads are kept as a partial file and resumed with an HTTP Range request.
 
     Args:
         base_url: The base URL of the API service.
         task_id: The ID of the task to check and download.
         download_dir: The local directory to save the downloaded file.
+        retries: How many times an interrupted download is resumed before giving up.
+        status: The task status if it is already known; otherwise it is fetched first.
 
     Returns:
         A dictionary summarizing the outcome for this task.
@@ -25,32 +48,62 @@ def check_and_download(base_url: str, task_id: str, download_dir: str) -> dict:
     download_url = f"{base_url.rstrip('/')}/tasks/result/download/{task_id}"
     
     try:
-        # Step 1: Check status first
-        response = requests.get(status_url, timeout=10)
-        response.raise_for_status()
-        status = response.json().get("status")
+        # Step 1: Check status first, unless the bulk lookup already did
+        if status is None:
+            response = requests.get(status_url, timeout=10)
+            response.raise_for_status()
+            status = response.json().get("status")
 
         if status != "SUCCESS":
             return {"task_id": task_id, "status": status, "file": None, "error": f"Task not successful (status: {status})."}
 
-        # Step 2: If successful, proceed to download
-        with requests.get(download_url, stream=True, timeout=180) as r_download:
-            r_download.raise_for_status()
-            
-            content_disp = r_download.headers.get("content-disposition")
-            if content_disp and 'filename=' in content_disp:
-                filename = content_disp.split('filename=')[1].strip('"')
-            else:
-                filename = f"task_{task_id}_results.zip"
-            
-            local_filepath = os.path.join(download_dir, filename)
-            os.makedirs(download_dir, exist_ok=True)
-
-            with open(local_filepath, 'wb') as f:
-                for chunk in r_download.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            return {"task_id": task_id, "status": "DOWNLOADED", "file": local_filepath, "error": None}
+        # Step 2: If successful, proceed to download, resuming any interrupted attempt
+        os.makedirs(download_dir, exist_ok=True)
+        part_path = os.path.join(download_dir, f".{task_id}.zip.part")
+        etag_path = f"{part_path}.etag"
+
+        for attempt in range(retries + 1):
+            headers = {}
+            if os.path.exists(part_path) and os.path.exists(etag_path):
+                with open(etag_path, 'r', encoding='utf-8') as f:
+                    headers = {"Range": f"bytes={os.path.getsize(part_path)}-", "If-Range": f.read()}
+
+            try:
+                with requests.get(download_url, headers=headers, stream=True, timeout=180) as r_download:
+                    if r_download.status_code == 416:
+                        # The partial file is already complete or no longer matches; start over.
+                        os.remove(part_path)
+                        continue
+                    r_download.raise_for_status()
+
+                    content_disp = r_download.headers.get("content-disposition")
+                    if content_disp and 'filename=' in content_disp:
+                        filename = content_disp.split('filename=')[1].strip('"')
+                    else:
+                        filename = f"task_{task_id}_results.zip"
+
+                    if r_download.headers.get("etag"):
+                        with open(etag_path, 'w', encoding='utf-8') as f:
+                            f.write(r_download.headers["etag"])
+
+                    mode = 'ab' if r_download.status_code == 206 else 'wb'
+                    with open(part_path, mode) as f:
+                        for chunk in r_download.iter_content(chunk_size=8192):
+                            f.write(chunk)
+                break
+            except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == retries:
+                    raise
+                time.sleep(2 ** attempt)
+        else:
+            return {"task_id": task_id, "status": "ERROR", "file": None, "error": "Download could not be resumed."}
+
+        local_filepath = os.path.join(download_dir, filename)
+        os.replace(part_path, local_filepath)
+        if os.path.exists(etag_path):
+            os.remove(etag_path)
+
+        return {"task_id": task_id, "status": "DOWNLOADED", "file": local_filepath, "error": None}
 
     except requests.exceptions.RequestException as e:
         return {"task_id": task_id, "status": "ERROR", "file": None, "error": f"Network error: {e}"}
@@ -84,6 +137,12 @@ def main():
         default=5,
         help="Number of concurrent download workers (threads)."
     )
+    parser.add_argument(
+        "-r", "--retries",
+        type=int,
+        default=3,
+        help="How many times an interrupted download is resumed before giving up."
+    )
     args = parser.parse_args()
 
     if not os.path.isfile(args.csv_file):
@@ -103,9 +162,15 @@ def main():
 
     print(f"Found {len(tasks_to_process)} submitted tasks. Starting download process with {args.workers} workers...")
     
+    try:
+        statuses = fetch_statuses(args.url, tasks_to_process)
+    except requests.exceptions.RequestException as e:
+        print(f"Bulk status lookup failed ({e}); checking tasks one by one.")
+        statuses = {}
+
     results = []
     with ThreadPoolExecutor(max_workers=args.workers) as executor:
-        future_to_task = {executor.submit(check_and_download, args.url, task_id, args.download_dir): task_id for task_id in tasks_to_process}
+        future_to_task = {executor.submit(check_and_download, args.url, task_id, args.download_dir, args.retries, statuses.get(task_id)): task_id for task_id in tasks_to_process}
         
         for future in tqdm(as_completed(future_to_task), total=len(tasks_to_process), desc="Downloading Results"):
             result = future.result()
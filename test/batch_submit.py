@@ -2,28 +2,91 @@
 # A client script for efficiently submitting a large batch of PDFs for processing.
 
 import os
+import time
 import requests
 import argparse
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import csv
 
-def submit_pdf_task(api_url: str, pdf_path: str) -> dict:
+# Statuses with which the service asks clients to come back after Retry-After seconds
+RETRY_LATER_STATUSES = (429, 503)
+DEFAULT_RETRY_AFTER = 30
+
+class Backoff:
+    """
+    Shared by all submission threads: once the service answers 429 or 503, none of them sends
+    another request until the Retry-After it gave has passed.
+    """
+
+    def __init__(self):
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self._resume_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def defer(self, response: requests.Response):
+        try:
+            seconds = int(response.headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+        except ValueError:
+            seconds = DEFAULT_RETRY_AFTER
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.time() + seconds)
+
+def post_with_backoff(url: str, open_files, backoff: Backoff, max_retries: int, headers: dict | None = None, timeout: int = 30) -> requests.Response:
+    """
+    POSTs the files returned by `open_files` (called again for every attempt, so the uploads are
+    read from the start), retrying after the server's Retry-After while it turns the request away.
+
+    Args:
+        url: The URL to post to.
+        open_files: A callable returning the `files` argument for requests and the opened file handles.
+        backoff: The backoff shared with the other submission threads.
+        max_retries: How often a turned-away request is retried before its response is returned.
+        headers: Extra request headers.
+        timeout: The request timeout in seconds.
+
+    Returns:
+        The last response.
+    """
+    for attempt in range(max_retries + 1):
+        backoff.wait()
+        files, handles = open_files()
+        try:
+            response = requests.post(url, files=files, headers=headers, timeout=timeout)
+        finally:
+            for f in handles:
+                f.close()
+        if response.status_code not in RETRY_LATER_STATUSES or attempt == max_retries:
+            return response
+        backoff.defer(response)
+
+def submit_pdf_task(api_url: str, pdf_path: str, backoff: Backoff | None = None, max_retries: int = 0, headers: dict | None = None) -> dict:
     """
     Submits a single PDF file to the processing service.
 
     Args:
         api_url: The URL of the API endpoint for processing PDFs.
         pdf_path: The local path to the PDF file.
+        backoff: The backoff shared with the other submission threads.
+        max_retries: How often to retry when the service asks to come back later.
+        headers: Extra request headers, e.g. the client id.
 
     Returns:
         A dictionary containing the submission result.
     """
     file_name = os.path.basename(pdf_path)
+
+    def open_files():
+        f = open(pdf_path, 'rb')
+        return {'file': (file_name, f, 'application/pdf')}, [f]
+
     try:
-        with open(pdf_path, 'rb') as f:
-            files = {'file': (file_name, f, 'application/pdf')}
-            response = requests.post(api_url, files=files, timeout=30)
+        response = post_with_backoff(api_url, open_files, backoff or Backoff(), max_retries, headers)
 
         if response.status_code == 202:
             return {
@@ -54,6 +117,42 @@ def submit_pdf_task(api_url: str, pdf_path: str) -> dict:
             "error": f"An unexpected error occurred: {e}"
         }
 
+def submit_pdf_batch(batch_url: str, pdf_paths: list, backoff: Backoff | None = None, max_retries: int = 0, headers: dict | None = None) -> list:
+    """
+    Submits many PDF files in a single request to the batch endpoint.
+
+    Args:
+        batch_url: The URL of the API endpoint for batch submissions.
+        pdf_paths: The local paths of the PDF files in this batch.
+        backoff: The backoff shared with the other submission threads.
+        max_retries: How often to retry when the service asks to come back later.
+        headers: Extra request headers, e.g. the client id.
+
+    Returns:
+        A list of submission results, one per file.
+    """
+    file_names = [os.path.basename(p) for p in pdf_paths]
+
+    def open_files():
+        handles = [open(p, 'rb') for p in pdf_paths]
+        return [('files', (name, f, 'application/pdf')) for name, f in zip(file_names, handles)], handles
+
+    try:
+        response = post_with_backoff(batch_url, open_files, backoff or Backoff(), max_retries, headers, timeout=600)
+        if response.status_code != 202:
+            error = f"API Error: Status {response.status_code} - {response.text}"
+            return [{"filename": name, "status": "failed", "task_id": None, "batch_id": None, "error": error} for name in file_names]
+
+        batch = response.json()
+        status = requests.get(f"{batch_url.rstrip('/')}/{batch['batch_id']}", timeout=60)
+        status.raise_for_status()
+        return [
+            {"filename": task["filename"], "status": "submitted", "task_id": task["task_id"], "batch_id": batch["batch_id"], "error": None}
+            for task in status.json()["tasks"]
+        ]
+    except requests.exceptions.RequestException as e:
+        return [{"filename": name, "status": "failed", "task_id": None, "batch_id": None, "error": f"Network Error: {e}"} for name in file_names]
+
 def main():
     """
     Main function to find PDFs in a directory and submit them concurrently.
@@ -62,6 +161,10 @@ def main():
     parser.add_argument("-d", "--directory", required=True, help="The directory containing PDF files to submit.")
     parser.add_argument("-u", "--url", default="http://localhost:8001/process-pdf/", help="The API endpoint URL.")
     parser.add_argument("-w", "--workers", type=int, default=5, help="Number of concurrent submission workers (threads).")
+    parser.add_argument("-b", "--batch-size", type=int, default=0, help="Upload this many PDFs per request through the batch endpoint (0 submits one request per file).")
+    parser.add_argument("--batch-url", default="http://localhost:8001/batches/", help="The batch API endpoint URL.")
+    parser.add_argument("--max-retries", type=int, default=20, help="How often to retry a submission the service turns away with 429/503, waiting for its Retry-After each time.")
+    parser.add_argument("--client-id", default=None, help="Client id sent in the X-Client-Id header, which per-client quotas are counted against.")
     args = parser.parse_args()
 
     if not os.path.isdir(args.directory):
@@ -76,13 +179,22 @@ def main():
 
     print(f"Found {len(pdf_files)} PDF files. Starting submission with {args.workers} concurrent workers...")
 
+    backoff = Backoff()
+    headers = {"X-Client-Id": args.client_id} if args.client_id else None
     results = []
-    with ThreadPoolExecutor(max_workers=args.workers) as executor:
-        future_to_pdf = {executor.submit(submit_pdf_task, args.url, pdf_path): pdf_path for pdf_path in pdf_files}
-        
-        for future in tqdm(as_completed(future_to_pdf), total=len(pdf_files), desc="Submitting PDFs"):
-            result = future.result()
-            results.append(result)
+    if args.batch_size > 0:
+        batches = [pdf_files[i:i + args.batch_size] for i in range(0, len(pdf_files), args.batch_size)]
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(submit_pdf_batch, args.batch_url, batch, backoff, args.max_retries, headers) for batch in batches]
+            for future in tqdm(as_completed(futures), total=len(batches), desc="Submitting batches"):
+                results.extend(future.result())
+    else:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            future_to_pdf = {executor.submit(submit_pdf_task, args.url, pdf_path, backoff, args.max_retries, headers): pdf_path for pdf_path in pdf_files}
+            
+            for future in tqdm(as_completed(future_to_pdf), total=len(pdf_files), desc="Submitting PDFs"):
+                result = future.result()
+                results.append(result)
 
     print("\nSubmission summary:")
     successful_submissions = [r for r in results if r['status'] == 'submitted']
@@ -99,8 +211,8 @@ def main():
     log_file = "submission_log.csv"
     print(f"\nSaving detailed submission log to '{log_file}'...")
     with open(log_file, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['filename', 'status', 'task_id', 'error']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        fieldnames = ['filename', 'status', 'task_id', 'batch_id', 'error']
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, restval='')
         writer.writeheader()
         writer.writerows(results)
     
@@ -0,0 +1,348 @@
+# benchmark.py
+# An offline benchmark of the whole service: synthetic PDFs are submitted through the API,
+# processed by an in-process Celery worker with a stubbed doc_analyze, and downloaded again.
+# Needs the service dependencies plus `fakeredis`; no Redis, GPU or model weights are required.
+# With --s3, uploads and outputs go through the S3 backend, served by moto unless S3_ENDPOINT_URL is set.
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import urllib.request
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import fitz
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run an offline end-to-end benchmark and write the results as JSON.")
+    parser.add_argument("-n", "--documents", type=int, default=20, help="Number of synthetic PDFs to submit (default: 20).")
+    parser.add_argument("--min-pages", type=int, default=1, help="Minimum pages per document (default: 1).")
+    parser.add_argument("--max-pages", type=int, default=30, help="Maximum pages per document (default: 30).")
+    parser.add_argument("--scanned-ratio", type=float, default=0.3, help="Share of documents made of image-only pages (default: 0.3).")
+    parser.add_argument("--inference-ms-per-page", type=float, default=20.0, help="Simulated doc_analyze time per page in ms (default: 20).")
+    parser.add_argument("--inference-overhead-ms", type=float, default=0.0, help="Simulated fixed cost of every doc_analyze or batch call in ms (default: 0).")
+    parser.add_argument("--single-device", action="store_true", help="Run simulated inference calls one at a time, as on one shared GPU.")
+    parser.add_argument("-c", "--concurrency", type=int, default=2, help="Worker threads of the in-process Celery worker (default: 2).")
+    parser.add_argument("--micro-batch-size", type=int, default=0, help="Batch up to this many small documents per inference call (MICRO_BATCH_SIZE; needs -c at least as large).")
+    parser.add_argument("--prefetch-multiplier", type=int, default=None,
+                        help="Tasks each worker thread reserves ahead (WORKER_PREFETCH_MULTIPLIER). The in-memory broker refills "
+                             "reservations only every 2s, so raise this when comparing micro-batching.")
+    parser.add_argument("--micro-batch-wait-ms", type=int, default=50, help="How long a batch waits to fill up (MICRO_BATCH_WAIT_MS, default: 50).")
+    parser.add_argument("--outputs", default=None, help="Comma-separated outputs to request. Defaults to the server setting.")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the synthetic corpus (default: 42).")
+    parser.add_argument("--redis-url", default=None, help="Use this Redis instead of the in-memory fakeredis stand-in.")
+    parser.add_argument("--s3", action="store_true", help="Store uploads and outputs in S3 (moto, or the store at S3_ENDPOINT_URL).")
+    parser.add_argument("--workdir", default=None, help="Directory for the corpus, uploads and outputs. Defaults to a temp dir.")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="Where to write the JSON results (default: benchmark_results.json).")
+    return parser.parse_args()
+
+
+def summarize(values: list[float]) -> dict:
+    """
+    Returns count, mean and the usual percentiles of `values`.
+    """
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def percentile(p: float) -> float:
+        return ordered[min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": ordered[-1],
+    }
+
+
+def generate_corpus(directory: str, args) -> list[dict]:
+    """
+    Writes `args.documents` PDFs with a seeded mix of text pages and image-only (scan-like) pages.
+    """
+    rng = random.Random(args.seed)
+    scan = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 850, 1100), False)
+    scan.clear_with(235)
+    corpus = []
+    for index in range(args.documents):
+        pages = rng.randint(args.min_pages, args.max_pages)
+        scanned = rng.random() < args.scanned_ratio
+        doc = fitz.open()
+        for page_no in range(pages):
+            page = doc.new_page()
+            if scanned:
+                page.insert_image(page.rect, pixmap=scan)
+            else:
+                words = " ".join(rng.choice(("alpha", "beta", "gamma", "delta", "sigma", "omega")) for _ in range(400))
+                page.insert_textbox(fitz.Rect(50, 50, 545, 790), f"Document {index} page {page_no}\n{words}", fontsize=10)
+        path = os.path.join(directory, f"bench_{index:04d}.pdf")
+        doc.save(path)
+        doc.close()
+        corpus.append({"path": path, "pages": pages, "scanned": scanned, "size_bytes": os.path.getsize(path)})
+    return corpus
+
+
+class RssSampler:
+    """
+    Samples the resident memory of this process in the background and keeps the peak per phase.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        from app.model_warmup import current_rss_bytes
+        self._rss = current_rss_bytes
+        self.interval = interval
+        self.phase = "startup"
+        self.peaks: dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = self._rss()
+            self.peaks[self.phase] = max(self.peaks.get(self.phase, 0), rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def install_stand_ins(args):
+    """
+    Points the service at in-memory infrastructure before any app module is imported, and
+    replaces model inference with a stub that sleeps `--inference-ms-per-page` per page.
+    """
+    workdir = args.workdir
+    os.environ.setdefault("CACHE_ENABLED", "false")
+    os.environ.setdefault("WARMUP_ENABLED", "false")
+    os.environ["INPUT_DIR"] = os.path.join(workdir, "input")
+    os.environ["OUTPUT_DIR"] = os.path.join(workdir, "output")
+    os.environ["MICRO_BATCH_SIZE"] = str(args.micro_batch_size)
+    os.environ["MICRO_BATCH_WAIT_MS"] = str(args.micro_batch_wait_ms)
+    if args.prefetch_multiplier:
+        os.environ["WORKER_PREFETCH_MULTIPLIER"] = str(args.prefetch_multiplier)
+
+    if args.s3:
+        os.environ["STORAGE_BACKEND"] = "s3"
+        if not os.getenv("S3_ENDPOINT_URL"):
+            try:
+                from moto.server import ThreadedMotoServer
+            except ImportError:
+                sys.exit("moto is required for --s3 without S3_ENDPOINT_URL (pip install 'moto[server]').")
+            s3_server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+            s3_server.start()
+            logging.getLogger("werkzeug").setLevel(logging.WARNING)
+            os.environ["S3_ENDPOINT_URL"] = "http://%s:%d" % s3_server.get_host_and_port()
+            for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+                os.environ.setdefault(name, "testing")
+            os.environ.setdefault("S3_REGION", "us-east-1")
+
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+    else:
+        try:
+            import fakeredis
+        except ImportError:
+            sys.exit("fakeredis is required for the offline benchmark (pip install fakeredis), or pass --redis-url.")
+        import redis
+        server = fakeredis.FakeServer()
+        redis.Redis.from_url = classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+        import redis.asyncio
+        redis.asyncio.from_url = lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs)
+
+    import app.logging_config
+    app.logging_config.setup_logging = lambda: None
+
+    from app.worker import celery_app
+    # The in-memory transport polls for messages; the default 1s interval would dominate queue wait.
+    celery_app.conf.update(broker_url="memory://", result_backend="cache+memory://", broker_transport_options={"polling_interval": 0.01})
+
+    import app.main as main
+
+    import app.process_pdf as process_pdf
+    import app.batching as batching
+    from magic_pdf.operators.models import InferenceResult
+    seconds_per_page = args.inference_ms_per_page / 1000
+    overhead_seconds = args.inference_overhead_ms / 1000
+    device = threading.Lock() if args.single_device else None
+
+    def empty_model_list(dataset) -> list:
+        model_list = []
+        with fitz.open("pdf", dataset.data_bits()) as doc:
+            for page_no, page in enumerate(doc):
+                # doc_analyze reports page sizes of the 200 dpi render it runs the models on.
+                page_info = {"page_no": page_no, "width": int(page.rect.width * 200 / 72), "height": int(page.rect.height * 200 / 72)}
+                model_list.append({"layout_dets": [], "page_info": page_info})
+        return model_list
+
+    def infer(pages: int):
+        if device is None:
+            time.sleep(overhead_seconds + seconds_per_page * pages)
+            return
+        with device:
+            time.sleep(overhead_seconds + seconds_per_page * pages)
+
+    def stub_doc_analyze(dataset, ocr=False, show_log=False, start_page_id=0, end_page_id=None, **kwargs):
+        end_page_id = len(dataset) - 1 if end_page_id is None else end_page_id
+        model_list = empty_model_list(dataset)
+        infer(max(end_page_id - start_page_id + 1, 0))
+        return InferenceResult(model_list, dataset)
+
+    def stub_batch_doc_analyze(datasets, parse_method="auto", show_log=False, **kwargs):
+        model_lists = [empty_model_list(dataset) for dataset in datasets]
+        infer(sum(len(dataset) for dataset in datasets))
+        return [InferenceResult(model_list, dataset) for model_list, dataset in zip(model_lists, datasets)]
+
+    process_pdf.doc_analyze = stub_doc_analyze
+    batching.batch_doc_analyze = stub_batch_doc_analyze
+    return main, celery_app
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return None
+
+
+def run(args) -> dict:
+    args.workdir = args.workdir or tempfile.mkdtemp(prefix="mineru_bench_")
+    corpus_dir = os.path.join(args.workdir, "corpus")
+    os.makedirs(corpus_dir, exist_ok=True)
+    corpus = generate_corpus(corpus_dir, args)
+
+    main, celery_app = install_stand_ins(args)
+    from celery.signals import task_prerun
+    from celery.contrib.testing.worker import start_worker
+    from fastapi.testclient import TestClient
+    from app.scheduling import analysis_queues
+
+    queue_waits: list[float] = []
+
+    @task_prerun.connect(weak=False)
+    def measure_queue_wait(task=None, **kwargs):
+        submitted_at = task.request.get("submitted_at") if task is not None else None
+        if submitted_at and task.name != "deliver_webhook_task":
+            queue_waits.append(time.time() - submitted_at)
+
+    client = TestClient(main.app)
+    submissions, submit_latencies = [], []
+    form = {"outputs": args.outputs} if args.outputs else {}
+
+    with RssSampler() as sampler:
+        with start_worker(
+            celery_app, pool="threads", concurrency=args.concurrency, perform_ping_check=False,
+            queues=analysis_queues(), loglevel="WARNING", shutdown_timeout=60
+        ):
+            sampler.phase = "processing"
+            started_at = time.perf_counter()
+            for document in corpus:
+                with open(document["path"], "rb") as f:
+                    submit_started = time.perf_counter()
+                    response = client.post("/process-pdf/", files={"file": (os.path.basename(document["path"]), f, "application/pdf")}, data=form)
+                    submit_latencies.append(time.perf_counter() - submit_started)
+                response.raise_for_status()
+                submissions.append({**document, "task_id": response.json()["task_id"], "submitted_at": time.perf_counter()})
+
+            results, end_to_end = {}, []
+            while len(results) < len(submissions):
+                for submission in submissions:
+                    if submission["task_id"] in results:
+                        continue
+                    status = client.get(f"/tasks/status/{submission['task_id']}").json()
+                    if status["status"] in ("SUCCESS", "FAILURE"):
+                        results[submission["task_id"]] = status
+                        end_to_end.append(time.perf_counter() - submission["submitted_at"])
+                time.sleep(0.02)
+            processing_seconds = time.perf_counter() - started_at
+
+        sampler.phase = "download"
+        download_bytes, download_seconds = 0, 0.0
+        for submission in submissions:
+            if results[submission["task_id"]]["status"] != "SUCCESS":
+                continue
+            download_started = time.perf_counter()
+            with client.stream("GET", f"/tasks/result/download/{submission['task_id']}", follow_redirects=False) as response:
+                if response.status_code == 307:
+                    # A presigned URL of the object store, which the test client cannot reach.
+                    with urllib.request.urlopen(response.headers["Location"]) as presigned:
+                        for chunk in iter(lambda: presigned.read(64 * 1024), b""):
+                            download_bytes += len(chunk)
+                else:
+                    response.raise_for_status()
+                    for chunk in response.iter_bytes():
+                        download_bytes += len(chunk)
+            download_seconds += time.perf_counter() - download_started
+
+    succeeded = [status["result"] for status in results.values() if status["status"] == "SUCCESS"]
+    stage_values: dict[str, list[float]] = {}
+    for result in succeeded:
+        for stage, seconds in result.get("stage_seconds", {}).items():
+            stage_values.setdefault(stage, []).append(seconds)
+    total_pages = sum(submission["pages"] for submission in submissions)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "workdir")},
+        "corpus": {
+            "documents": len(corpus),
+            "pages": total_pages,
+            "scanned_documents": sum(1 for document in corpus if document["scanned"]),
+            "bytes": sum(document["size_bytes"] for document in corpus),
+        },
+        "tasks": {"succeeded": len(succeeded), "failed": len(results) - len(succeeded)},
+        "submit_latency_seconds": summarize(submit_latencies),
+        "queue_wait_seconds": summarize(queue_waits),
+        "end_to_end_seconds": summarize(end_to_end),
+        "stage_seconds": {stage: summarize(values) for stage, values in sorted(stage_values.items())},
+        "throughput": {
+            "processing_seconds": processing_seconds,
+            "documents_per_second": len(succeeded) / processing_seconds if processing_seconds else 0.0,
+            "pages_per_second": total_pages / processing_seconds if processing_seconds else 0.0,
+        },
+        "download": {
+            "bytes": download_bytes,
+            "seconds": download_seconds,
+            "megabytes_per_second": download_bytes / download_seconds / 1e6 if download_seconds else 0.0,
+        },
+        "memory": {f"peak_rss_bytes_{phase}": peak for phase, peak in sampler.peaks.items()},
+    }
+
+
+def main():
+    args = parse_args()
+    results = run(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"Processed {results['tasks']['succeeded']}/{results['corpus']['documents']} documents "
+          f"({results['corpus']['pages']} pages) in {results['throughput']['processing_seconds']:.2f}s "
+          f"-> {results['throughput']['pages_per_second']:.1f} pages/s")
+    print(f"Submit latency p95: {results['submit_latency_seconds'].get('p95', 0) * 1000:.1f} ms, "
+          f"queue wait p95: {results['queue_wait_seconds'].get('p95', 0):.3f} s, "
+          f"download: {results['download']['megabytes_per_second']:.1f} MB/s")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()